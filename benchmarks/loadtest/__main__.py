@@ -0,0 +1,111 @@
+"""
+Offline load test of the API, for capacity planning of the gunicorn settings.
+
+Starts the Audiveris and S3 stand-ins and gunicorn (configured by gunicorn.conf.py and the flags below)
+on this machine, seeds a converted score and its recording, then drives a mix of requests at the target rate
+and reports throughput, latency percentiles and error rates per scenario. Run from the repository root:
+
+    python -m benchmarks.loadtest --rate 200 --duration 60 --workers 8 --worker-class gevent
+    python -m benchmarks.loadtest --mix score_status=90,download_wav=10 --rate 1000
+
+Pass --api-url to drive an API that is already running (and already pointed at the stand-ins or at real services).
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import requests
+
+from .driver import DEFAULT_MIX, MXL_PATH, REPO_ROOT, SCENARIOS, Client, format_summary, run_load, summarize
+from .fake_audiveris import serve_audiveris
+from .fake_s3 import serve_s3
+
+def parse_mix(text: str) -> dict[str, float]:
+    mix = {}
+    for item in text.split(","):
+        scenario, _, weight = item.partition("=")
+        if scenario not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"Unknown scenario {scenario}, expected one of {', '.join(SCENARIOS)}")
+        mix[scenario] = float(weight)
+    return mix
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_api(args: argparse.Namespace, audiveris_url: str, s3_url: str, config_dir: Path) -> tuple[subprocess.Popen, str]:
+    """Runs gunicorn against the stand-ins, with a throwaway AWS profile so no real credentials are picked up"""
+    (config_dir / "config").write_text("[profile loadtest]\nregion = us-east-1\n")
+    (config_dir / "credentials").write_text("[loadtest]\naws_access_key_id = loadtest\naws_secret_access_key = loadtest\n")
+    port = free_port()
+    env = dict(
+        os.environ,
+        AUDIVERIS_API_URL=audiveris_url, AWS_BUCKET="loadtest", AWS_ENDPOINT_URL=s3_url, AWS_PROFILE="loadtest",
+        AWS_CONFIG_FILE=str(config_dir / "config"), AWS_SHARED_CREDENTIALS_FILE=str(config_dir / "credentials"),
+        API_URL=f"http://127.0.0.1:{port}", GUNICORN_BIND=f"127.0.0.1:{port}", GUNICORN_WORKERS=str(args.workers),
+        GUNICORN_WORKER_CLASS=args.worker_class, GUNICORN_WORKER_CONNECTIONS=str(args.worker_connections),
+    )
+    api = subprocess.Popen([sys.executable, "-m", "gunicorn", "--config", "gunicorn.conf.py", "src.api.main:app"],
+                           cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL if args.quiet else None, stderr=subprocess.DEVNULL if args.quiet else None)
+    api_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while True:
+        try:
+            if requests.get(f"{api_url}/app-health", timeout=1).ok:
+                return api, api_url
+        except requests.RequestException:
+            pass
+        if api.poll() is not None or time.monotonic() > deadline:
+            raise RuntimeError("gunicorn did not come up")
+        time.sleep(0.5)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=50, help="requests per second")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of load")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="scenario=weight,... out of " + ", ".join(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=1000, help="most requests in flight at once")
+    parser.add_argument("--time-budget", type=float, default=None, help="time_budget sent with every analysis")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--worker-class", default="gevent")
+    parser.add_argument("--worker-connections", type=int, default=1000)
+    parser.add_argument("--audiveris-latency", type=float, default=0.05, help="seconds per Audiveris request")
+    parser.add_argument("--conversion-time", type=float, default=5, help="seconds until an uploaded pdf is converted")
+    parser.add_argument("--s3-latency", type=float, default=0.02, help="seconds per S3 request")
+    parser.add_argument("--api-url", default=None, help="drive this API instead of starting one")
+    parser.add_argument("--json", type=Path, default=None, help="also write the summary to this file")
+    parser.add_argument("--quiet", action="store_true", help="hide gunicorn's output")
+    args = parser.parse_args()
+
+    audiveris = serve_audiveris(MXL_PATH, latency=args.audiveris_latency, conversion_time=args.conversion_time)
+    s3 = serve_s3(latency=args.s3_latency)
+    api = None
+    with tempfile.TemporaryDirectory(prefix="warbler-loadtest-") as config_dir:
+        try:
+            api_url = args.api_url
+            if api_url is None:
+                api, api_url = start_api(args, f"http://127.0.0.1:{audiveris.server_address[1]}", f"http://127.0.0.1:{s3.server_address[1]}", Path(config_dir))
+
+            client = Client(api_url, time_budget=args.time_budget)
+            client.seed(conversion_timeout=args.conversion_time + 60)
+            print(f"Driving {api_url} at {args.rate:g} requests/s for {args.duration:g}s", file=sys.stderr)
+            samples = run_load(client, args.mix, args.rate, args.duration, args.concurrency)
+            summary = summarize(samples, args.duration)
+        finally:
+            if api is not None:
+                api.terminate()
+                api.wait()
+
+    print(format_summary(summary))
+    if args.json is not None:
+        args.json.write_text(json.dumps({"settings": {key: str(value) for key, value in vars(args).items()}, "summary": summary}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Open-loop load generation against the API.
+
+Requests arrive as a Poisson process at the target rate, independent of how fast the API answers,
+and each one is timed from its scheduled arrival, so a saturated API shows up as growing latency
+instead of a silently lower request rate.
+"""
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+import requests
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+PDF_PATH = REPO_ROOT / "src" / "api" / "tests" / "test_materials" / "mozart.pdf"
+WAV_PATH = REPO_ROOT / "src" / "pitch" / "test_files" / "test7.wav"
+MXL_PATH = REPO_ROOT / "src" / "pitch" / "test_files" / "test7.mxl"
+"""the fake Audiveris converts every pdf into this score, which WAV_PATH is a performance of"""
+
+DEFAULT_MIX: dict[str, float] = {
+    "score_status": 50, "download_wav": 12, "download_mxl": 10,
+    "upload_pdf": 5, "upload_wav": 10, "analyze": 3,
+}
+"""relative frequency of each scenario, roughly a client polling the status while a few performances are recorded and analyzed"""
+
+@dataclass(slots=True)
+class Sample:
+    scenario: str
+    latency: float
+    """seconds from the scheduled arrival to the end of the response"""
+    status: int | None
+    """HTTP status code, None if the request failed without a response"""
+
+    @property
+    def ok(self) -> bool:
+        return self.status is not None and self.status < 400
+
+class Client:
+    """The scenarios, sharing the ids of uploaded scores and recordings"""
+
+    def __init__(self, api_url: str, time_budget: float | None = None):
+        self.api_url = api_url.rstrip("/")
+        self.time_budget = time_budget
+        self.local = threading.local()
+        self.pdf, self.wav = PDF_PATH.read_bytes(), WAV_PATH.read_bytes()
+        self.lock = threading.Lock()
+        self.score_ids: list[str] = []
+        self.wav_ids: list[str] = []
+        self.analysis_pair: tuple[str, str] | None = None
+        """(wav id, score id) of a recording and a converted score that belong together"""
+
+    @property
+    def session(self) -> requests.Session:
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def pick(self, ids: list[str]) -> str:
+        with self.lock:
+            return random.choice(ids)
+
+    def upload_pdf(self, unique: bool = True) -> requests.Response:
+        # unique uploads defeat the pdf deduplication, like real users uploading different scores
+        data = self.pdf + os.urandom(16) if unique else self.pdf
+        r = self.session.post(f"{self.api_url}/upload/pdf", files={"file": ("score.pdf", data, "application/pdf")})
+        if r.ok:
+            with self.lock:
+                self.score_ids.append(r.json()["id"])
+        return r
+
+    def upload_wav(self, unique: bool = True) -> requests.Response:
+        data = self.wav + os.urandom(16) if unique else self.wav
+        r = self.session.post(f"{self.api_url}/upload/wav", files={"file": ("performance.wav", data, "audio/wav")})
+        if r.ok:
+            with self.lock:
+                self.wav_ids.append(r.json()["id"])
+        return r
+
+    def score_status(self) -> requests.Response:
+        return self.session.get(f"{self.api_url}/score-status", params={"id": self.pick(self.score_ids)})
+
+    def download_wav(self) -> requests.Response:
+        return self.session.get(f"{self.api_url}/download/wav", params={"id": self.pick(self.wav_ids)})
+
+    def download_mxl(self) -> requests.Response:
+        return self.session.get(f"{self.api_url}/download/mxl", params={"id": self.analysis_pair[1]})
+
+    def analyze(self) -> requests.Response:
+        body = {"id_wav": self.analysis_pair[0], "id_mxl": self.analysis_pair[1]}
+        if self.time_budget is not None:
+            body["time_budget"] = self.time_budget
+        return self.session.post(f"{self.api_url}/analyze-performance", json=body)
+
+    def seed(self, conversion_timeout: float = 60) -> None:
+        """Uploads a score and its recording and waits for the conversion, so every scenario has ids to work with"""
+        self.upload_pdf(unique=False).raise_for_status()
+        self.upload_wav(unique=False).raise_for_status()
+        deadline = time.monotonic() + conversion_timeout
+        while self.session.get(f"{self.api_url}/score-status", params={"id": self.score_ids[0]}).json().get("status") != "completed":
+            if time.monotonic() > deadline:
+                raise TimeoutError("The seeded score was not converted in time")
+            time.sleep(0.2)
+        self.analysis_pair = (self.wav_ids[0], self.score_ids[0])
+
+SCENARIOS: dict[str, Callable[[Client], requests.Response]] = {
+    "upload_pdf": Client.upload_pdf,
+    "upload_wav": Client.upload_wav,
+    "score_status": Client.score_status,
+    "download_wav": Client.download_wav,
+    "download_mxl": Client.download_mxl,
+    "analyze": Client.analyze,
+}
+
+def run_scenario(client: Client, scenario: str, scheduled: float) -> Sample:
+    try:
+        status = SCENARIOS[scenario](client).status_code
+    except requests.RequestException:
+        status = None
+    return Sample(scenario, time.monotonic() - scheduled, status)
+
+def run_load(client: Client, mix: dict[str, float], rate: float, duration: float, concurrency: int, seed: int = 0) -> list[Sample]:
+    """Issues requests at rate per second for duration seconds, with at most concurrency of them in flight"""
+    rng = random.Random(seed)
+    scenarios, weights = list(mix), list(mix.values())
+    start = time.monotonic()
+    futures = []
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        arrival = 0.0
+        while True:
+            arrival += rng.expovariate(rate)
+            if arrival >= duration:
+                break
+            time.sleep(max(start + arrival - time.monotonic(), 0))
+            futures.append(pool.submit(run_scenario, client, rng.choices(scenarios, weights)[0], start + arrival))
+    return [future.result() for future in futures]
+
+def summarize(samples: list[Sample], duration: float) -> dict[str, dict[str, float]]:
+    """Per-scenario (and "total") request count, throughput, latency percentiles in ms and error rate"""
+    groups: dict[str, list[Sample]] = {}
+    for sample in samples:
+        groups.setdefault(sample.scenario, []).append(sample)
+    groups["total"] = samples
+
+    summary = {}
+    for scenario, group in groups.items():
+        latencies = np.array([sample.latency for sample in group]) * 1000
+        errors = sum(not sample.ok for sample in group)
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(group) else (np.nan,) * 3
+        summary[scenario] = {
+            "requests": len(group),
+            "throughput": (len(group) - errors) / duration,
+            "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99),
+            "max_ms": float(latencies.max(initial=0)),
+            "error_rate": errors / len(group) if group else 0.0,
+        }
+    return summary
+
+def format_summary(summary: dict[str, dict[str, float]]) -> str:
+    lines = [f"{'scenario':<14}{'requests':>10}{'ok/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'errors':>9}"]
+    for scenario, row in summary.items():
+        lines.append(f"{scenario:<14}{row['requests']:>10}{row['throughput']:>9.1f}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}"
+                     f"{row['p99_ms']:>10.1f}{row['max_ms']:>10.1f}{row['error_rate']:>9.1%}")
+    return "\n".join(lines)
@@ -0,0 +1,81 @@
+"""
+Local stand-in for the Audiveris wrapper: GET / (health), POST /upload, GET /status/<id> and GET /download/<id>.
+
+Every upload is "converted" into the same mxl after conversion_time seconds, and every request
+takes latency seconds to answer, to model the round trip to the hosted container.
+"""
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler
+from pathlib import Path
+
+from .server import StandInServer, serve
+
+class AudiverisState:
+    def __init__(self, mxl: bytes, latency: float = 0.0, conversion_time: float = 0.0):
+        self.mxl = mxl
+        self.latency = latency
+        self.conversion_time = conversion_time
+        self.lock = threading.Lock()
+        self.uploads: dict[str, float] = {}
+        """upload time (time.monotonic()) per score id"""
+
+class AudiverisHandler(BaseHTTPRequestHandler):
+    state: AudiverisState
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def respond(self, status: int, body: bytes, content_type: str = "application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def respond_json(self, status: int, body: dict):
+        self.respond(status, json.dumps(body).encode())
+
+    def status_of(self, score_id: str) -> str | None:
+        with self.state.lock:
+            uploaded = self.state.uploads.get(score_id)
+        if uploaded is None:
+            return None
+        return "completed" if time.monotonic() - uploaded >= self.state.conversion_time else "processing"
+
+    def do_POST(self):
+        time.sleep(self.state.latency)
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.rstrip("/") != "/upload":
+            return self.respond_json(404, {"message": "Not found"})
+        score_id = str(uuid.uuid4())
+        with self.state.lock:
+            self.state.uploads[score_id] = time.monotonic()
+        self.respond_json(200, {"id": score_id})
+
+    def do_GET(self):
+        time.sleep(self.state.latency)
+        if self.path == "/":
+            return self.respond(200, b"OK", "text/plain")
+        if self.path.rstrip("/") == "/upload":
+            return self.respond_json(405, {"message": "Method not allowed"})
+
+        route, _, score_id = self.path.lstrip("/").partition("/")
+        status = self.status_of(score_id)
+        if route == "status":
+            if status is None:
+                return self.respond_json(404, {"status": "error", "message": f"Unknown id {score_id}"})
+            return self.respond_json(200, {"status": status})
+        if route == "download":
+            if status != "completed":
+                return self.respond_json(404, {"status": status or "error", "message": "Not converted yet"})
+            return self.respond(200, self.state.mxl, "application/vnd.recordare.musicxml")
+        self.respond_json(404, {"message": "Not found"})
+
+def serve_audiveris(mxl_path: Path, port: int = 0, latency: float = 0.0, conversion_time: float = 0.0) -> StandInServer:
+    """Starts the stand-in on a background thread, server.server_address has the actual port"""
+    handler = type("BoundAudiverisHandler", (AudiverisHandler,), {"state": AudiverisState(Path(mxl_path).read_bytes(), latency, conversion_time)})
+    return serve(handler, port)
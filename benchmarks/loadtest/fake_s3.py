@@ -0,0 +1,124 @@
+"""
+In-memory stand-in for the S3 API, covering the calls the API makes through boto3:
+PutObject (including If-None-Match: * conditional writes), GetObject, HeadObject, DeleteObject
+and the multipart upload calls upload_fileobj uses for larger files.
+
+boto3 is pointed at it with AWS_ENDPOINT_URL. Buckets are created implicitly, only path-style
+addressing is supported (botocore uses it for IP address endpoints).
+"""
+import threading
+import time
+import uuid
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from .server import StandInServer, serve
+
+class S3Store:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        """seconds added to every request, to model the round trip to a real region"""
+        self.lock = threading.Lock()
+        self.objects: dict[tuple[str, str], bytes] = {}
+        self.uploads: dict[str, dict[int, bytes]] = {}
+
+def error_body(code: str, message: str) -> bytes:
+    return f'<?xml version="1.0" encoding="UTF-8"?><Error><Code>{code}</Code><Message>{message}</Message></Error>'.encode()
+
+def decode_aws_chunked(data: bytes) -> bytes:
+    """Payload of an aws-chunked body: hex size;chunk-signature=...\\r\\n data \\r\\n ... 0\\r\\n trailers"""
+    payload, position = bytearray(), 0
+    while True:
+        line_end = data.index(b"\r\n", position)
+        size = int(data[position:line_end].split(b";")[0], 16)
+        if size == 0:
+            return bytes(payload)
+        payload += data[line_end + 2:line_end + 2 + size]
+        position = line_end + 2 + size + 2
+
+class S3Handler(BaseHTTPRequestHandler):
+    store: S3Store
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def target(self) -> tuple[str, str, dict[str, list[str]]]:
+        url = urlsplit(self.path)
+        bucket, _, key = url.path.lstrip("/").partition("/")
+        return bucket, unquote(key), parse_qs(url.query, keep_blank_values=True)
+
+    def body(self) -> bytes:
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if "aws-chunked" in self.headers.get("Content-Encoding", "") or self.headers.get("x-amz-content-sha256", "").startswith("STREAMING-"):
+            data = decode_aws_chunked(data)
+        return data
+
+    def respond(self, status: int, body: bytes = b"", headers: dict[str, str] | None = None, send_body: bool = True):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def delay(self):
+        if self.store.latency:
+            time.sleep(self.store.latency)
+
+    def do_PUT(self):
+        self.delay()
+        bucket, key, query = self.target()
+        data = self.body()
+        with self.store.lock:
+            if "uploadId" in query:
+                self.store.uploads[query["uploadId"][0]][int(query["partNumber"][0])] = data
+                return self.respond(200, headers={"ETag": f'"{uuid.uuid4().hex}"'})
+            if self.headers.get("If-None-Match") == "*" and (bucket, key) in self.store.objects:
+                return self.respond(412, error_body("PreconditionFailed", "At least one of the pre-conditions you specified did not hold"))
+            self.store.objects[bucket, key] = data
+        self.respond(200, headers={"ETag": f'"{uuid.uuid4().hex}"'})
+
+    def do_POST(self):
+        self.delay()
+        bucket, key, query = self.target()
+        self.body()
+        with self.store.lock:
+            if "uploads" in query:
+                upload_id = uuid.uuid4().hex
+                self.store.uploads[upload_id] = {}
+                body = f"<InitiateMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{key}</Key><UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>"
+                return self.respond(200, body.encode())
+            parts = self.store.uploads.pop(query["uploadId"][0])
+            self.store.objects[bucket, key] = b"".join(parts[number] for number in sorted(parts))
+        body = f"<CompleteMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{key}</Key><ETag>\"{uuid.uuid4().hex}\"</ETag></CompleteMultipartUploadResult>"
+        self.respond(200, body.encode())
+
+    def do_GET(self, send_body: bool = True):
+        self.delay()
+        bucket, key, _ = self.target()
+        with self.store.lock:
+            data = self.store.objects.get((bucket, key))
+        if data is None:
+            return self.respond(404, error_body("NoSuchKey", "The specified key does not exist."), send_body=send_body)
+        self.respond(200, data, {"Content-Type": "binary/octet-stream", "Last-Modified": formatdate(usegmt=True), "ETag": '"0"'}, send_body=send_body)
+
+    def do_HEAD(self):
+        self.do_GET(send_body=False)
+
+    def do_DELETE(self):
+        self.delay()
+        bucket, key, query = self.target()
+        with self.store.lock:
+            if "uploadId" in query:
+                self.store.uploads.pop(query["uploadId"][0], None)
+            else:
+                self.store.objects.pop((bucket, key), None)
+        self.respond(204)
+
+def serve_s3(port: int = 0, latency: float = 0.0) -> StandInServer:
+    """Starts the stand-in on a background thread, server.server_address has the actual port"""
+    handler = type("BoundS3Handler", (S3Handler,), {"store": S3Store(latency)})
+    return serve(handler, port)
@@ -0,0 +1,14 @@
+"""Threaded HTTP server the stand-ins run on"""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+    """the default backlog of 5 refuses connections long before the API is saturated"""
+
+def serve(handler: type[BaseHTTPRequestHandler], port: int = 0) -> StandInServer:
+    """Serves on 127.0.0.1 from a background thread, server.server_address has the actual port"""
+    server = StandInServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
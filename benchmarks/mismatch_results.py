@@ -0,0 +1,60 @@
+"""
+Memory and serialization cost of the mismatch result types.
+
+Compares the old annotation-only classes (one __dict__ per mismatch), the slotted dataclasses,
+and MismatchTable. Run from the repository root:
+
+    python -m benchmarks.mismatch_results [rows]
+"""
+import dataclasses
+import json
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+from src.analysis.results import MismatchTable
+from src.pitch.main import PitchMismatch
+
+class DictPitchMismatch:
+    """the pre-dataclass layout: every instance carries a __dict__"""
+    def __init__(self, time: float, expected_pitch: float, actual_pitch: float):
+        self.time = time
+        self.expected_pitch = expected_pitch
+        self.actual_pitch = actual_pitch
+
+def measure_memory(build) -> tuple[object, int]:
+    tracemalloc.start()
+    result = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size
+
+def measure_time(fn, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main(rows: int) -> None:
+    rng = np.random.default_rng(0)
+    times = np.arange(rows) * 512 / 44100
+    expected = rng.uniform(100, 1000, rows)
+    actual = rng.uniform(100, 1000, rows)
+    columns = (times.tolist(), expected.tolist(), actual.tolist())
+
+    dict_items, dict_bytes = measure_memory(lambda: [DictPitchMismatch(*row) for row in zip(*columns)])
+    slot_items, slot_bytes = measure_memory(lambda: [PitchMismatch(*row) for row in zip(*columns)])
+    table, table_bytes = measure_memory(lambda: MismatchTable(PitchMismatch, times, expected, actual))
+
+    print(f"{rows} mismatches")
+    print(f"{'layout':<28}{'bytes/result':>14}{'json (ms)':>12}")
+    print(f"{'class with __dict__':<28}{dict_bytes / rows:>14.1f}{measure_time(lambda: json.dumps([vars(i) for i in dict_items])) * 1000:>12.2f}")
+    print(f"{'slotted dataclass':<28}{slot_bytes / rows:>14.1f}{measure_time(lambda: json.dumps([dataclasses.asdict(i) for i in slot_items])) * 1000:>12.2f}")
+    print(f"{'MismatchTable records':<28}{table_bytes / rows:>14.1f}{measure_time(lambda: json.dumps(table.to_records())) * 1000:>12.2f}")
+    print(f"{'MismatchTable columnar':<28}{table_bytes / rows:>14.1f}{measure_time(lambda: json.dumps({k: v.tolist() for k, v in table.columns().items()})) * 1000:>12.2f}")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50_000)
@@ -0,0 +1,81 @@
+"""
+Speed and accuracy of the analysis profiles (src/analysis/profiles.py).
+
+Runs the full analysis of every test recording (and of test7 with a wrong note spliced in, so there
+are pitch mismatches to find) under each profile, and reports the time it took and how well its
+mismatches agree with the "accurate" profile's: the F1 score of its mismatch times against the accurate
+ones, counting a mismatch as found if the other profile has one within MATCH_SECONDS.
+Run from the repository root:
+
+    python -m benchmarks.profiles [repeat]
+"""
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import soundfile
+
+from src.analysis.pipeline import analyze
+from src.analysis.profiles import PROFILES
+from src.analysis.results import MismatchTable
+
+TEST_FILES_DIR = Path(__file__).resolve().parents[1] / "src" / "pitch" / "test_files"
+RECORDINGS = ["test2", "test7", "test9", "test12"]
+MATCH_SECONDS = 0.1
+
+def wrong_note_recording(directory: Path) -> Path:
+    """test7 with two seconds of a 1 kHz tone in the middle"""
+    y, sample_rate = soundfile.read(TEST_FILES_DIR / "test7.wav")
+    half = len(y) // 2
+    tone = 0.3 * np.sin(2 * np.pi * 1000 * np.arange(2 * sample_rate) / sample_rate)
+    y[half:half + 2 * sample_rate] = tone[:, None] if y.ndim > 1 else tone
+    soundfile.write(directory / "test7_wrong.wav", y, sample_rate)
+    return directory / "test7_wrong.wav"
+
+def found(times: np.ndarray, others: np.ndarray) -> np.ndarray:
+    """Whether each of times has one of the (sorted) others within MATCH_SECONDS"""
+    if len(others) == 0:
+        return np.zeros(len(times), dtype=bool)
+    i = np.searchsorted(others, times)
+    before, after = others[np.maximum(i - 1, 0)], others[np.minimum(i, len(others) - 1)]
+    return np.minimum(np.abs(times - before), np.abs(after - times)) <= MATCH_SECONDS
+
+def agreement(table: MismatchTable, reference: MismatchTable) -> float:
+    times, reference_times = table["time"], reference["time"]
+    if len(times) == 0 and len(reference_times) == 0:
+        return 1.0
+    precision = found(times, reference_times).mean() if len(times) else 0.0
+    recall = found(reference_times, times).mean() if len(reference_times) else 0.0
+    return 0.0 if precision + recall == 0 else 2 * precision * recall / (precision + recall)
+
+def main(repeat: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        cases = [(name, TEST_FILES_DIR / f"{name}.wav", TEST_FILES_DIR / f"{name}.mxl") for name in RECORDINGS]
+        cases.append(("test7_wrong", wrong_note_recording(Path(tmp)), TEST_FILES_DIR / "test7.mxl"))
+
+        totals = {name: 0.0 for name in PROFILES}
+        agreements: dict[str, dict[str, list[float]]] = {name: {"pitch_feedback": [], "dynamics_feedback": []} for name in PROFILES}
+        for case, audio_path, score_path in cases:
+            results = {}
+            for name, profile in PROFILES.items():
+                best = float("inf")
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    results[name] = analyze(audio_path, score_path, profile=profile)
+                    best = min(best, time.perf_counter() - start)
+                totals[name] += best
+            for name in PROFILES:
+                for kind in agreements[name]:
+                    agreements[name][kind].append(agreement(results[name].feedback[kind], results["accurate"].feedback[kind]))
+            print(f"{case}: " + ", ".join(f"{name} {len(results[name].feedback['pitch_feedback'])} pitch mismatches" for name in PROFILES), file=sys.stderr)
+
+    print(f"{len(cases)} recordings (44.1 kHz, ~11s each), best of {repeat}")
+    print(f"{'profile':<10}{'seconds':>10}{'speedup':>10}{'pitch agreement':>18}{'dynamics agreement':>21}")
+    for name in PROFILES:
+        print(f"{name:<10}{totals[name]:>10.2f}{totals['accurate'] / totals[name]:>9.1f}x"
+              f"{np.mean(agreements[name]['pitch_feedback']):>18.1%}{np.mean(agreements[name]['dynamics_feedback']):>21.1%}")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2)
@@ -0,0 +1,25 @@
+"""
+gunicorn settings used by the Dockerfile, each one can be overridden through the environment.
+
+The proxy endpoints (/upload/*, /download/*, /score-status, /aws-health) spend nearly all their time
+waiting on Audiveris or S3. With gevent workers (the default) each worker process serves up to
+GUNICORN_WORKER_CONNECTIONS of them concurrently, while analyses run in a separate process pool
+(see src/api/executor.py). Set GUNICORN_WORKER_CLASS=sync for one request per process.
+A worker whose memory grew beyond WORKER_MAX_RSS_MB is recycled once it is done with its requests (see src/api/memory.py).
+"""
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("GUNICORN_WORKERS", "8"))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gevent")
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+# seconds a recycled or stopped worker gets to finish its requests, long enough for queued analyses
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "300"))
+
+def post_request(worker, req, environ, resp):
+    from src.api.main import watchdog
+    if worker.alive and watchdog.should_recycle():
+        worker.log.warning("Worker %s is over its memory limit, recycling it", worker.pid)
+        # stops accepting requests, finishes the ones in flight, then the arbiter starts a fresh worker
+        worker.alive = False
@@ -0,0 +1,200 @@
+"""
+Box-wide store of compiled score arrays, shared by every gunicorn worker and analysis process without copies.
+
+An artifact is a named set of NumPy arrays, e.g. a score's timeline (see timeline.py) or the expected pitch per hop
+derived from it. It is published once into ARTIFACT_CACHE_DIR as one .npy file per array, and every process that
+needs it maps those files read-only, so all of them share the same pages of the page cache: resident memory grows
+with the number of distinct scores, not with workers x scores.
+
+A small JSON index (see statefile.py) counts the references each process holds to every artifact. Once the artifacts take more than ARTIFACT_CACHE_BYTES the least recently used ones
+nobody references are deleted. References of processes that died are dropped the next time anyone looks at the index.
+
+A SharedTimeline names a published timeline, so it is pickled as its key: the analysis process it is sent to maps
+the timeline (and the expected pitch and dynamics arrays derived from it) itself instead of receiving a copy.
+"""
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Final, Iterator
+
+import numpy as np
+
+from .statefile import locked_state, process_alive
+from .timeline import ScoreTimeline
+
+ARTIFACT_CACHE_DIR: Final[str] = os.getenv("ARTIFACT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "warbler-artifacts"))
+
+ARTIFACT_CACHE_BYTES: Final[int] = int(os.getenv("ARTIFACT_CACHE_BYTES", str(1 << 30)))
+"""bytes of artifacts kept on the box, beyond which unreferenced ones are evicted"""
+
+ARTIFACT_KEY: Final[re.Pattern] = re.compile(r"[A-Za-z0-9._-]{1,200}")
+"""keys are directory names in the cache"""
+
+Arrays = dict[str, np.ndarray]
+
+def new_index() -> dict:
+    return {"entries": {}, "hits": 0, "misses": 0, "evictions": 0}
+
+class ArtifactStore:
+    def __init__(self, directory: str | Path = ARTIFACT_CACHE_DIR, max_bytes: int = ARTIFACT_CACHE_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def path(self, key: str) -> Path:
+        if not ARTIFACT_KEY.fullmatch(key):
+            raise ValueError(f"Invalid artifact key {key!r}")
+        return self.directory / key
+
+    @contextmanager
+    def index(self) -> Iterator[dict]:
+        """The box-wide index of artifacts, locked against every other process until the block ends. Changes to it are saved"""
+        with locked_state(self.directory / "index.json", new_index) as state:
+            for entry in state["entries"].values():
+                entry["refs"] = {pid: count for pid, count in entry["refs"].items() if process_alive(int(pid))}
+            yield state
+
+    def map(self, key: str) -> Arrays:
+        """The arrays of a published artifact, mapped read-only"""
+        return {path.stem: np.load(path, mmap_mode="r") for path in self.path(key).glob("*.npy")}
+
+    def acquire(self, key: str) -> Arrays | None:
+        """Maps a published artifact and references it for this process until release, None if it isn't published"""
+        with self.index() as state:
+            entry = state["entries"].get(key)
+            if entry is None:
+                state["misses"] += 1
+                return None
+            state["hits"] += 1
+            entry["last_used"] = time.time()
+            pid = str(os.getpid())
+            entry["refs"][pid] = entry["refs"].get(pid, 0) + 1
+            # mapped under the lock, so the artifact can't be evicted in between
+            return self.map(key)
+
+    def release(self, key: str) -> None:
+        with self.index() as state:
+            entry = state["entries"].get(key)
+            pid = str(os.getpid())
+            if entry is not None and pid in entry["refs"]:
+                entry["refs"][pid] -= 1
+                if entry["refs"][pid] <= 0:
+                    del entry["refs"][pid]
+
+    def publish(self, key: str, arrays: Arrays) -> None:
+        """
+        Writes an artifact, then evicts the least recently used unreferenced ones over the budget.
+        If another process published the same key in the meantime, its copy is kept
+        """
+        staging = self.directory / f".staging-{uuid.uuid4().hex}"
+        staging.mkdir()
+        try:
+            for name, array in arrays.items():
+                np.save(staging / f"{name}.npy", np.ascontiguousarray(array), allow_pickle=False)
+            size = sum(path.stat().st_size for path in staging.iterdir())
+            with self.index() as state:
+                if key in state["entries"]:
+                    return
+                shutil.rmtree(self.path(key), ignore_errors=True)  # left behind by a process that died while publishing
+                staging.rename(self.path(key))
+                state["entries"][key] = {"bytes": size, "last_used": time.time(), "refs": {}}
+                self.evict(state, keep=key)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def evict(self, state: dict, keep: str | None = None) -> None:
+        """Deletes the least recently used artifacts nobody references (except keep) until the rest fit the budget"""
+        total = sum(entry["bytes"] for entry in state["entries"].values())
+        for key, entry in sorted(state["entries"].items(), key=lambda item: item[1]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if entry["refs"] or key == keep:
+                continue
+            # processes that still have the files mapped keep their pages until they unmap them
+            shutil.rmtree(self.path(key), ignore_errors=True)
+            del state["entries"][key]
+            total -= entry["bytes"]
+            state["evictions"] += 1
+
+    @contextmanager
+    def mapped(self, key: str, build: Callable[[], Arrays]) -> Iterator[Arrays]:
+        """The artifact's arrays, mapped read-only and referenced until the block ends. build makes them if they aren't published yet"""
+        arrays = self.acquire(key)
+        while arrays is None:
+            self.publish(key, build())
+            arrays = self.acquire(key)
+        try:
+            yield arrays
+        finally:
+            self.release(key)
+
+    def stats(self) -> dict:
+        """Artifacts, their bytes and references, and the hit, miss and eviction counts"""
+        with self.index() as state:
+            entries = state["entries"].values()
+            return {
+                "artifacts": len(state["entries"]), "bytes": sum(entry["bytes"] for entry in entries),
+                "references": sum(sum(entry["refs"].values()) for entry in entries),
+                "hits": state["hits"], "misses": state["misses"], "evictions": state["evictions"],
+            }
+
+@dataclass(slots=True)
+class MappedTimeline(ScoreTimeline):
+    """
+    A timeline whose arrays are mapped from the artifact store. The expected pitch and dynamics arrays are
+    published next to it the first time any process needs them, and mapped from there afterwards
+    """
+    store: ArtifactStore | None = None
+    key: str = ""
+    stack: ExitStack = field(default_factory=ExitStack)
+    """references to the derived artifacts, released with the timeline's"""
+
+    def derived(self, name: str, build: Callable[[], Arrays]) -> Arrays:
+        return self.stack.enter_context(self.store.mapped(f"{self.key}.{name}", build))
+
+    def expected_pitches(self, sample_rate: int, hop_length: int) -> np.ndarray:
+        build = lambda: {"pitches": np.array(ScoreTimeline.expected_pitches(self, sample_rate, hop_length), dtype=np.float64)}
+        return self.derived(f"pitches-{sample_rate}-{hop_length}", build)["pitches"]
+
+    def expected_rms(self, sample_rate: int, rest_db: float) -> tuple[np.ndarray, np.ndarray]:
+        def build() -> Arrays:
+            expected_rms, time_points = ScoreTimeline.expected_rms(self, sample_rate, rest_db)
+            return {"expected_rms": np.array(expected_rms, dtype=np.float64), "time_points": np.array(time_points, dtype=np.float64)}
+        arrays = self.derived(f"rms-{sample_rate}-{rest_db:g}", build)
+        return arrays["expected_rms"], arrays["time_points"]
+
+@dataclass(frozen=True, slots=True)
+class SharedTimeline:
+    """A timeline published in the artifact store, see share_timeline. Pickled as its key"""
+    key: str
+    directory: str = ARTIFACT_CACHE_DIR
+    max_bytes: int = ARTIFACT_CACHE_BYTES
+
+    @contextmanager
+    def open(self) -> Iterator[MappedTimeline]:
+        """Maps the timeline and references it (and what is derived from it) from this process until the block ends"""
+        store = ArtifactStore(self.directory, self.max_bytes)
+        with ExitStack() as stack:
+            arrays = stack.enter_context(store.mapped(self.key, self.missing))
+            timeline = MappedTimeline.from_arrays(arrays)
+            timeline.store, timeline.key = store, self.key
+            stack.enter_context(timeline.stack)
+            yield timeline
+
+    def missing(self) -> Arrays:
+        raise LookupError(f"Timeline {self.key} is not in the artifact store, it must be shared before it is opened")
+
+@contextmanager
+def share_timeline(store: ArtifactStore, key: str, compile: Callable[[], ScoreTimeline]) -> Iterator[SharedTimeline]:
+    """
+    Publishes the timeline under key, unless it is already, and references it until the block ends so that
+    the processes the handle is sent to can open it. compile makes the timeline if it isn't published yet
+    """
+    with store.mapped(key, lambda: compile().to_arrays()):
+        yield SharedTimeline(key, str(store.directory), store.max_bytes)
@@ -0,0 +1,251 @@
+"""
+Offline batch analysis of many recordings, e.g. for re-scoring an archive after the analyzers changed.
+
+    python -m src.analysis.batch recordings/ -o results.jsonl
+    python -m src.analysis.batch manifest.jsonl -o results.parquet --workers 8 --profile balanced
+
+A directory is searched recursively for recordings (.wav) with a score of the same name next to them
+(.mxl, .musicxml or .xml). A manifest is a JSONL file of {"audio": ..., "score": ..., "id": ...} objects or a CSV
+file with those columns. Paths in a manifest are relative to it, and the id defaults to the audio path.
+
+Every distinct score is parsed and compiled into its timeline (see timeline.py) once, in parallel, then the
+recordings run through the full analysis (see pipeline.py) across a process pool against those timelines, longest
+first. Each result is appended to the output as one JSON line with the columnar feedback as soon as it is done.
+Rerunning with the same output resumes: jobs that already have a result from this ANALYZER_VERSION and the same options
+(profile, dynamics mode and tolerance) are skipped and failed ones are retried. A .parquet output is written from a .jsonl
+journal next to it once every job has run (needs pyarrow), with the latest result of every job from this version and these options.
+"""
+import argparse
+import csv
+import json
+import sys
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from dataclasses import asdict, dataclass, fields
+from datetime import timedelta
+from pathlib import Path
+from typing import Final, TextIO
+
+import soundfile
+from music21 import converter
+
+from .pipeline import ANALYZER_VERSION, analyze
+from .profiles import PROFILES
+from .timeline import ScoreTimeline
+from .tolerance import DEFAULT_TOLERANCE, Tolerance, parse_tolerance
+from ..dynamics.feedback import DynamicsMismatch, DynamicsSpan, compile_score, dynamics_modes
+from ..pitch.main import PitchMismatch
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pyarrow is optional, only needed for parquet output
+    pyarrow = None
+
+AUDIO_SUFFIXES: Final[tuple[str, ...]] = (".wav",)
+SCORE_SUFFIXES: Final[tuple[str, ...]] = (".mxl", ".musicxml", ".xml")
+"""in order of preference, when a recording has several scores next to it"""
+
+@dataclass(frozen=True, slots=True)
+class BatchJob:
+    id: str
+    audio: Path
+    score: Path
+
+@dataclass(frozen=True, slots=True)
+class BatchOptions:
+    profile: str = "accurate"
+    dynamics_mode: str = "frame"
+    tolerance: Tolerance = DEFAULT_TOLERANCE
+
+def find_pairs(directory: Path) -> list[BatchJob]:
+    """Recordings under directory that have a score of the same name next to them, with their paths relative to directory as ids"""
+    jobs = []
+    for audio in sorted(path for path in directory.rglob("*") if path.suffix.lower() in AUDIO_SUFFIXES):
+        score = next((audio.with_suffix(suffix) for suffix in SCORE_SUFFIXES if audio.with_suffix(suffix).is_file()), None)
+        if score is None:
+            print(f"Skipping {audio}, there is no score next to it", file=sys.stderr)
+            continue
+        jobs.append(BatchJob(id=audio.relative_to(directory).as_posix(), audio=audio, score=score))
+    return jobs
+
+def read_manifest(manifest: Path) -> list[BatchJob]:
+    """The jobs of a JSONL or CSV manifest. Raises ValueError if an entry has no audio or score"""
+    with open(manifest, newline="") as f:
+        if manifest.suffix.lower() == ".csv":
+            entries = list(csv.DictReader(f))
+        else:
+            entries = [json.loads(line) for line in f if line.strip()]
+    jobs = []
+    for number, entry in enumerate(entries, start=1):
+        if not entry.get("audio") or not entry.get("score"):
+            raise ValueError(f"Entry {number} of {manifest} needs both 'audio' and 'score', got {entry}")
+        jobs.append(BatchJob(id=str(entry.get("id") or entry["audio"]), audio=manifest.parent / entry["audio"], score=manifest.parent / entry["score"]))
+    ids = [job.id for job in jobs]
+    if len(set(ids)) != len(ids):
+        raise ValueError(f"The ids in {manifest} are not unique")
+    return jobs
+
+def journal_path(output: Path) -> Path:
+    """Where the results are appended to, the output itself unless it is written as parquet at the end"""
+    return output.with_name(output.name + ".jsonl") if output.suffix.lower() == ".parquet" else output
+
+def read_journal(journal: Path) -> list[dict]:
+    """The records written so far. A line cut off by an interruption is ignored"""
+    if not journal.exists():
+        return []
+    records = []
+    with open(journal) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                pass
+    return records
+
+def option_fields(options: BatchOptions) -> dict:
+    """The options as they are recorded with every result"""
+    return {"profile": options.profile, "dynamics_mode": options.dynamics_mode, "tolerance": asdict(options.tolerance)}
+
+def is_current(record: dict, options: BatchOptions) -> bool:
+    """Whether a record comes from this ANALYZER_VERSION and these options"""
+    return record.get("analyzer_version") == ANALYZER_VERSION and all(record.get(key) == value for key, value in option_fields(options).items())
+
+def completed_ids(records: list[dict], options: BatchOptions = BatchOptions()) -> set[str]:
+    """Jobs that already have a result from this ANALYZER_VERSION and these options, results of other options don't count"""
+    return {record["id"] for record in records if "error" not in record and is_current(record, options)}
+
+def prepare_score(score: Path) -> bytes:
+    """The serialized timeline of a score, compiled once for every recording of it"""
+    return compile_score(converter.parse(score)).to_bytes()
+
+def analyze_job(job: BatchJob, timeline: bytes, options: BatchOptions) -> dict:
+    """Analyzes one recording against its prepared score, the result as a JSON-ready record"""
+    start = time.perf_counter()
+    record = {"id": job.id, "audio": str(job.audio), "score": str(job.score), "analyzer_version": ANALYZER_VERSION, **option_fields(options)}
+    try:
+        record["duration"] = soundfile.info(job.audio).duration
+        analysis = analyze(job.audio, ScoreTimeline.from_bytes(timeline), tolerance=options.tolerance, dynamics_mode=options.dynamics_mode,
+                           profile=PROFILES[options.profile])
+    except Exception as e:
+        return {**record, "error": f"{type(e).__name__}: {e}", "seconds": time.perf_counter() - start}
+    record.update(
+        seconds=time.perf_counter() - start,
+        accuracy={kind: analysis.accuracy(kind) for kind in analysis.feedback},
+        **{kind: {name: column.tolist() for name, column in table.columns().items()} for kind, table in analysis.feedback.items()},
+    )
+    return record
+
+class Progress:
+    """Prints every finished job with the throughput so far and the estimated time left"""
+    def __init__(self, total: int, out: TextIO = sys.stderr):
+        self.total = total
+        self.out = out
+        self.done = 0
+        self.failed = 0
+        self.audio_seconds = 0.0
+        self.start = time.monotonic()
+
+    def report(self, record: dict) -> None:
+        self.done += 1
+        self.failed += "error" in record
+        self.audio_seconds += record.get("duration", 0.0)
+        elapsed = max(time.monotonic() - self.start, 1e-9)
+        rate = self.done / elapsed
+        eta = timedelta(seconds=round((self.total - self.done) / rate))
+        status = f"failed: {record['error']}" if "error" in record else f"ok in {record['seconds']:.1f}s"
+        print(f"[{self.done}/{self.total}] {record['id']} {status} | {rate:.2f} recordings/s, "
+              f"{self.audio_seconds / elapsed:.1f} audio-s/s, ETA {eta}", file=self.out, flush=True)
+
+def run_batch(jobs: list[BatchJob], output: Path, options: BatchOptions = BatchOptions(), workers: int | None = None) -> Progress:
+    """Analyzes the jobs that have no result in output yet, appending their results to it. Returns the progress of this run"""
+    journal = journal_path(output)
+    done = completed_ids(read_journal(journal), options)
+    pending = [job for job in jobs if job.id not in done]
+    if len(pending) < len(jobs):
+        print(f"Resuming, {len(jobs) - len(pending)} of {len(jobs)} recordings already have results", file=sys.stderr)
+    # longest recordings first, so that no worker is left with a long one at the end
+    pending.sort(key=lambda job: job.audio.stat().st_size if job.audio.exists() else 0, reverse=True)
+    progress = Progress(len(pending))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool, open(journal, "a+") as out:
+        # a line cut off by an interruption is finished, so the next record starts on its own line
+        out.seek(0, 2)
+        if out.tell() > 0:
+            out.seek(out.tell() - 1)
+            if out.read(1) != "\n":
+                out.write("\n")
+
+        try:
+            timelines = {score: pool.submit(prepare_score, score) for score in dict.fromkeys(job.score for job in pending)}
+            analyses: dict[Future, BatchJob] = {}
+            for job in pending:
+                try:
+                    analyses[pool.submit(analyze_job, job, timelines[job.score].result(), options)] = job
+                except Exception as e:
+                    record = {"id": job.id, "audio": str(job.audio), "score": str(job.score), "analyzer_version": ANALYZER_VERSION,
+                              **option_fields(options), "error": f"Failed to prepare the score: {type(e).__name__}: {e}"}
+                    out.write(json.dumps(record) + "\n")
+                    out.flush()
+                    progress.report(record)
+
+            for future in as_completed(analyses):
+                record = future.result()
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+                progress.report(record)
+        except KeyboardInterrupt:
+            pool.shutdown(wait=False, cancel_futures=True)
+            print(f"Interrupted after {progress.done} of {progress.total} recordings, rerun to resume", file=sys.stderr)
+            raise
+
+    if output != journal:
+        write_parquet(journal, output, options)
+    return progress
+
+def parquet_schema(options: BatchOptions) -> "pyarrow.Schema":
+    """Columns of the parquet output, fixed so that failed jobs (which have no feedback) can't leave any out"""
+    text, number = pyarrow.string(), pyarrow.float64()
+    columns = lambda item_type: pyarrow.struct([(field.name, pyarrow.list_(number)) for field in fields(item_type)])
+    return pyarrow.schema([
+        ("id", text), ("audio", text), ("score", text), ("analyzer_version", text), ("profile", text), ("dynamics_mode", text),
+        ("tolerance", pyarrow.struct([(field.name, number) for field in fields(Tolerance)])),
+        ("duration", number), ("seconds", number), ("error", text),
+        ("accuracy", pyarrow.struct([("dynamics_feedback", number), ("pitch_feedback", number)])),
+        ("dynamics_feedback", columns(DynamicsMismatch if options.dynamics_mode == "frame" else DynamicsSpan)),
+        ("pitch_feedback", columns(PitchMismatch)),
+    ])
+
+def write_parquet(journal: Path, output: Path, options: BatchOptions = BatchOptions()) -> None:
+    """The latest record of every job in the journal from this ANALYZER_VERSION and these options, as a parquet file"""
+    if pyarrow is None:
+        raise RuntimeError(f"pyarrow is needed to write {output}, the results are in {journal}")
+    latest = {record["id"]: record for record in read_journal(journal) if is_current(record, options)}
+    pyarrow.parquet.write_table(pyarrow.Table.from_pylist(list(latest.values()), schema=parquet_schema(options)), output)
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m src.analysis.batch", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", type=Path, help="directory of recordings and scores, or a .jsonl or .csv manifest")
+    parser.add_argument("-o", "--output", type=Path, required=True, help="results file, .jsonl or .parquet")
+    parser.add_argument("--workers", type=int, default=None, help="analyses at once, the number of CPUs by default")
+    parser.add_argument("--profile", choices=list(PROFILES), default="accurate")
+    parser.add_argument("--dynamics-mode", choices=dynamics_modes, default="frame")
+    parser.add_argument("--tolerance", type=json.loads, default=None, help='JSON tolerance, e.g. \'{"dynamics_db": 3}\'')
+    args = parser.parse_args(argv)
+
+    try:
+        tolerance = parse_tolerance(args.tolerance) if args.tolerance is not None else DEFAULT_TOLERANCE
+        jobs = find_pairs(args.source) if args.source.is_dir() else read_manifest(args.source)
+    except (ValueError, OSError) as e:
+        parser.error(str(e))
+    if args.output.suffix.lower() == ".parquet" and pyarrow is None:
+        parser.error("Writing parquet needs pyarrow, install it or write .jsonl")
+
+    progress = run_batch(jobs, args.output, BatchOptions(args.profile, args.dynamics_mode, tolerance), args.workers)
+    elapsed = time.monotonic() - progress.start
+    print(f"Analyzed {progress.done - progress.failed} recordings ({progress.audio_seconds:.0f} audio-seconds) in {elapsed:.1f}s, "
+          f"{progress.failed} failed", file=sys.stderr)
+    return 1 if progress.failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
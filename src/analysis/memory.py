@@ -0,0 +1,28 @@
+"""
+Resident memory of this process, for the per-stage accounting of analyses (see pipeline.py) and the worker
+memory watchdog (see api/memory.py).
+"""
+import os
+import resource
+from contextlib import contextmanager
+from typing import Final, Iterator
+
+PAGE_SIZE: Final[int] = os.sysconf("SC_PAGE_SIZE")
+
+def rss_bytes() -> int:
+    """Resident set size of this process. Without /proc it falls back to the peak resident set size"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+@contextmanager
+def stage_rss(growth: dict[str, int], stage: str) -> Iterator[None]:
+    """Records in growth[stage] how many bytes the resident set grew (or shrank) while the block ran"""
+    before = rss_bytes()
+    try:
+        yield
+    finally:
+        growth[stage] = rss_bytes() - before
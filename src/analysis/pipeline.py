@@ -0,0 +1,149 @@
+"""
+The full performance analysis: preflight checks, then the dynamics and pitch analyzers.
+Used by the /analyze-performance endpoint.
+"""
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Final
+
+import numpy as np
+
+from .artifacts import SharedTimeline
+from .memory import rss_bytes, stage_rss
+from .preflight import preflight
+from .profiles import DEFAULT_PROFILE, AnalysisProfile, load_recording
+from .progressive import COARSE_HOP_LENGTH, COARSE_SAMPLE_RATE, progressive_pitch_check
+from .results import MismatchTable
+from .timeline import ScoreTimeline
+from .tolerance import DEFAULT_TOLERANCE, Tolerance
+from .window import AnalysisWindow, find_active_window
+from ..dynamics.feedback import get_dynamics_feedback_levels
+from ..pitch.main import pitch_check_levels
+
+ANALYZER_VERSION: Final[str] = "2026.10.1"
+"""stored with every analysis (see api/history.py), bumped whenever the analyzers change what they report"""
+
+@dataclass(slots=True)
+class Analysis:
+    feedback: dict[str, MismatchTable]
+    """"dynamics_feedback" and "pitch_feedback" """
+    complete: bool = True
+    """False if the deadline cut the pitch refinement short, some pitch feedback then comes from the coarse pass"""
+    completeness: float = 1.0
+    """fraction of the suspicious regions that were refined at full resolution"""
+    levels: dict[str, dict[str, MismatchTable]] = field(default_factory=dict)
+    """feedback (shaped like feedback) per requested tolerance level"""
+    window: AnalysisWindow | None = None
+    measure_starts: dict[str, np.ndarray] = field(default_factory=dict)
+    """recording time at which each measure starts, per feedback kind, the way that analyzer aligned the score"""
+    measure_numbers: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.int64))
+    frame_seconds: dict[str, float] = field(default_factory=dict)
+    """seconds of the recording one mismatch row stands for, per feedback kind. 0 for spans, which have their own end"""
+    coarse_frame_seconds: dict[str, float] = field(default_factory=dict)
+    """for kinds analyzed progressively, seconds one row of the coarse pass stands for"""
+    refined_regions: dict[str, list[tuple[float, float]]] = field(default_factory=dict)
+    """for kinds analyzed progressively, the (start, end) regions refined at full resolution. Rows elsewhere are coarse"""
+    stage_growth: dict[str, int] = field(default_factory=dict)
+    """bytes the resident memory of the analyzing process grew by during each stage, see memory.py"""
+    rss: int = 0
+    """resident memory of the analyzing process once the analysis was done"""
+
+    def accuracy(self, kind: str, table: MismatchTable | None = None) -> float:
+        """Fraction of the played part of the recording without mismatches of this kind (in feedback, or in table)"""
+        table = self.feedback[kind] if table is None else table
+        played = self.window.release - self.window.onset if self.window is not None else 0.0
+        if played <= 0:
+            return 1.0
+        seconds = self.row_seconds(kind, table)
+        if seconds is not None:
+            _, first = np.unique(table["time"], return_index=True)
+            mismatched = float(np.sum(seconds[first]))
+        else:
+            mismatched = float(np.sum(table["end"] - table["time"]))
+        return float(np.clip(1 - mismatched / played, 0.0, 1.0))
+
+    def row_seconds(self, kind: str, table: MismatchTable | None = None) -> np.ndarray | None:
+        """Seconds of the recording each mismatch row of this kind (in feedback, or in table) stands for, None for spans"""
+        table = self.feedback[kind] if table is None else table
+        if self.frame_seconds.get(kind, 0.0) <= 0:
+            return None
+        seconds = np.full(len(table), self.frame_seconds[kind])
+        if kind in self.coarse_frame_seconds:
+            times = np.asarray(table["time"])
+            refined = np.zeros(len(table), dtype=bool)
+            for start, end in self.refined_regions.get(kind, []):
+                refined |= (times >= start) & (times < end)
+            seconds[~refined] = self.coarse_frame_seconds[kind]
+        return seconds
+
+def analyze(audio_path: str | Path, sheet_music: str | Path | ScoreTimeline | SharedTimeline, deadline: float | None = None,
+            tolerance: Tolerance = DEFAULT_TOLERANCE, levels: dict[str, Tolerance] | None = None, dynamics_mode: str = "frame",
+            profile: AnalysisProfile = DEFAULT_PROFILE) -> Analysis:
+    """
+    Analyzes a recording against its score, given as a path or as an already compiled timeline (see timeline.py),
+    possibly one shared through the artifact store (see artifacts.py).
+    The score is parsed once and shared by both analyzers,
+    which only look at the part of the recording where the performer is playing.
+    With a deadline (in time.monotonic() seconds) the pitch analysis runs progressively and returns what it has by then.
+    feedback is judged with tolerance, and every extra named level in levels is evaluated on the same extracted features.
+    dynamics_mode (see dynamics.feedback.dynamics_modes) picks frame, note or marking span level dynamics feedback.
+    profile (see profiles.py) sets the sample rates, hops and frames the analyzers run at.
+    Raises PreflightError before any expensive work if the inputs can't be analyzed.
+    """
+    if isinstance(sheet_music, SharedTimeline):
+        with sheet_music.open() as timeline:
+            return analyze(audio_path, timeline, deadline, tolerance, levels, dynamics_mode, profile)
+
+    levels = levels or {}
+    tolerances = [tolerance, *levels.values()]
+    growth: dict[str, int] = {}
+
+    with stage_rss(growth, "preflight"):
+        check = preflight(audio_path, sheet_music)
+    if check.analysis_duration is not None:
+        print(f"Recording is {check.duration:.1f}s for a {check.expected_duration:.1f}s score, only analyzing the first {check.analysis_duration:.1f}s")
+
+    with stage_rss(growth, "window"):
+        window = find_active_window(audio_path, duration=check.analysis_duration or check.duration)
+    print(f"Playing from {window.onset:.1f}s to {window.release:.1f}s of the {check.duration:.1f}s recording")
+
+    audio = audio_path
+    if profile.shared_sample_rate is not None:
+        # decoded and resampled once, for both analyzers
+        with stage_rss(growth, "decode"):
+            audio = load_recording(audio_path, profile.shared_sample_rate, offset=window.start, duration=window.duration)
+
+    with stage_rss(growth, "dynamics"):
+        dynamics_feedback = get_dynamics_feedback_levels(check.timeline, audio, [level.dynamics_db for level in tolerances], window=window,
+                                                         mode=dynamics_mode, profile=profile)
+    print(f"Found {len(dynamics_feedback[0])} dynamics mismatches")
+
+    pitch_levels = [level.pitch_level for level in tolerances]
+    complete, completeness = True, 1.0
+    coarse_frame_seconds, refined_regions = {}, {}
+    if deadline is None:
+        with stage_rss(growth, "pitch"):
+            pitch_feedback = pitch_check_levels(audio, check.timeline, pitch_levels, window=window, profile=profile)
+        print(f"Found {len(pitch_feedback[0])} pitch mismatches")
+    else:
+        with stage_rss(growth, "pitch"):
+            progressive = progressive_pitch_check(audio, check.timeline, window, deadline, pitch_levels, profile)
+        pitch_feedback = progressive.levels
+        complete, completeness = progressive.refined_seconds >= progressive.suspicious_seconds, progressive.completeness
+        coarse_frame_seconds["pitch_feedback"] = COARSE_HOP_LENGTH / COARSE_SAMPLE_RATE
+        refined_regions["pitch_feedback"] = progressive.refined_regions
+        print(f"Found {len(progressive.feedback)} pitch mismatches, {progressive.completeness:.0%} of suspicious regions refined")
+
+    # pitch follows the score's tempo from the onset, dynamics stretch the score over the played part
+    measure_seconds, measure_numbers = check.timeline.measure_seconds()
+    stretch = (window.release - window.onset) / check.expected_duration if check.expected_duration > 0 else 1.0
+    measure_starts = {"dynamics_feedback": window.onset + measure_seconds * stretch, "pitch_feedback": window.onset + measure_seconds}
+    frame_seconds = {
+        "dynamics_feedback": profile.dynamics_hop_length / profile.dynamics_sample_rate if dynamics_mode == "frame" else 0.0,
+        "pitch_feedback": profile.pitch_hop_length / (profile.pitch_sample_rate or check.sample_rate),
+    }
+
+    feedback = [{"dynamics_feedback": dynamics, "pitch_feedback": pitch} for dynamics, pitch in zip(dynamics_feedback, pitch_feedback)]
+    return Analysis(feedback=feedback[0], complete=complete, completeness=completeness, levels=dict(zip(levels, feedback[1:])),
+                    window=window, measure_starts=measure_starts, measure_numbers=measure_numbers, frame_seconds=frame_seconds,
+                    coarse_frame_seconds=coarse_frame_seconds, refined_regions=refined_regions, stage_growth=growth, rss=rss_bytes())
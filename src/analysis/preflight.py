@@ -0,0 +1,79 @@
+"""
+Cheap checks that run before the expensive analysis stages.
+Rejects recordings that are unreadable, too short, silent or far longer than the score,
+and scores without notes, before any pitch tracking happens.
+"""
+import music21
+import numpy as np
+import soundfile
+from dataclasses import dataclass
+from music21 import converter
+from pathlib import Path
+from typing import Final
+
+from .timeline import ScoreTimeline
+from .window import energy_envelope
+from ..dynamics.feedback import compile_score
+
+MIN_DURATION: Final[float] = 0.5
+"""recordings shorter than this (in seconds) are rejected"""
+
+SILENCE_DB: Final[float] = -60
+"""recordings whose loudest energy window is below this (dBFS) are considered silent"""
+
+TRIM_DURATION_RATIO: Final[float] = 3
+"""recordings longer than this many times the score's expected duration are only analyzed up to that point"""
+
+REJECT_DURATION_RATIO: Final[float] = 10
+"""recordings longer than this many times the score's expected duration are rejected"""
+
+class PreflightError(ValueError):
+    """The inputs can't be analyzed. The message is meant to be shown to the client"""
+
+@dataclass(slots=True)
+class Preflight:
+    timeline: ScoreTimeline
+    sample_rate: int
+    duration: float
+    """length of the recording in seconds"""
+    expected_duration: float
+    """length of the score in seconds at its notated tempo"""
+    analysis_duration: float | None
+    """seconds of the recording to analyze, None to analyze all of it"""
+
+def peak_db(audio_path: str | Path) -> float:
+    """Level of the loudest window in the recording"""
+    envelope, _ = energy_envelope(audio_path)
+    return 20 * np.log10(max(envelope.max(initial=0.0), 1e-10))
+
+def expected_duration(score: music21.stream.Score) -> float:
+    """Length of the first part of the score in seconds, following its tempo changes"""
+    return check_timeline(compile_score(score)).expected_duration()
+
+def check_timeline(timeline: ScoreTimeline) -> ScoreTimeline:
+    if not timeline.has_notes:
+        raise PreflightError("The score has no notes in its first part")
+    return timeline
+
+def preflight(audio_path: str | Path, sheet_music: str | Path | ScoreTimeline) -> Preflight:
+    """
+    Runs the cheap checks, from cheapest to most expensive: the wav header, a silence check, then the score.
+    sheet_music is the path of the score or its precompiled timeline.
+    Raises PreflightError if the inputs should not be analyzed.
+    """
+    try:
+        info = soundfile.info(audio_path)
+    except RuntimeError:
+        raise PreflightError("The recording is not a readable audio file")
+    if info.duration < MIN_DURATION:
+        raise PreflightError(f"The recording is only {info.duration:.2f}s long")
+    if peak_db(audio_path) < SILENCE_DB:
+        raise PreflightError("The recording is silent")
+
+    timeline = check_timeline(sheet_music if isinstance(sheet_music, ScoreTimeline) else compile_score(converter.parse(sheet_music)))
+    score_duration = timeline.expected_duration()
+    if info.duration > score_duration * REJECT_DURATION_RATIO:
+        raise PreflightError(f"The recording is {info.duration:.0f}s long but the score only takes {score_duration:.0f}s")
+
+    analysis_duration = score_duration * TRIM_DURATION_RATIO if info.duration > score_duration * TRIM_DURATION_RATIO else None
+    return Preflight(timeline=timeline, sample_rate=info.samplerate, duration=info.duration, expected_duration=score_duration, analysis_duration=analysis_duration)
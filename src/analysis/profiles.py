@@ -0,0 +1,88 @@
+"""
+Analysis profiles: the sample rate, hop length and frame length each analyzer runs at.
+
+pyin only searches up to C7 (~2.1 kHz), so a 44.1 or 48 kHz native rate carries nothing the pitch tracker
+needs. The "balanced" and "fast" profiles decode the recording once and resample it with a single polyphase
+filter to a rate both analyzers share. pyin's time goes almost entirely into its per-frame pitch search and
+Viterbi decoding, so what actually buys speed is the coarser hop these lower rates allow: "balanced" tracks
+pitch every ~23ms and "fast" every ~46ms, instead of every ~11.6ms. "accurate" is the analysis as it has
+always run: pitch at the native rate, dynamics at 22050 Hz.
+
+Mismatch times and the right note window are derived from each profile's own rate and hop, so they stay in
+seconds on the recording's timeline. See benchmarks/profiles.py for the speed and agreement of each profile.
+"""
+import librosa
+import numpy as np
+import soundfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Final
+
+@dataclass(frozen=True, slots=True)
+class AnalysisProfile:
+    pitch_sample_rate: int | None
+    """None tracks pitch at the recording's native rate"""
+    pitch_hop_length: int
+    pitch_frame_length: int
+    dynamics_sample_rate: int
+    dynamics_hop_length: int
+    dynamics_frame_length: int
+
+    @property
+    def shared_sample_rate(self) -> int | None:
+        """The rate both analyzers run at, if they share one, so the recording is resampled only once"""
+        return self.pitch_sample_rate if self.pitch_sample_rate == self.dynamics_sample_rate else None
+
+PROFILES: Final[dict[str, AnalysisProfile]] = {
+    "accurate": AnalysisProfile(pitch_sample_rate=None, pitch_hop_length=512, pitch_frame_length=2048,
+                                dynamics_sample_rate=22050, dynamics_hop_length=512, dynamics_frame_length=2048),
+    # same dynamics as "accurate", pitch hops twice as long
+    "balanced": AnalysisProfile(pitch_sample_rate=22050, pitch_hop_length=512, pitch_frame_length=1024,
+                                dynamics_sample_rate=22050, dynamics_hop_length=512, dynamics_frame_length=2048),
+    # the pitch frame still fits a full period of C2 with yin's default window
+    "fast": AnalysisProfile(pitch_sample_rate=11025, pitch_hop_length=512, pitch_frame_length=512,
+                            dynamics_sample_rate=11025, dynamics_hop_length=256, dynamics_frame_length=1024),
+}
+
+DEFAULT_PROFILE: Final[AnalysisProfile] = PROFILES["accurate"]
+
+@dataclass(slots=True)
+class Recording:
+    """Part of a recording decoded once, for the analyzers to share instead of each decoding the file"""
+    y: np.ndarray
+    sample_rate: int
+    offset: float = 0.0
+    """seconds into the file where y starts"""
+
+    def load(self, offset: float = 0.0, duration: float | None = None) -> tuple[np.ndarray, int]:
+        """Same as librosa.load(path, sr=self.sample_rate, offset=offset, duration=duration), without decoding anything"""
+        start = max(int((offset - self.offset) * self.sample_rate), 0)
+        stop = len(self.y) if duration is None else start + int(duration * self.sample_rate)
+        return self.y[start:stop], self.sample_rate
+
+def load_recording(audio_path: str | Path, sample_rate: int, offset: float = 0.0, duration: float | None = None) -> Recording:
+    """Decodes duration seconds of the recording from offset, downmixed and resampled to sample_rate with a polyphase filter"""
+    with soundfile.SoundFile(audio_path) as f:
+        native_rate = f.samplerate
+        f.seek(int(offset * native_rate))
+        y = f.read(frames=-1 if duration is None else int(duration * native_rate), dtype="float32", always_2d=True)
+    y = np.mean(y, axis=1)
+    if native_rate != sample_rate:
+        y = librosa.resample(y, orig_sr=native_rate, target_sr=sample_rate, res_type="polyphase")
+    return Recording(np.ascontiguousarray(y, dtype=np.float32), sample_rate, offset)
+
+def audio_sample_rate(audio: str | Path | Recording) -> int:
+    return audio.sample_rate if isinstance(audio, Recording) else librosa.get_samplerate(audio)
+
+def load_span(audio: str | Path | Recording, sample_rate: int | None, offset: float = 0.0, duration: float | None = None,
+              res_type: str = "soxr_hq") -> tuple[np.ndarray, int]:
+    """
+    Samples of the audio between offset and offset + duration (None until the end) at sample_rate (None for the native rate),
+    from a path or from an already decoded Recording, which is only resampled if it is at another rate
+    """
+    if not isinstance(audio, Recording):
+        return librosa.load(audio, sr=sample_rate, offset=offset, duration=duration, res_type=res_type)
+    y, recording_rate = audio.load(offset, duration)
+    if sample_rate is None or sample_rate == recording_rate:
+        return y, recording_rate
+    return librosa.resample(y, orig_sr=recording_rate, target_sr=sample_rate, res_type=res_type), sample_rate
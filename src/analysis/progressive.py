@@ -0,0 +1,137 @@
+"""
+Deadline-aware pitch analysis.
+
+A coarse pass (decimated audio, large hop, yin instead of pyin) covers the whole window quickly.
+Only the regions where it finds wrong notes are then re-checked at full resolution, worst regions
+first, until the deadline. Regions that were not refined in time keep their coarse mismatches.
+"""
+import librosa
+import numpy as np
+import time
+from dataclasses import dataclass
+from typing import Final, Sequence
+
+from .profiles import DEFAULT_PROFILE, AnalysisProfile, Recording, audio_sample_rate, load_span
+from .results import MismatchTable
+from .timeline import ScoreTimeline
+from .window import AnalysisWindow
+from ..pitch.main import (DEFAULT_PITCH_LEVEL, PitchLevel, PitchMismatch, expected_pitches_for_window,
+                          find_mismatch_levels, track_pitch, tracked_span)
+
+COARSE_SAMPLE_RATE: Final[int] = 11025
+"""comfortably above twice the highest tracked pitch (C7, ~2.1 kHz)"""
+
+COARSE_HOP_LENGTH: Final[int] = 512
+"""~46ms per hop at COARSE_SAMPLE_RATE, about 4x coarser than the full-resolution pass"""
+
+COARSE_FRAME_LENGTH: Final[int] = 1024
+
+COARSE_SILENCE_DB: Final[float] = -35
+"""the coarse pass treats frames quieter than this relative to the loudest one as unvoiced"""
+
+REGION_GAP: Final[float] = 0.5
+"""coarse mismatches closer than this many seconds are refined together"""
+
+REGION_PADDING: Final[float] = 0.5
+"""seconds added on both sides of a suspicious region, the coarse pass tends to under-report the extent of a wrong note"""
+
+@dataclass(slots=True)
+class ProgressiveResult:
+    levels: list[MismatchTable]
+    """pitch feedback per requested tolerance level"""
+    refined_seconds: float
+    """seconds of suspicious regions that were re-checked at full resolution"""
+    suspicious_seconds: float
+    """seconds of suspicious regions found by the coarse pass"""
+    refined_regions: list[tuple[float, float]]
+    """(start, end) of the regions that were refined, mismatches elsewhere come from the coarse pass"""
+
+    @property
+    def feedback(self) -> MismatchTable:
+        """pitch feedback at the first tolerance level"""
+        return self.levels[0]
+
+    @property
+    def completeness(self) -> float:
+        return 1.0 if self.suspicious_seconds == 0 else self.refined_seconds / self.suspicious_seconds
+
+def coarse_pitch_check(audio_path: str | Recording, timeline: ScoreTimeline, window: AnalysisWindow, levels: Sequence[PitchLevel] = (DEFAULT_PITCH_LEVEL,)) -> list[MismatchTable]:
+    """Cheap version of pitch_check_levels: decimated audio, large hop, yin with an energy gate for voicing"""
+    expected_pitches, lead_in = expected_pitches_for_window(timeline, COARSE_SAMPLE_RATE, COARSE_HOP_LENGTH, window)
+    offset, duration = tracked_span(window, lead_in + len(expected_pitches), COARSE_SAMPLE_RATE, COARSE_HOP_LENGTH)
+    y, _ = load_span(audio_path, COARSE_SAMPLE_RATE, offset=offset, duration=duration, res_type="soxr_qq")
+
+    f0 = librosa.yin(y, fmin=librosa.note_to_hz('C2'), fmax=librosa.note_to_hz('C7'), sr=COARSE_SAMPLE_RATE, frame_length=COARSE_FRAME_LENGTH, hop_length=COARSE_HOP_LENGTH)
+    rms = librosa.feature.rms(y=y, frame_length=COARSE_FRAME_LENGTH, hop_length=COARSE_HOP_LENGTH)[0]
+    voiced_flag = rms >= rms.max(initial=0.0) * 10 ** (COARSE_SILENCE_DB / 20)
+    return find_mismatch_levels(f0, voiced_flag, expected_pitches, COARSE_SAMPLE_RATE, COARSE_HOP_LENGTH, levels, offset, lead_in)
+
+def suspicious_regions(coarse: list[MismatchTable]) -> list[tuple[float, float, int]]:
+    """Groups the coarse mismatches of every level into padded (start, end, count) regions, most mismatches first"""
+    times = np.unique(np.concatenate([table["time"] for table in coarse]))
+    if len(times) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(times) > REGION_GAP + 2 * REGION_PADDING) + 1
+    regions = [
+        (max(float(group[0]) - REGION_PADDING, 0.0), float(group[-1]) + COARSE_HOP_LENGTH / COARSE_SAMPLE_RATE + REGION_PADDING, len(group))
+        for group in np.split(times, breaks)
+    ]
+    return sorted(regions, key=lambda region: region[2], reverse=True)
+
+def refine_region(audio_path: str | Recording, expected_pitches: np.ndarray, lead_in: int, sample_rate: int, window: AnalysisWindow, start: float, end: float,
+                  levels: Sequence[PitchLevel] = (DEFAULT_PITCH_LEVEL,), profile: AnalysisProfile = DEFAULT_PROFILE) -> list[MismatchTable]:
+    """
+    Full-resolution (the profile's) pitch check of [start, end) at every level. The surrounding right note window (the widest of the levels)
+    is tracked as well, so a note played slightly early or late is judged the same way as in a full analysis.
+    Hop i of the window expects expected_pitches[i - lead_in], see expected_pitches_for_window
+    """
+    context = max(right_note_window for _, right_note_window in levels)
+    hop_length = profile.pitch_hop_length
+    seconds_per_hop = hop_length / sample_rate
+    first = max(int((start - context - window.start) / seconds_per_hop), 0)
+    last = min(int(np.ceil((end + context - window.start) / seconds_per_hop)), lead_in + len(expected_pitches))
+    if last <= first:
+        return [MismatchTable(PitchMismatch, [], [], []) for _ in levels]
+
+    offset = window.start + first * seconds_per_hop
+    y, sample_rate = load_span(audio_path, profile.pitch_sample_rate, offset=offset, duration=(last - first) * seconds_per_hop)
+    f0, voiced_flag = track_pitch(y, sample_rate, hop_length, profile.pitch_frame_length)
+    mismatches = find_mismatch_levels(f0, voiced_flag, expected_pitches, sample_rate, hop_length, levels, offset, lead_in - first)
+    return [table.between(start, end) for table in mismatches]
+
+def merge_refined(coarse: MismatchTable, refined: list[MismatchTable], regions: list[tuple[float, float]]) -> MismatchTable:
+    """Coarse mismatches outside of the refined regions, plus the refined ones, sorted by time"""
+    keep_coarse = np.ones(len(coarse), dtype=bool)
+    for start, end in regions:
+        keep_coarse &= (coarse["time"] < start) | (coarse["time"] >= end)
+    data = np.concatenate([coarse.filter(keep_coarse).data] + [table.data for table in refined], axis=1)
+    return MismatchTable.from_array(PitchMismatch, data[:, np.argsort(data[0], kind="stable")])
+
+def progressive_pitch_check(audio_path: str | Recording, timeline: ScoreTimeline, window: AnalysisWindow, deadline: float,
+                            levels: Sequence[PitchLevel] = (DEFAULT_PITCH_LEVEL,), profile: AnalysisProfile = DEFAULT_PROFILE) -> ProgressiveResult:
+    """
+    Coarse pass over the whole window, then full-resolution refinement of suspicious regions until
+    time.monotonic() reaches deadline. Every tolerance level is evaluated on the same passes.
+    """
+    coarse = coarse_pitch_check(audio_path, timeline, window, levels)
+    regions = suspicious_regions(coarse)
+    suspicious_seconds = sum(end - start for start, end, _ in regions)
+
+    sample_rate: int = profile.pitch_sample_rate or audio_sample_rate(audio_path)
+    expected_pitches, lead_in = expected_pitches_for_window(timeline, sample_rate, profile.pitch_hop_length, window)
+
+    refined: list[list[MismatchTable]] = [[] for _ in levels]
+    refined_regions: list[tuple[float, float]] = []
+    for start, end, _ in regions:
+        if time.monotonic() >= deadline:
+            break
+        for tables, table in zip(refined, refine_region(audio_path, expected_pitches, lead_in, sample_rate, window, start, end, levels, profile)):
+            tables.append(table)
+        refined_regions.append((start, end))
+
+    return ProgressiveResult(
+        levels=[merge_refined(table, tables, refined_regions) for table, tables in zip(coarse, refined)],
+        refined_seconds=sum(end - start for start, end in refined_regions),
+        suspicious_seconds=suspicious_seconds,
+        refined_regions=refined_regions,
+    )
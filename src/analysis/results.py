@@ -0,0 +1,90 @@
+"""
+Array-backed containers for analyzer results.
+Mismatches are kept as parallel NumPy columns instead of one Python object per frame,
+so they can be sliced, filtered and serialized in bulk.
+"""
+import dataclasses
+import numpy as np
+
+class MismatchTable:
+    """
+    Column-oriented collection of mismatches.
+
+    The columns are the fields of a (slotted) dataclass such as DynamicsMismatch, whose fields
+    are ("time", "expectedDB", "actualDB"). All columns live in one contiguous 2D float64 array
+    with one row per field, so each column is a zero-copy view and slicing returns views as well.
+    Rows are expected to be sorted by their first field (time).
+
+    Indexing:
+        table[3]          -> DynamicsMismatch(time=..., expectedDB=..., actualDB=...)
+        table["time"]     -> the time column
+        table[10:20]      -> MismatchTable view of those rows
+        table[mask]       -> MismatchTable of the rows where the boolean mask is True
+    """
+
+    def __init__(self, item_type: type, *columns):
+        self.item_type = item_type
+        self.names: tuple[str, ...] = tuple(field.name for field in dataclasses.fields(item_type))
+        if len(columns) != len(self.names):
+            raise ValueError(f"{item_type.__name__} has {len(self.names)} fields, got {len(columns)} columns")
+        self.data: np.ndarray = np.array(columns, dtype=np.float64, ndmin=2).reshape(len(self.names), -1)
+
+    @classmethod
+    def from_array(cls, item_type: type, data: np.ndarray) -> "MismatchTable":
+        """Wraps an existing (fields x rows) array without copying it"""
+        table = cls.__new__(cls)
+        table.item_type = item_type
+        table.names = tuple(field.name for field in dataclasses.fields(item_type))
+        if data.ndim != 2 or data.shape[0] != len(table.names):
+            raise ValueError(f"expected an array of shape ({len(table.names)}, rows), got {data.shape}")
+        table.data = data
+        return table
+
+    @classmethod
+    def from_items(cls, item_type: type, items) -> "MismatchTable":
+        """Builds a table from mismatch objects, e.g. ones produced outside of the analyzers"""
+        names = [field.name for field in dataclasses.fields(item_type)]
+        rows = [[getattr(item, name) for name in names] for item in items]
+        data = np.array(rows, dtype=np.float64).reshape(-1, len(names)).T
+        return cls.from_array(item_type, np.ascontiguousarray(data))
+
+    def __len__(self) -> int:
+        return self.data.shape[1]
+
+    def __repr__(self) -> str:
+        return f"MismatchTable({self.item_type.__name__}, {len(self)} rows)"
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.data[self.names.index(key)]
+        if isinstance(key, (int, np.integer)):
+            return self.item_type(*self.data[:, key].tolist())
+        return MismatchTable.from_array(self.item_type, self.data[:, key])
+
+    def __iter__(self):
+        for row in self.data.T.tolist():
+            yield self.item_type(*row)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.data if dtype is None else self.data.astype(dtype)
+
+    @property
+    def time(self) -> np.ndarray:
+        return self.data[0]
+
+    def columns(self) -> dict[str, np.ndarray]:
+        """Returns the columns keyed by their field names. The arrays are views into the table"""
+        return dict(zip(self.names, self.data))
+
+    def between(self, start: float, end: float) -> "MismatchTable":
+        """Rows with start <= time < end, as a view"""
+        lo, hi = np.searchsorted(self.time, [start, end], side="left")
+        return self[lo:hi]
+
+    def filter(self, mask: np.ndarray) -> "MismatchTable":
+        """Rows where the boolean mask is True"""
+        return self[np.asarray(mask, dtype=bool)]
+
+    def to_records(self) -> list[dict[str, float]]:
+        """Returns one dict per mismatch, the shape the API has always returned as JSON"""
+        return [dict(zip(self.names, row)) for row in self.data.T.tolist()]
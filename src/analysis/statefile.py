@@ -0,0 +1,54 @@
+"""
+Small JSON state files shared by every process on the box: the scheduler's ledger (see api/scheduler.py),
+the artifact index (see artifacts.py) and the memory watchdog's totals (see api/memory.py).
+
+A state file is read and changed under an exclusive flock of a .lock file next to it, and saved by writing a
+temporary file that is renamed over it. A process killed while saving leaves the previous state intact, and a state
+that can't be read anyway is logged and started over instead of failing everyone who uses it. The states record the
+pids of the processes they concern, entries of processes that died are pruned with process_alive.
+"""
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator
+
+def process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def replace_file(path: Path, text: str) -> None:
+    """Writes text to path through a temporary file renamed over it, readers see the old or the new text, never part of it"""
+    staging = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    staging.write_text(text)
+    os.replace(staging, path)
+
+def read_state(path: Path, new: Callable[[], dict]) -> dict:
+    """The state saved in path, new() if there is none or it can't be read"""
+    try:
+        text = path.read_text()
+        return json.loads(text) if text else new()
+    except FileNotFoundError:
+        return new()
+    except (ValueError, UnicodeDecodeError) as e:
+        print(f"Warning: {path} is corrupt, starting over: {str(e)}")
+        return new()
+
+@contextmanager
+def locked_state(path: Path, new: Callable[[], dict]) -> Iterator[dict]:
+    """The state saved in path (new() if there is none), locked against every other process until the block ends. Changes to it are saved"""
+    # the lock is on a file of its own, the state file is replaced on every save
+    with open(path.with_name(path.name + ".lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            state = read_state(path, new)
+            yield state
+            replace_file(path, json.dumps(state))
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
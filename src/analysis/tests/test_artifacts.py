@@ -0,0 +1,58 @@
+import multiprocessing
+import pickle
+import numpy as np
+import pytest
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from music21 import converter
+from ..artifacts import ArtifactStore, SharedTimeline, share_timeline
+from ...dynamics.feedback import compile_score
+
+TEST_FILES_DIR = Path(__file__).resolve().parents[2] / "pitch" / "test_files"
+
+def test_maps_read_only_and_evicts_unreferenced(tmp_path):
+    store = ArtifactStore(tmp_path, max_bytes=3000)
+    build = lambda: {"values": np.arange(200, dtype=np.float64)}  # ~1.7 kB as .npy
+    with store.mapped("held", build) as arrays:
+        assert isinstance(arrays["values"], np.memmap) and not arrays["values"].flags.writeable
+        with pytest.raises(ValueError):
+            arrays["values"][0] = 1
+        # over the budget, but "held" is referenced, so nothing can go
+        with store.mapped("other", build):
+            pass
+        assert store.stats()["artifacts"] == 2
+        with store.mapped("newest", build):
+            pass
+        # "other" was the least recently used one nobody referenced
+        assert (tmp_path / "held").exists() and not (tmp_path / "other").exists()
+    stats = store.stats()
+    assert (stats["artifacts"], stats["references"], stats["hits"], stats["misses"], stats["evictions"]) == (2, 0, 3, 3, 1)
+
+def expected_from_other_process(shared: SharedTimeline) -> tuple[float, np.ndarray]:
+    with shared.open() as timeline:
+        return timeline.expected_duration(), np.array(timeline.expected_pitches(22050, 512))
+
+def test_shared_timeline_is_mapped_by_other_processes(tmp_path):
+    timeline = compile_score(converter.parse(str(TEST_FILES_DIR / "test7.mxl")))
+    store = ArtifactStore(tmp_path)
+    with share_timeline(store, "timeline-test7", lambda: timeline) as shared:
+        # the handle is only its key
+        assert len(pickle.dumps(shared)) < 200
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            duration, pitches = pool.submit(expected_from_other_process, shared).result()
+        assert duration == timeline.expected_duration()
+        assert np.array_equal(pitches, timeline.expected_pitches(22050, 512), equal_nan=True)
+        # the other process published the expected pitches for everyone, and its references died with it
+        assert (tmp_path / "timeline-test7.pitches-22050-512").exists()
+        assert store.stats()["references"] == 1
+
+    with pytest.raises(LookupError):
+        with SharedTimeline("timeline-unknown", str(tmp_path)).open():
+            pass
+
+def test_corrupt_index_starts_over(tmp_path):
+    store = ArtifactStore(tmp_path)
+    (tmp_path / "index.json").write_text('{"entries": {"half')  # a process died while saving before saves were atomic
+    with store.mapped("values", lambda: {"values": np.arange(3.0)}) as arrays:
+        assert np.array_equal(arrays["values"], np.arange(3.0))
+    assert store.stats()["artifacts"] == 1
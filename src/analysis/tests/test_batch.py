@@ -0,0 +1,66 @@
+import json
+import shutil
+import pytest
+from pathlib import Path
+from ..batch import BatchJob, BatchOptions, completed_ids, find_pairs, option_fields, read_journal, read_manifest, run_batch, write_parquet
+from ..pipeline import ANALYZER_VERSION
+
+TEST_FILES_DIR = Path(__file__).resolve().parents[2] / "pitch" / "test_files"
+
+def test_finds_pairs_and_reads_manifests(tmp_path):
+    (tmp_path / "take1.wav").touch()
+    (tmp_path / "take1.mxl").touch()
+    (tmp_path / "nested").mkdir()
+    (tmp_path / "nested" / "take2.wav").touch()
+    (tmp_path / "nested" / "take2.musicxml").touch()
+    (tmp_path / "unscored.wav").touch()
+    assert [job.id for job in find_pairs(tmp_path)] == ["nested/take2.wav", "take1.wav"]
+
+    (tmp_path / "manifest.csv").write_text("audio,score,id\ntake1.wav,take1.mxl,\nnested/take2.wav,take1.mxl,second\n")
+    assert read_manifest(tmp_path / "manifest.csv") == [
+        BatchJob("take1.wav", tmp_path / "take1.wav", tmp_path / "take1.mxl"),
+        BatchJob("second", tmp_path / "nested" / "take2.wav", tmp_path / "take1.mxl"),
+    ]
+
+def test_resumes_and_retries_failures(tmp_path):
+    shutil.copy(TEST_FILES_DIR / "test7.wav", tmp_path)
+    shutil.copy(TEST_FILES_DIR / "test7.mxl", tmp_path)
+    manifest = tmp_path / "manifest.jsonl"
+    manifest.write_text(json.dumps({"audio": "test7.wav", "score": "test7.mxl"}) + "\n" + json.dumps({"audio": "test7.wav", "score": "missing.mxl", "id": "broken"}) + "\n")
+    output = tmp_path / "results.jsonl"
+    # a previous run was interrupted while writing a line
+    output.write_text(json.dumps({"id": "old", "analyzer_version": ANALYZER_VERSION, **option_fields(BatchOptions())}) + '\n{"id": "test7')
+
+    progress = run_batch(read_manifest(manifest), output, workers=1)
+    assert (progress.done, progress.failed) == (2, 1)
+    records = {record["id"]: record for record in read_journal(output)}
+    assert set(records) == {"old", "test7.wav", "broken"}
+    assert "error" in records["broken"]
+    assert set(records["test7.wav"]["pitch_feedback"]) == {"time", "expected_pitch", "actual_pitch"}
+    assert completed_ids(read_journal(output)) == {"old", "test7.wav"}
+    # results of other options don't count as done
+    assert completed_ids(read_journal(output), BatchOptions(profile="fast")) == set()
+
+    # only the failed one runs again
+    assert run_batch(read_manifest(manifest), output, workers=1).total == 1
+
+def test_parquet_keeps_every_column_and_only_current_results(tmp_path):
+    pyarrow = pytest.importorskip("pyarrow")
+    import pyarrow.parquet
+    options = BatchOptions()
+    current = {"analyzer_version": ANALYZER_VERSION, **option_fields(options)}
+    journal = tmp_path / "results.parquet.jsonl"
+    journal.write_text("".join(json.dumps(record) + "\n" for record in [
+        {"id": "broken", **current, "error": "RuntimeError: unreadable"},
+        {"id": "stale", **current, "analyzer_version": "0"},
+        {"id": "fast", **current, "profile": "fast"},
+        {"id": "take", **current, "duration": 2.0, "seconds": 1.0, "accuracy": {"dynamics_feedback": 0.5, "pitch_feedback": 1.0},
+         "dynamics_feedback": {"time": [0.5], "expectedDB": [-10.0], "actualDB": [0.0]}, "pitch_feedback": {"time": [], "expected_pitch": [], "actual_pitch": []}},
+    ]))
+    write_parquet(journal, tmp_path / "results.parquet", options)
+
+    table = pyarrow.parquet.read_table(tmp_path / "results.parquet")
+    # the failed job comes first, its missing feedback still gets its columns
+    assert table.column("id").to_pylist() == ["broken", "take"]
+    assert table.column("dynamics_feedback").to_pylist()[1]["expectedDB"] == [-10.0]
+    assert table.column("accuracy").to_pylist() == [None, {"dynamics_feedback": 0.5, "pitch_feedback": 1.0}]
@@ -0,0 +1,45 @@
+import music21
+import numpy as np
+import pytest
+import soundfile
+from pathlib import Path
+from ..preflight import preflight, expected_duration, PreflightError
+
+TEST_FILES_DIR = Path(__file__).resolve().parents[2] / "dynamics" / "mxl_test_files"
+
+def write_wav(path: Path, y: np.ndarray, sample_rate: int = 22050) -> Path:
+    soundfile.write(path, y, sample_rate)
+    return path
+
+def tone(seconds: float, sample_rate: int = 22050) -> np.ndarray:
+    return 0.5 * np.sin(2 * np.pi * 440 * np.arange(int(seconds * sample_rate)) / sample_rate)
+
+def test_expected_duration_follows_tempo():
+    score = music21.converter.parse(str(TEST_FILES_DIR / "test8.mxl"))
+    # 16 quarter notes at 80 bpm
+    assert expected_duration(score) == pytest.approx(12.0)
+
+def test_accepts_recording_of_score_length():
+    check = preflight(TEST_FILES_DIR / "test7.wav", TEST_FILES_DIR / "test7.mxl")
+    assert check.analysis_duration is None
+    assert check.duration == pytest.approx(soundfile.info(TEST_FILES_DIR / "test7.wav").duration)
+
+def test_rejects_silence(tmp_path):
+    with pytest.raises(PreflightError, match="silent"):
+        preflight(write_wav(tmp_path / "silent.wav", np.zeros(22050 * 5)), TEST_FILES_DIR / "test8.mxl")
+
+def test_rejects_garbage(tmp_path):
+    (tmp_path / "garbage.wav").write_bytes(b"not a wav file")
+    with pytest.raises(PreflightError, match="readable"):
+        preflight(tmp_path / "garbage.wav", TEST_FILES_DIR / "test8.mxl")
+
+def test_trims_then_rejects_long_recordings(tmp_path):
+    check = preflight(write_wav(tmp_path / "long.wav", tone(40)), TEST_FILES_DIR / "test8.mxl")
+    assert check.analysis_duration == pytest.approx(36.0)
+    with pytest.raises(PreflightError, match="long"):
+        preflight(write_wav(tmp_path / "longer.wav", tone(130)), TEST_FILES_DIR / "test8.mxl")
+
+def test_rejects_score_without_notes():
+    score = music21.stream.Score([music21.stream.Part([music21.note.Rest(quarterLength=4)])])
+    with pytest.raises(PreflightError, match="no notes"):
+        expected_duration(score)
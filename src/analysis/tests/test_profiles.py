@@ -0,0 +1,34 @@
+import librosa
+import numpy as np
+import soundfile
+from pathlib import Path
+from ..profiles import PROFILES, load_recording, load_span
+from ..window import find_active_window
+from ...dynamics.feedback import compile_score
+from ...pitch.main import pitch_check_timeline
+from music21 import converter
+
+TEST_FILES_DIR = Path(__file__).resolve().parents[2] / "pitch" / "test_files"
+
+def test_recording_spans_line_up_with_the_file():
+    path = TEST_FILES_DIR / "test7.wav"
+    recording = load_recording(path, 22050, offset=1.0, duration=8.0)
+    y, sample_rate = load_span(recording, 22050, offset=3.0, duration=2.0)
+    reference, _ = librosa.load(path, sr=22050, offset=3.0, duration=2.0)
+    assert sample_rate == 22050 and len(y) == len(reference)
+    # different resamplers, same signal
+    assert np.corrcoef(y, reference)[0, 1] > 0.99
+
+def test_profiles_report_wrong_notes_in_recording_seconds(tmp_path):
+    y, sample_rate = soundfile.read(TEST_FILES_DIR / "test7.wav")
+    half = len(y) // 2
+    y[half:half + 2 * sample_rate] = 0.3 * np.sin(2 * np.pi * 1000 * np.arange(2 * sample_rate) / sample_rate)[:, None]
+    soundfile.write(tmp_path / "wrong.wav", y, sample_rate)
+    window = find_active_window(tmp_path / "wrong.wav", duration=soundfile.info(tmp_path / "wrong.wav").duration)
+    timeline = compile_score(converter.parse(str(TEST_FILES_DIR / "test7.mxl")))
+
+    for name, profile in PROFILES.items():
+        audio = tmp_path / "wrong.wav" if profile.shared_sample_rate is None else load_recording(tmp_path / "wrong.wav", profile.shared_sample_rate)
+        times = pitch_check_timeline(audio, timeline, window=window, profile=profile)["time"]
+        in_tone = (times >= half / sample_rate - 0.1) & (times <= half / sample_rate + 2.1)
+        assert in_tone.mean() > 0.5, name
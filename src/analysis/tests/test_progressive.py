@@ -0,0 +1,41 @@
+import time
+import music21
+import numpy as np
+import soundfile
+from pathlib import Path
+from ..progressive import progressive_pitch_check
+from ..window import find_active_window
+from ...dynamics.feedback import compile_score
+from ...pitch.main import pitch_check_score
+
+TEST_FILES_DIR = Path(__file__).resolve().parents[2] / "pitch" / "test_files"
+
+def recording_with_wrong_note(tmp_path: Path) -> Path:
+    y, sample_rate = soundfile.read(TEST_FILES_DIR / "test7.wav")
+    y = y[:, 0] if y.ndim > 1 else y
+    half = len(y) // 2
+    y[half:half + 2 * sample_rate] = 0.3 * np.sin(2 * np.pi * 1000 * np.arange(2 * sample_rate) / sample_rate)
+    soundfile.write(tmp_path / "wrong.wav", y, sample_rate)
+    return tmp_path / "wrong.wav"
+
+def test_expired_deadline_returns_coarse_result(tmp_path):
+    path = recording_with_wrong_note(tmp_path)
+    score = music21.converter.parse(str(TEST_FILES_DIR / "test7.mxl"))
+    window = find_active_window(path, duration=soundfile.info(path).duration)
+
+    result = progressive_pitch_check(str(path), compile_score(score), window, deadline=time.monotonic() - 1)
+    assert result.suspicious_seconds > 0
+    assert result.completeness == 0.0
+    assert len(result.feedback) > 0
+
+def test_refined_mismatches_match_full_analysis(tmp_path):
+    path = recording_with_wrong_note(tmp_path)
+    score = music21.converter.parse(str(TEST_FILES_DIR / "test7.mxl"))
+    window = find_active_window(path, duration=soundfile.info(path).duration)
+
+    result = progressive_pitch_check(str(path), compile_score(score), window, deadline=time.monotonic() + 600)
+    full = pitch_check_score(str(path), score, window=window)
+    assert result.completeness == 1.0
+    assert len(result.feedback) > 0
+    assert np.isin(np.round(result.feedback["time"], 6), np.round(full["time"], 6)).all()
+    assert np.all(np.diff(result.feedback["time"]) >= 0)
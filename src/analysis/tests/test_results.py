@@ -0,0 +1,31 @@
+import numpy as np
+from ..results import MismatchTable
+from ...pitch.main import PitchMismatch
+
+def pitch_table(rows: int = 5) -> MismatchTable:
+    return MismatchTable(PitchMismatch, np.arange(rows, dtype=float), np.full(rows, 440.0), np.arange(rows) + 400.0)
+
+def test_items_are_slotted_dataclasses():
+    table = pitch_table()
+    assert table[2] == PitchMismatch(time=2.0, expected_pitch=440.0, actual_pitch=402.0)
+    assert not hasattr(table[2], "__dict__")
+    assert list(table)[-1].actual_pitch == 404.0
+
+def test_slicing_is_zero_copy():
+    table = pitch_table()
+    window = table[1:3]
+    assert len(window) == 2
+    assert np.shares_memory(window.data, table.data)
+    assert np.shares_memory(table["actual_pitch"], table.data)
+
+def test_between_and_filter():
+    table = pitch_table()
+    assert table.between(1.0, 3.0)["time"].tolist() == [1.0, 2.0]
+    assert table.between(10.0, 20.0).to_records() == []
+    assert table.filter(table["actual_pitch"] > 402.0)["time"].tolist() == [3.0, 4.0]
+
+def test_from_items_roundtrip():
+    items = [PitchMismatch(time=0.5, expected_pitch=261.63, actual_pitch=float("nan"))]
+    table = MismatchTable.from_items(PitchMismatch, items)
+    assert table["expected_pitch"].tolist() == [261.63]
+    assert len(MismatchTable.from_items(PitchMismatch, [])) == 0
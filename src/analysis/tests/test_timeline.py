@@ -0,0 +1,50 @@
+import music21
+import numpy as np
+import pytest
+from music21 import converter, duration, dynamics, note, stream, tempo
+from pathlib import Path
+from ..timeline import ScoreTimeline
+from ...dynamics.feedback import compile_score, dynamic_to_rms
+from ...pitch.main import get_tempos
+
+TEST_FILES_DIR = Path(__file__).resolve().parents[2] / "dynamics" / "mxl_test_files"
+
+def triplet_score() -> music21.stream.Score:
+    measure = stream.Measure([tempo.MetronomeMark(number=97), dynamics.Dynamic("p")])
+    for i in range(6):
+        measure.append(note.Note(60 + i, duration=duration.Duration(1 / 3)))
+    measure.append(note.Rest(quarterLength=1 / 3))
+    measure.append(dynamics.Dynamic("f"))
+    measure.append(tempo.MetronomeMark(number=131.5))
+    for i in range(4):
+        measure.append(note.Note(70 - i, quarterLength=0.75))
+    return stream.Score([stream.Part([measure])])
+
+def test_round_trip_keeps_exact_beats():
+    timeline = ScoreTimeline.from_bytes(compile_score(triplet_score()).to_bytes())
+    assert timeline.tempos() == get_tempos(triplet_score())
+    assert timeline.dynamics() == [(0.0, dynamic_to_rms["p"]), (timeline.tempos()[1][0], dynamic_to_rms["f"])]
+    assert len(timeline.expected_pitches(22050, 512)) > 0
+
+def test_expected_duration():
+    timeline = compile_score(converter.parse(str(TEST_FILES_DIR / "test8.mxl")))
+    # 16 quarter notes at 80 bpm
+    assert timeline.expected_duration() == pytest.approx(12.0)
+
+def test_measure_seconds():
+    timeline = ScoreTimeline.from_bytes(compile_score(converter.parse(str(TEST_FILES_DIR / "test8.mxl"))).to_bytes())
+    seconds, numbers = timeline.measure_seconds()
+    assert numbers.tolist() == [1, 2, 3, 4]
+    assert seconds == pytest.approx([0, 3, 6, 9])
+
+def test_unknown_dynamics_stay_unknown():
+    # test11 has an "fff" marking, which has no level
+    timeline = ScoreTimeline.from_bytes(compile_score(converter.parse(str(TEST_FILES_DIR / "test11.mxl"))).to_bytes())
+    assert timeline.dynamics()[1] == (2.5, None)
+
+def test_rejects_other_versions(monkeypatch):
+    from .. import timeline
+    data = compile_score(triplet_score()).to_bytes()
+    monkeypatch.setattr(timeline, "TIMELINE_VERSION", timeline.TIMELINE_VERSION + 1)
+    with pytest.raises(ValueError):
+        ScoreTimeline.from_bytes(data)
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+from pathlib import Path
+from ..pipeline import analyze
+from ..tolerance import DEFAULT_TOLERANCE, Tolerance, parse_tolerance, parse_tolerance_levels
+
+TEST_FILES_DIR = Path(__file__).resolve().parents[2] / "pitch" / "test_files"
+
+def test_parse_tolerance_fills_in_from_base():
+    assert parse_tolerance({"dynamics_db": 3}) == Tolerance(dynamics_db=3.0)
+    levels = parse_tolerance_levels({"strict": {"pitch_delta": 0.2}}, base=Tolerance(dynamics_db=2))
+    assert levels == {"strict": Tolerance(dynamics_db=2.0, pitch_delta=0.2, right_note_window=DEFAULT_TOLERANCE.right_note_window)}
+
+@pytest.mark.parametrize("value", [{"dynamics_db": -1}, {"pitch_delta": True}, {"pitch": 0.5}, {"right_note_window": 60}, [3]])
+def test_parse_tolerance_rejects_invalid(value):
+    with pytest.raises(ValueError):
+        parse_tolerance(value)
+
+def test_parse_tolerance_levels_rejects_invalid_names():
+    with pytest.raises(ValueError):
+        parse_tolerance_levels({"a;b": {}})
+
+def test_levels_are_nested_and_default_matches():
+    levels = {"strict": Tolerance(dynamics_db=2, pitch_delta=0.1, right_note_window=0.1), "lenient": Tolerance(dynamics_db=10, pitch_delta=0.9, right_note_window=2)}
+    analysis = analyze(TEST_FILES_DIR / "test9.wav", TEST_FILES_DIR / "test9.mxl", levels=levels)
+    default = analyze(TEST_FILES_DIR / "test9.wav", TEST_FILES_DIR / "test9.mxl")
+    for kind in ["dynamics_feedback", "pitch_feedback"]:
+        assert np.array_equal(analysis.feedback[kind].data, default.feedback[kind].data, equal_nan=True)
+        strict, normal, lenient = (set(np.round(feedback[kind]["time"], 6)) for feedback in [analysis.levels["strict"], analysis.feedback, analysis.levels["lenient"]])
+        assert strict >= normal >= lenient
+        assert len(strict) > len(lenient)
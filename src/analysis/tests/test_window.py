@@ -0,0 +1,70 @@
+import music21
+import numpy as np
+import pytest
+import soundfile
+from pathlib import Path
+from ..window import find_active_window, WINDOW_MARGIN
+from ...dynamics.feedback import compile_score, get_dynamics_feedback_for_timeline
+from ...pitch.main import pitch_check_score
+
+TEST_FILES_DIR = Path(__file__).resolve().parents[2] / "pitch" / "test_files"
+
+def test_finds_playing_between_silences(tmp_path):
+    sample_rate = 22050
+    tone = 0.5 * np.sin(2 * np.pi * 440 * np.arange(2 * sample_rate) / sample_rate)
+    silence = np.zeros(3 * sample_rate)
+    soundfile.write(tmp_path / "padded.wav", np.concatenate([silence, tone, silence]), sample_rate)
+
+    window = find_active_window(tmp_path / "padded.wav", duration=8.0)
+    assert window.onset == pytest.approx(3.0, abs=0.2)
+    assert window.release == pytest.approx(5.0, abs=0.2)
+    assert window.start == pytest.approx(window.onset - WINDOW_MARGIN)
+    assert window.end == pytest.approx(window.release + WINDOW_MARGIN)
+
+def test_soft_opening_and_ending_count_as_playing(tmp_path):
+    sample_rate = 22050
+    tone = lambda seconds, db: 10 ** (db / 20) * 0.5 * np.sin(2 * np.pi * 440 * np.arange(int(seconds * sample_rate)) / sample_rate)
+    silence = np.zeros(sample_rate)
+    # pp is 40 dB below ff, see dynamic_to_rms
+    soundfile.write(tmp_path / "soft.wav", np.concatenate([silence, tone(3, -40), tone(3, 0), tone(3, -40), silence]), sample_rate)
+
+    window = find_active_window(tmp_path / "soft.wav", duration=11.0)
+    assert window.onset == pytest.approx(1.0, abs=0.2)
+    assert window.release == pytest.approx(10.0, abs=0.2)
+
+def test_window_stays_inside_recording(tmp_path):
+    sample_rate = 22050
+    soundfile.write(tmp_path / "tone.wav", 0.5 * np.sin(np.arange(2 * sample_rate)), sample_rate)
+    window = find_active_window(tmp_path / "tone.wav", duration=2.0)
+    assert window.start == 0.0 and window.onset == 0.0
+    assert window.end <= 2.0
+
+def test_pitch_times_are_on_the_original_timeline(tmp_path):
+    y, sample_rate = soundfile.read(TEST_FILES_DIR / "test2.wav")
+    # replace the second half with a constant wrong note so there are mismatches to locate
+    y = y[:, 0] if y.ndim > 1 else y
+    half = len(y) // 2
+    y[half:] = 0.3 * np.sin(2 * np.pi * 1000 * np.arange(len(y) - half) / sample_rate)
+    silence = np.zeros(4 * sample_rate)
+    soundfile.write(tmp_path / "padded.wav", np.concatenate([silence, y, silence]), sample_rate)
+
+    score = music21.converter.parse(str(TEST_FILES_DIR / "test2.mxl"))
+    window = find_active_window(tmp_path / "padded.wav", duration=soundfile.info(tmp_path / "padded.wav").duration)
+    mismatches = pitch_check_score(str(tmp_path / "padded.wav"), score, window=window)
+    assert len(mismatches) > 0
+    assert mismatches["time"].min() >= 4.0 + half / sample_rate - 1.5
+    assert mismatches["time"].max() <= window.end
+
+def test_dynamics_compares_only_the_played_part(tmp_path):
+    y, sample_rate = soundfile.read(TEST_FILES_DIR / "test7.wav")
+    y = y[:, 0] if y.ndim > 1 else y
+    silence = np.zeros(2 * sample_rate)
+    soundfile.write(tmp_path / "padded.wav", np.concatenate([silence, y, silence]), sample_rate)
+
+    window = find_active_window(tmp_path / "padded.wav", duration=soundfile.info(tmp_path / "padded.wav").duration)
+    assert window.start < window.onset  # there is a margin to load
+    mismatches = get_dynamics_feedback_for_timeline(compile_score(music21.converter.parse(str(TEST_FILES_DIR / "test7.mxl"))),
+                                                    str(tmp_path / "padded.wav"), window=window)
+    assert len(mismatches) > 0
+    assert mismatches["time"].min() >= window.onset - 0.05
+    assert mismatches["time"].max() <= window.release + 0.05
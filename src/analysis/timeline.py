@@ -0,0 +1,192 @@
+"""
+Compact, precompiled form of a score: the note timeline, tempo map, dynamics and measures of its first part.
+
+Everything the analyzers need from a score is here, so an analysis against an ingested score
+neither downloads the mxl nor runs converter.parse. Beat positions and note lengths are kept as
+exact fractions, so the expected pitch and dynamics arrays come out identical to the ones built
+from the parsed score.
+"""
+import io
+import music21
+import numpy as np
+from dataclasses import dataclass, field, fields
+from fractions import Fraction
+from music21.common.numberTools import opFrac
+from typing import Final
+
+TIMELINE_VERSION: Final[int] = 2
+"""bumped whenever the serialized layout changes, older artifacts are then recompiled"""
+
+def to_ratios(beats) -> np.ndarray:
+    """Beat positions or lengths as a (n, 2) array of exact numerators and denominators"""
+    ratios = [Fraction(beat) for beat in beats]
+    return np.array([(ratio.numerator, ratio.denominator) for ratio in ratios], dtype=np.int64).reshape(-1, 2)
+
+def from_ratios(ratios: np.ndarray) -> list:
+    """Inverse of to_ratios, with the same float or Fraction types music21 uses for offsets"""
+    return [opFrac(Fraction(int(numerator), int(denominator))) for numerator, denominator in ratios]
+
+def ratios_to_float(ratios: np.ndarray) -> np.ndarray:
+    return ratios[:, 0] / ratios[:, 1] if len(ratios) else np.zeros(0)
+
+def as_number(value: float) -> int | float | None:
+    """Restores the number types of the parsed score, with nan standing for None"""
+    if np.isnan(value):
+        return None
+    return int(value) if float(value).is_integer() else float(value)
+
+@dataclass(slots=True)
+class ScoreTimeline:
+    note_lengths: np.ndarray
+    """(notes, 2) exact quarter lengths of the notes and rests of the first part"""
+    note_frequencies: np.ndarray
+    """frequency of each note in Hz, nan for rests"""
+    tempo_beats: np.ndarray
+    """(tempos, 2) exact beat of each tempo change, the first one is at beat 0"""
+    tempo_bpm: np.ndarray
+    dynamic_beats: np.ndarray
+    """(dynamics, 2) exact beat of each dynamics marking, the first one is at beat 0"""
+    dynamic_db: np.ndarray
+    """expected level of each dynamics marking in dB, nan for markings without a level"""
+    measure_beats: np.ndarray = field(default_factory=lambda: to_ratios([]))
+    """(measures, 2) exact beat at which each measure starts"""
+    measure_numbers: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.int64))
+    """number of each measure as printed in the score"""
+
+    @classmethod
+    def from_score(cls, score: music21.stream.Score, tempos_list: list[tuple[float, int]], dynamics_levels: list[tuple[float, float]] = ()) -> "ScoreTimeline":
+        """
+        Timeline of the first part of score. tempos_list is (beat, bpm) as returned by get_tempos, dynamics_levels
+        is (beat, dB) and only needed for expected_rms
+        """
+        notes_and_rests = list(score.parts[0].recurse().notesAndRests) if score.parts else []
+        measures = list(score.parts[0].getElementsByClass(music21.stream.Measure)) if score.parts else []
+        return cls(
+            note_lengths=to_ratios(note.duration.quarterLength for note in notes_and_rests),
+            note_frequencies=np.array([note.pitch.frequency if note.isNote else np.nan for note in notes_and_rests], dtype=np.float64),
+            tempo_beats=to_ratios(beat for beat, _ in tempos_list),
+            tempo_bpm=np.array([bpm for _, bpm in tempos_list], dtype=np.float64),
+            dynamic_beats=to_ratios(beat for beat, _ in dynamics_levels),
+            dynamic_db=np.array([db for _, db in dynamics_levels], dtype=np.float64),
+            measure_beats=to_ratios(measure.offset for measure in measures),
+            measure_numbers=np.array([measure.number for measure in measures], dtype=np.int64),
+        )
+
+    @property
+    def has_notes(self) -> bool:
+        return bool(np.any(~np.isnan(self.note_frequencies)))
+
+    def tempos(self) -> list[tuple[float, int | float]]:
+        return list(zip(from_ratios(self.tempo_beats), map(as_number, self.tempo_bpm)))
+
+    def dynamics(self) -> list[tuple[float, int | float | None]]:
+        return list(zip(from_ratios(self.dynamic_beats), map(as_number, self.dynamic_db)))
+
+    def expected_duration(self) -> float:
+        """Length in seconds, following the tempo changes"""
+        tempos_list = self.tempos()
+        seconds, cur_beat, tempo_ptr = 0.0, 0.0, 0
+        for note_length in from_ratios(self.note_lengths):
+            while tempo_ptr < len(tempos_list) - 1 and tempos_list[tempo_ptr + 1][0] <= cur_beat:
+                tempo_ptr += 1
+            seconds += note_length / tempos_list[tempo_ptr][1] * 60
+            cur_beat += note_length
+        return seconds
+
+    def note_beats(self) -> np.ndarray:
+        """(notes + 1) beat at which every note or rest starts, followed by the end of the last one"""
+        return np.concatenate([[0.0], np.cumsum(ratios_to_float(self.note_lengths))])
+
+    def beats_to_seconds(self, beats: np.ndarray) -> np.ndarray:
+        """Score time in seconds of beat positions, following the tempo changes"""
+        tempo_beats, seconds_per_beat = ratios_to_float(self.tempo_beats), 60 / self.tempo_bpm
+        tempo_seconds = np.concatenate([[0.0], np.cumsum(np.diff(tempo_beats) * seconds_per_beat[:-1])])
+        tempo_i = np.maximum(np.searchsorted(tempo_beats, beats, side="right") - 1, 0)
+        return tempo_seconds[tempo_i] + (beats - tempo_beats[tempo_i]) * seconds_per_beat[tempo_i]
+
+    def measure_seconds(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Score time in seconds at which each measure starts, and the measure numbers.
+        A score without measures counts as a single measure 1
+        """
+        if len(self.measure_beats) == 0:
+            return np.zeros(1), np.ones(1, dtype=np.int64)
+        return self.beats_to_seconds(ratios_to_float(self.measure_beats)), self.measure_numbers
+
+    def marking_of(self, beats: np.ndarray) -> np.ndarray:
+        """Index of the dynamics marking in effect at each beat position"""
+        return np.maximum(np.searchsorted(ratios_to_float(self.dynamic_beats), beats, side="right") - 1, 0)
+
+    def expected_pitches(self, sample_rate: int, hop_length: int) -> list[float]:
+        """Expected pitch per hop, see pitch.main.find_expected_pitches"""
+        tempos_list = self.tempos()
+        expected_pitches: list[float] = []
+        tempo_ptr, cur_beat = 0, 0.0
+        for note_length, pitch in zip(from_ratios(self.note_lengths), self.note_frequencies.tolist()):
+            next_note_change = cur_beat + note_length
+            next_tempo_change = tempos_list[tempo_ptr + 1][0] if tempo_ptr < len(tempos_list) - 1 else float('inf')
+
+            samples = int(((next_note_change - cur_beat) / tempos_list[tempo_ptr][1] * 60) * sample_rate / hop_length)
+            expected_pitches.extend([pitch] * samples)
+            cur_beat = next_note_change
+
+            # tempo only changes on note changes
+            if next_tempo_change == next_note_change:
+                tempo_ptr += 1
+        return expected_pitches
+
+    def expected_rms(self, sample_rate: int, rest_db: float) -> tuple[list, list]:
+        """Expected level and score position per sample, see dynamics.feedback.rms_note_by_note"""
+        tempos_list, dynamics_list = self.tempos(), self.dynamics()
+        note_lengths, is_note = from_ratios(self.note_lengths), ~np.isnan(self.note_frequencies)
+
+        expected_rms: list[float] = []
+        time_points: list[float] = []
+        note_ptr, dyn_ptr, tempo_ptr = 0, 0, 0
+        cur_beat = 0.0
+        while note_ptr < len(note_lengths):
+            next_note_change = cur_beat + note_lengths[note_ptr]
+            next_dynamic_change = dynamics_list[dyn_ptr + 1][0] if dyn_ptr < len(dynamics_list) - 1 else float('inf')
+            next_tempo_change = tempos_list[tempo_ptr + 1][0] if tempo_ptr < len(tempos_list) - 1 else float('inf')
+
+            cur_end = next_note_change
+            cur_tempo = tempos_list[tempo_ptr][1]
+            cur_dyn = dynamics_list[dyn_ptr][1] if is_note[note_ptr] else rest_db
+
+            if next_dynamic_change < next_note_change:
+                cur_end = next_dynamic_change
+                dyn_ptr += 1
+            else:
+                if next_tempo_change == next_note_change:
+                    tempo_ptr += 1
+                note_ptr += 1
+
+            samples = int(((cur_end - cur_beat) / cur_tempo) * sample_rate)
+            expected_rms.extend([cur_dyn] * samples)
+            time_points.extend(np.linspace(cur_beat, cur_end, samples, endpoint=False))
+            cur_beat = min(next_note_change, next_dynamic_change, next_tempo_change)
+        return expected_rms, time_points
+
+    def to_arrays(self) -> dict[str, np.ndarray]:
+        """The timeline's arrays by field name, with the TIMELINE_VERSION they were written by"""
+        return {"version": np.array(TIMELINE_VERSION), **{name: getattr(self, name) for name in TIMELINE_FIELDS}}
+
+    @classmethod
+    def from_arrays(cls, arrays) -> "ScoreTimeline":
+        """Inverse of to_arrays, without copying the arrays. Raises ValueError for arrays written by another TIMELINE_VERSION"""
+        if int(arrays["version"]) != TIMELINE_VERSION:
+            raise ValueError(f"Timeline version {int(arrays['version'])} is not {TIMELINE_VERSION}")
+        return cls(**{name: arrays[name] for name in TIMELINE_FIELDS})
+
+    def to_bytes(self) -> bytes:
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, **self.to_arrays())
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "ScoreTimeline":
+        """Raises ValueError for artifacts written by another TIMELINE_VERSION"""
+        with np.load(io.BytesIO(data)) as arrays:
+            return cls.from_arrays({name: arrays[name] for name in arrays.files})
+
+TIMELINE_FIELDS: Final[tuple[str, ...]] = tuple(field.name for field in fields(ScoreTimeline))
@@ -0,0 +1,68 @@
+"""
+Per-request tolerances of the analyzers.
+
+A request can ask for several tolerance levels at once (e.g. strict and lenient grading). The recording is
+pitch tracked and its RMS extracted once, and the deviation of every frame from the score is computed once as
+well; each level only thresholds those deviations, so extra levels cost next to nothing.
+"""
+import math
+import re
+from dataclasses import dataclass, fields, replace
+from typing import Final
+
+from ..dynamics.feedback import dynamics_tolerance_db
+from ..pitch.compare_pitch import DELTA_COEFF
+from ..pitch.main import RIGHT_NOTE_WINDOW, PitchLevel
+
+MAX_TOLERANCE_LEVELS: Final[int] = 8
+"""most levels one request can ask for"""
+
+MAX_RIGHT_NOTE_WINDOW: Final[float] = 5
+"""seconds, the pitch comparison does work proportional to the widest window for every frame"""
+
+LEVEL_NAME: Final[re.Pattern] = re.compile(r"[A-Za-z0-9_-]{1,32}")
+"""level names end up in response keys and in the X-Warbler-Layout header, so they are kept plain"""
+
+@dataclass(frozen=True, slots=True)
+class Tolerance:
+    dynamics_db: float = dynamics_tolerance_db
+    """how many dB the level may be off from the expected one"""
+    pitch_delta: float = DELTA_COEFF
+    """how close a pitch must be, as a fraction of the way to the neighbouring semitone (see compare_pitch.similar)"""
+    right_note_window: float = RIGHT_NOTE_WINDOW
+    """seconds around each frame within which the right note may be played"""
+
+    @property
+    def pitch_level(self) -> PitchLevel:
+        return (self.pitch_delta, self.right_note_window)
+
+DEFAULT_TOLERANCE: Final[Tolerance] = Tolerance()
+
+def parse_tolerance(value, base: Tolerance = DEFAULT_TOLERANCE) -> Tolerance:
+    """
+    Tolerance from a request's JSON object such as {"dynamics_db": 3, "pitch_delta": 0.25}. Fields it leaves out
+    are taken from base. Raises ValueError if it isn't a valid tolerance
+    """
+    if not isinstance(value, dict):
+        raise ValueError(f"A tolerance must be an object, got {value!r}")
+    names = {field.name for field in fields(Tolerance)}
+    unknown = sorted(set(value) - names)
+    if unknown:
+        raise ValueError(f"Unknown tolerance fields {', '.join(unknown)}, expected some of {', '.join(sorted(names))}")
+    for name, number in value.items():
+        if isinstance(number, bool) or not isinstance(number, (int, float)) or not math.isfinite(number) or number < 0:
+            raise ValueError(f"Tolerance '{name}' must be a non-negative number, got {number!r}")
+    if value.get("right_note_window", 0) > MAX_RIGHT_NOTE_WINDOW:
+        raise ValueError(f"Tolerance 'right_note_window' can be at most {MAX_RIGHT_NOTE_WINDOW} seconds, got {value['right_note_window']}")
+    return replace(base, **{name: float(number) for name, number in value.items()})
+
+def parse_tolerance_levels(value, base: Tolerance = DEFAULT_TOLERANCE) -> dict[str, Tolerance]:
+    """Named levels from a request's JSON object of tolerances, see parse_tolerance. Raises ValueError for invalid ones"""
+    if not isinstance(value, dict):
+        raise ValueError(f"Tolerance levels must be an object of named tolerances, got {value!r}")
+    if len(value) > MAX_TOLERANCE_LEVELS:
+        raise ValueError(f"At most {MAX_TOLERANCE_LEVELS} tolerance levels can be requested, got {len(value)}")
+    for name in value:
+        if not LEVEL_NAME.fullmatch(name):
+            raise ValueError(f"Tolerance level names must be 1-32 letters, digits, '-' or '_', got {name!r}")
+    return {name: parse_tolerance(level, base) for name, level in value.items()}
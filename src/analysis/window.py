@@ -0,0 +1,84 @@
+"""
+Finds the part of a recording where the performer is actually playing, so the expensive
+analyzers can skip the silence before and after it.
+"""
+import numpy as np
+import soundfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Final
+
+ENERGY_DECIMATION: Final[int] = 16
+"""only every ENERGY_DECIMATION-th sample is looked at by the energy envelope"""
+
+ENERGY_WINDOW: Final[int] = 256
+"""window (in decimated samples) the energy envelope computes RMS over"""
+
+NOISE_PERCENTILE: Final[float] = 10
+"""percentile of the envelope taken as the recording's noise floor"""
+
+ABOVE_NOISE_DB: Final[float] = 10
+"""windows at least this much louder than the noise floor count as playing"""
+
+MIN_ACTIVE_DBFS: Final[float] = -60
+"""windows quieter than this in absolute terms never count as playing, e.g. dither over digital silence"""
+
+MAX_BELOW_PEAK_DB: Final[float] = -50
+"""
+the threshold is never higher than this relative to the loudest window. It is below pp (-40 dB against ff, see
+dynamic_to_rms in dynamics/feedback.py), so soft playing counts even in a recording without silence to measure the noise on
+"""
+
+WINDOW_MARGIN: Final[float] = 0.5
+"""seconds of context kept before the first and after the last active window"""
+
+@dataclass(slots=True)
+class AnalysisWindow:
+    """Region of a recording to analyze. All values are seconds on the recording's own timeline"""
+    start: float
+    """start of the analyzed region, the onset minus the margin"""
+    end: float
+    """end of the analyzed region, the release plus the margin"""
+    onset: float
+    """where the performer starts playing, the score is aligned to this"""
+    release: float
+    """where the performer stops playing"""
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+def energy_envelope(audio_path: str | Path, duration: float | None = None) -> tuple[np.ndarray, float]:
+    """
+    RMS of consecutive windows of the recording, computed on a signal decimated by ENERGY_DECIMATION.
+    Returns the RMS values and the length of one window in seconds.
+    """
+    info = soundfile.info(audio_path)
+    frames = -1 if duration is None else int(duration * info.samplerate)
+    blocksize = ENERGY_DECIMATION * ENERGY_WINDOW * 64
+    envelope: list[np.ndarray] = []
+    for block in soundfile.blocks(audio_path, blocksize=blocksize, frames=frames, dtype="float32", always_2d=True):
+        samples = block[::ENERGY_DECIMATION].mean(axis=1)
+        usable = len(samples) // ENERGY_WINDOW * ENERGY_WINDOW
+        envelope.append(np.sqrt(np.mean(samples[:usable].reshape(-1, ENERGY_WINDOW) ** 2, axis=1)))
+    return (np.concatenate(envelope) if envelope else np.zeros(0)), ENERGY_DECIMATION * ENERGY_WINDOW / info.samplerate
+
+def full_window(duration: float) -> AnalysisWindow:
+    """Window covering the whole recording, equivalent to not windowing at all"""
+    return AnalysisWindow(start=0.0, end=duration, onset=0.0, release=duration)
+
+def find_active_window(audio_path: str | Path, duration: float, margin: float = WINDOW_MARGIN) -> AnalysisWindow:
+    """
+    Cheap energy-threshold pass over the first duration seconds of the recording. Playing is whatever stands out
+    from the noise floor, however soft. Returns the whole range if nothing stands out from it.
+    """
+    envelope, window_seconds = energy_envelope(audio_path, duration=duration)
+    if len(envelope) == 0 or envelope.max() <= 0:
+        return full_window(duration)
+
+    noise = np.percentile(envelope, NOISE_PERCENTILE)
+    threshold = min(max(noise * 10 ** (ABOVE_NOISE_DB / 20), 10 ** (MIN_ACTIVE_DBFS / 20)), envelope.max() * 10 ** (MAX_BELOW_PEAK_DB / 20))
+    active = np.flatnonzero(envelope >= threshold)
+    onset = float(active[0] * window_seconds)
+    release = min(float((active[-1] + 1) * window_seconds), duration)
+    return AnalysisWindow(start=max(onset - margin, 0.0), end=min(release + margin, duration), onset=onset, release=release)
@@ -0,0 +1,151 @@
+"""
+Deduplication of uploaded recordings.
+
+Uploads are hashed while they stream to S3. The hash -> id index lives in the same bucket under
+INDEX_PREFIX, one small object per hash, written with a conditional put so concurrent workers
+agree on which id was first. Optionally a perceptual fingerprint of the whole recording is indexed as well,
+so the same take saved with another sample rate, bit depth or channel layout is recognized. A fingerprint match
+is never treated as proof: both uploads are kept and the earlier id is only reported as similar.
+"""
+import hashlib
+import os
+import botocore.exceptions
+import librosa
+import numpy as np
+import soundfile
+from typing import BinaryIO, Final
+
+INDEX_PREFIX: Final[str] = "index/"
+"""S3 key prefix for the hash -> id index"""
+
+FINGERPRINT_ENABLED: Final[bool] = os.getenv("WAV_FINGERPRINT_DEDUP", "0") == "1"
+"""perceptual fingerprinting decodes the upload, so it is opt-in"""
+
+FINGERPRINT_SAMPLE_RATE: Final[int] = 8000
+FINGERPRINT_HOP_LENGTH: Final[int] = 1024
+FINGERPRINT_BANDS: Final[int] = 17
+"""energy bands per frame, giving FINGERPRINT_BANDS - 1 bits per frame"""
+FINGERPRINT_FRAMES: Final[int] = 64
+"""the index keys come from the first ~8 seconds, shorter recordings are only deduplicated by content hash"""
+
+FINGERPRINT_MAX_FRAME_DIFFERENCE: Final[int] = 2
+"""re-encodes of the same take are as long as it up to resampling, takes that only share their opening usually aren't"""
+
+FINGERPRINT_MAX_BIT_ERROR: Final[float] = 0.15
+"""re-encodes of the same take differ in a few percent of the bits, unrelated recordings in about half"""
+
+FINGERPRINT_INDEX: Final[str] = "fingerprint-v2"
+"""index kind of the fingerprints. v2 ones cover the whole recording, entries of v1 (the opening only) are ignored"""
+
+FINGERPRINT_BYTES_PER_FRAME: Final[int] = (FINGERPRINT_BANDS - 1 + 7) // 8
+"""fingerprints are stored packed frame by frame, so recordings of any length can be compared"""
+
+LSH_KEY_BITS: Final[int] = 12
+LSH_POSITIONS: Final[np.ndarray] = np.random.default_rng(0).choice(FINGERPRINT_FRAMES * (FINGERPRINT_BANDS - 1), size=(8, LSH_KEY_BITS), replace=False)
+"""fixed random bit subsets of the fingerprint. A re-encode matches at least one of them exactly with very high probability"""
+
+class HashingReader:
+    """File-like wrapper that hashes everything that is read through it"""
+
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+        self.hash = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read(size)
+        self.hash.update(data)
+        return data
+
+    def hexdigest(self) -> str:
+        return self.hash.hexdigest()
+
+def index_key(kind: str, digest: str) -> str:
+    return f"{INDEX_PREFIX}{kind}/{digest}"
+
+def claim_digest(s3, bucket: str, kind: str, digest: str, id: str) -> str:
+    """Maps digest to id unless it is already indexed. Returns the id the digest ends up mapped to"""
+    key = index_key(kind, digest)
+    try:
+        s3.put_object(Bucket=bucket, Key=key, Body=id.encode(), IfNoneMatch="*")
+        return id
+    except botocore.exceptions.ClientError as e:
+        if e.response.get("Error", {}).get("Code") not in ("PreconditionFailed", "ConditionalRequestConflict"):
+            raise
+    return s3.get_object(Bucket=bucket, Key=key)["Body"].read().decode()
+
+def audio_fingerprint(stream: BinaryIO) -> np.ndarray | None:
+    """
+    Sign pattern of band-energy differences over the whole recording, as a bool array with one row per frame.
+    The pattern only depends on relative loudness between bands and frames, so it survives
+    resampling, requantization, channel downmixes and gain changes.
+    Returns None for recordings that are too short or silent.
+    """
+    with soundfile.SoundFile(stream) as f:
+        # downmixed block by block, so only one channel of the recording is held at the original rate
+        y = np.concatenate([block.mean(axis=1) for block in f.blocks(blocksize=1 << 16, dtype="float32", always_2d=True)] or [np.zeros(0, dtype=np.float32)])
+        sample_rate = f.samplerate
+    y = librosa.resample(y, orig_sr=sample_rate, target_sr=FINGERPRINT_SAMPLE_RATE)
+    if np.max(np.abs(y), initial=0) < 1e-4:
+        return None
+
+    bands = librosa.feature.melspectrogram(y=y, sr=FINGERPRINT_SAMPLE_RATE, n_fft=2 * FINGERPRINT_HOP_LENGTH, hop_length=FINGERPRINT_HOP_LENGTH, center=False, n_mels=FINGERPRINT_BANDS, fmin=300, fmax=2000)
+    bits = np.diff(np.diff(np.log(bands + 1e-10), axis=0), axis=1) > 0
+    if bits.shape[1] < FINGERPRINT_FRAMES:
+        return None
+    return bits.T
+
+def fingerprint_keys(bits: np.ndarray) -> list[str]:
+    """Locality-sensitive index keys from the opening: similar fingerprints share at least one key"""
+    opening = bits[:FINGERPRINT_FRAMES].ravel()
+    return [f"{band}-{np.packbits(opening[positions]).tobytes().hex()}" for band, positions in enumerate(LSH_POSITIONS)]
+
+def fingerprint_distance(bits: np.ndarray, other: np.ndarray) -> float:
+    """Fraction of differing bits over the whole recordings, 1 if their lengths differ by more than FINGERPRINT_MAX_FRAME_DIFFERENCE"""
+    if abs(len(bits) - len(other)) > FINGERPRINT_MAX_FRAME_DIFFERENCE:
+        return 1.0
+    frames = min(len(bits), len(other))
+    return float(np.mean(bits[:frames] != other[:frames]))
+
+def match_fingerprint(s3, bucket: str, bits: np.ndarray) -> str | None:
+    """Returns the id of an indexed recording whose fingerprint is within FINGERPRINT_MAX_BIT_ERROR of bits"""
+    checked: set[str] = set()
+    for key in fingerprint_keys(bits):
+        try:
+            candidate = s3.get_object(Bucket=bucket, Key=index_key(FINGERPRINT_INDEX, key))["Body"].read().decode()
+        except s3.exceptions.NoSuchKey:
+            continue
+        if candidate in checked:
+            continue
+        checked.add(candidate)
+        stored = s3.get_object(Bucket=bucket, Key=index_key(f"{FINGERPRINT_INDEX}-bits", candidate))["Body"].read()
+        candidate_bits = np.unpackbits(np.frombuffer(stored, dtype=np.uint8).reshape(-1, FINGERPRINT_BYTES_PER_FRAME), axis=1)[:, :bits.shape[1]].astype(bool)
+        if fingerprint_distance(bits, candidate_bits) <= FINGERPRINT_MAX_BIT_ERROR:
+            return candidate
+    return None
+
+def index_fingerprint(s3, bucket: str, id: str, bits: np.ndarray) -> None:
+    s3.put_object(Bucket=bucket, Key=index_key(f"{FINGERPRINT_INDEX}-bits", id), Body=np.packbits(bits, axis=1).tobytes())
+    for key in fingerprint_keys(bits):
+        # keys that are already taken keep pointing at the older recording
+        claim_digest(s3, bucket, FINGERPRINT_INDEX, key, id)
+
+def find_duplicate(s3, bucket: str, id: str, digest: str, stream: BinaryIO) -> tuple[str | None, bool]:
+    """
+    Indexes a freshly uploaded wav under its content hash (and fingerprint, if enabled).
+    Returns the id of an earlier upload of the same recording, or None if this one is new. The flag is True
+    if the earlier upload has the same content hash, False if only their fingerprints match
+    """
+    existing_id = claim_digest(s3, bucket, "sha256", digest, id)
+    if existing_id != id:
+        return existing_id, True
+    if not FINGERPRINT_ENABLED:
+        return None, False
+
+    stream.seek(0)
+    bits = audio_fingerprint(stream)
+    if bits is None:
+        return None, False
+    similar_id = match_fingerprint(s3, bucket, bits)
+    # indexed either way, the new upload is kept even if it resembles an earlier one
+    index_fingerprint(s3, bucket, id, bits)
+    return similar_id, False
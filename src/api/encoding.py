@@ -0,0 +1,126 @@
+"""
+Content negotiation for analysis responses.
+
+JSON (a list of objects per feedback kind) stays the default. Clients can ask for a smaller
+representation through the Accept header:
+- application/vnd.warbler.columnar+json: {"time": [...], "expectedDB": [...], ...} per feedback kind
+- application/msgpack: same layout, but every column is a msgpack bin of little-endian float32
+- application/vnd.warbler.float32: the raw little-endian float32 columns back to back, described
+  by the X-Warbler-Layout header as `kind:rows:col,col,col;kind:rows:...`
+
+Feedback kinds can be grouped, e.g. the feedback per requested tolerance level under "tolerance_levels".
+Groups nest as objects in the JSON and msgpack formats, and their kinds are joined with "/" in the
+X-Warbler-Layout header, e.g. `tolerance_levels/strict/pitch_feedback:12:time,expected_pitch,actual_pitch`.
+
+Metadata about the analysis (e.g. "complete" for deadline-limited analyses) is added as extra top-level
+keys in the JSON and msgpack formats, and as a JSON X-Warbler-Metadata header for raw float32.
+
+Any format is gzip or brotli compressed when the client sends a matching Accept-Encoding.
+"""
+import gzip
+import json
+import flask
+import msgpack
+import numpy as np
+from typing import Any, Callable, Final
+from werkzeug.datastructures import Accept, MIMEAccept
+
+from ..analysis.results import MismatchTable
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+JSON_MIMETYPE: Final[str] = "application/json"
+COLUMNAR_MIMETYPE: Final[str] = "application/vnd.warbler.columnar+json"
+MSGPACK_MIMETYPE: Final[str] = "application/msgpack"
+FLOAT32_MIMETYPE: Final[str] = "application/vnd.warbler.float32"
+
+SUPPORTED_MIMETYPES: Final[list[str]] = [JSON_MIMETYPE, COLUMNAR_MIMETYPE, MSGPACK_MIMETYPE, "application/x-msgpack", FLOAT32_MIMETYPE]
+"""in order of preference, so that */* or a missing Accept header gives JSON"""
+
+WIRE_DTYPE: Final[str] = "<f4"
+"""little-endian float32, used by the binary formats"""
+
+MIN_COMPRESS_BYTES: Final[int] = 1024
+"""bodies smaller than this are not worth compressing"""
+
+def negotiate_format(accept: MIMEAccept) -> str:
+    """Picks the response mimetype from the request's Accept header, defaulting to JSON"""
+    mimetype = accept.best_match(SUPPORTED_MIMETYPES, default=JSON_MIMETYPE)
+    return MSGPACK_MIMETYPE if mimetype == "application/x-msgpack" else mimetype
+
+Feedback = dict[str, "MismatchTable | Feedback"]
+"""feedback kind -> its table, or a group of further feedback kinds"""
+
+def encode_tables(feedback: Feedback, encode_table: Callable[[MismatchTable], Any]) -> dict:
+    """feedback with encode_table applied to every table, keeping the groups"""
+    return {kind: encode_tables(value, encode_table) if isinstance(value, dict) else encode_table(value) for kind, value in feedback.items()}
+
+def flatten(feedback: Feedback, prefix: str = "") -> dict[str, MismatchTable]:
+    """The tables of feedback and its groups, keyed by their kinds joined with "/" """
+    tables = {}
+    for kind, value in feedback.items():
+        if isinstance(value, dict):
+            tables.update(flatten(value, f"{prefix}{kind}/"))
+        else:
+            tables[prefix + kind] = value
+    return tables
+
+def encode_json(feedback: Feedback, metadata: dict) -> bytes:
+    return json.dumps({**encode_tables(feedback, MismatchTable.to_records), **metadata}).encode()
+
+def encode_columnar(feedback: Feedback, metadata: dict) -> bytes:
+    return json.dumps({
+        **encode_tables(feedback, lambda table: {name: column.tolist() for name, column in table.columns().items()}),
+        **metadata,
+    }).encode()
+
+def encode_msgpack(feedback: Feedback, metadata: dict) -> bytes:
+    return msgpack.packb({
+        **encode_tables(feedback, lambda table: {name: column.astype(WIRE_DTYPE).tobytes() for name, column in table.columns().items()}),
+        **metadata,
+    })
+
+def encode_float32(feedback: Feedback) -> tuple[bytes, str]:
+    """Returns the concatenated float32 columns and the X-Warbler-Layout header describing them"""
+    tables = flatten(feedback)
+    columns = [column for table in tables.values() for column in table.columns().values()]
+    body = np.concatenate(columns).astype(WIRE_DTYPE).tobytes() if columns else b""
+    layout = ";".join(f"{kind}:{len(table)}:{','.join(table.names)}" for kind, table in tables.items())
+    return body, layout
+
+def compress(body: bytes, accept_encodings: Accept) -> tuple[bytes, str | None]:
+    """Compresses the body with the best encoding the client accepts, returns the body and the Content-Encoding"""
+    if len(body) < MIN_COMPRESS_BYTES:
+        return body, None
+    offered = ["br", "gzip"] if brotli is not None else ["gzip"]
+    encoding = accept_encodings.best_match(offered)
+    if encoding == "br":
+        return brotli.compress(body), "br"
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=6), "gzip"
+    return body, None
+
+def feedback_response(feedback: Feedback, metadata: dict | None = None) -> flask.Response:
+    """Builds the response for the current request in whichever format and encoding it asked for"""
+    mimetype = negotiate_format(flask.request.accept_mimetypes)
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    metadata = metadata or {}
+
+    if mimetype == COLUMNAR_MIMETYPE:
+        body = encode_columnar(feedback, metadata)
+    elif mimetype == MSGPACK_MIMETYPE:
+        body = encode_msgpack(feedback, metadata)
+    elif mimetype == FLOAT32_MIMETYPE:
+        body, headers["X-Warbler-Layout"] = encode_float32(feedback)
+        if metadata:
+            headers["X-Warbler-Metadata"] = json.dumps(metadata)
+    else:
+        body = encode_json(feedback, metadata)
+
+    body, content_encoding = compress(body, flask.request.accept_encodings)
+    if content_encoding is not None:
+        headers["Content-Encoding"] = content_encoding
+    return flask.Response(body, status=200, mimetype=mimetype, headers=headers)
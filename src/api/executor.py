@@ -0,0 +1,64 @@
+"""
+Keeps CPU-heavy work (the performance analysis) off the request-serving loop.
+
+Under gunicorn's gevent workers (see gunicorn.conf.py) every request is a greenlet on the worker's
+main thread, so an analysis running inline would stall every status poll and download on that worker.
+pyin holds the GIL for seconds at a time, so a thread doesn't help either: the work goes to a small
+process pool per worker and only the calling greenlet waits for it.
+Blocking I/O that gevent can't make cooperative (e.g. sqlite3, which waits out another worker's write
+in C) goes to gevent's thread pool instead, the hub keeps serving other requests while it waits.
+Under sync workers or the flask dev server both simply run inline.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Final, TypeVar
+
+T = TypeVar("T")
+
+ANALYSIS_PROCESSES: Final[int] = int(os.getenv("ANALYSIS_PROCESSES", "1"))
+"""concurrent analyses per worker process"""
+
+# lazy process pool, created on first use so that every gunicorn worker gets its own
+executor = None
+
+def gevent_active() -> bool:
+    """Whether this process runs under gevent with the standard library monkey patched"""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("socket")
+
+def get_executor() -> ProcessPoolExecutor:
+    global executor
+    if executor is None:
+        # forkserver: the pool's processes don't inherit the worker's monkey patched state
+        executor = ProcessPoolExecutor(max_workers=ANALYSIS_PROCESSES, mp_context=multiprocessing.get_context("forkserver"))
+    return executor
+
+def recycle_executor() -> None:
+    """
+    Replaces the process pool with a fresh one on next use, e.g. once its processes hold too much memory.
+    Analyses already submitted still finish in the old pool, whose processes then exit
+    """
+    global executor
+    if executor is not None:
+        executor.shutdown(wait=False)
+        executor = None
+
+def run_cpu_bound(fn: Callable[..., T], *args, **kwargs) -> T:
+    """
+    Calls fn(*args, **kwargs) without blocking other requests of this worker, returns its result or raises its exception.
+    fn, its arguments and its result must be picklable
+    """
+    if not gevent_active():
+        return fn(*args, **kwargs)
+    return get_executor().submit(fn, *args, **kwargs).result()
+
+def run_blocking(fn: Callable[..., T], *args, **kwargs) -> T:
+    """Calls fn(*args, **kwargs) on a thread without blocking other requests of this worker, returns its result or raises its exception"""
+    if not gevent_active():
+        return fn(*args, **kwargs)
+    import gevent
+    return gevent.get_hub().threadpool.apply(fn, args, kwargs)
@@ -0,0 +1,205 @@
+"""
+Historical store of analysis results, for tracking progress across takes without re-analyzing old recordings.
+
+Every analysis is kept in an embedded SQLite database, keyed by its recording (wav_id), its score (mxl_id),
+the ANALYZER_VERSION that produced it and when it ran. The mismatches themselves are stored compactly: one
+row per feedback kind (and tolerance level) holding the table's little-endian float32 columns as a blob,
+together with that kind's accuracy, the recording time at which each measure starts and, for progressive
+analyses whose coarse and refined rows cover different durations, the seconds each row covers. Progress over time
+is aggregated in SQL from the stored accuracies, and per-measure heatmaps are binned from the stored times,
+so neither query touches audio.
+
+A take is one recording of a score. A recording that was analyzed more than once counts once, by its latest analysis.
+Workers on the box share the database file, SQLite's write-ahead log lets them read while another one writes.
+"""
+import dataclasses
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from contextlib import closing, contextmanager
+from pathlib import Path
+from typing import Final, Iterator
+
+import numpy as np
+
+from ..analysis.pipeline import ANALYZER_VERSION, Analysis
+from ..analysis.results import MismatchTable
+from ..dynamics.feedback import DynamicsMismatch, DynamicsSpan
+from ..pitch.main import PitchMismatch
+
+RESULTS_DB: Final[str] = os.getenv("RESULTS_DB", os.path.join(tempfile.gettempdir(), "warbler-results.sqlite3"))
+"""path of the database, point it at persistent storage in production"""
+
+BUSY_TIMEOUT: Final[float] = 10
+"""seconds a worker waits for another one's write to finish"""
+
+STORED_DTYPE: Final[str] = "<f4"
+"""mismatch columns are stored as little-endian float32, like the API's binary formats"""
+
+ITEM_TYPES: Final[dict[str, type]] = {item_type.__name__: item_type for item_type in (DynamicsMismatch, DynamicsSpan, PitchMismatch)}
+
+MAX_HEATMAP_TAKES: Final[int] = 1000
+"""most recent takes a heatmap is computed over"""
+
+DEFAULT_LEVEL: Final[str] = ""
+"""level of the feedback judged with the request's own tolerance, named levels are stored under their names"""
+
+SCHEMA: Final[str] = """
+CREATE TABLE IF NOT EXISTS analyses (
+    id INTEGER PRIMARY KEY,
+    wav_id TEXT NOT NULL,
+    mxl_id TEXT NOT NULL,
+    analyzer_version TEXT NOT NULL,
+    created REAL NOT NULL,
+    onset REAL,
+    release REAL,
+    complete INTEGER NOT NULL,
+    options TEXT NOT NULL,
+    measure_numbers BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS analyses_by_score ON analyses (mxl_id, analyzer_version, created);
+CREATE INDEX IF NOT EXISTS analyses_by_wav ON analyses (wav_id, created);
+CREATE TABLE IF NOT EXISTS feedback (
+    analysis_id INTEGER NOT NULL REFERENCES analyses (id),
+    level TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    item_type TEXT NOT NULL,
+    rows INTEGER NOT NULL,
+    accuracy REAL NOT NULL,
+    frame_seconds REAL NOT NULL,
+    row_seconds BLOB,
+    measure_starts BLOB NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (analysis_id, level, kind)
+) WITHOUT ROWID;
+"""
+
+TAKES: Final[str] = """
+SELECT MAX(id) AS id FROM analyses
+WHERE mxl_id = :mxl_id AND analyzer_version = :version AND created >= :start AND created < :end
+GROUP BY wav_id
+"""
+"""the latest analysis of every take of a score in a time range"""
+
+def stored_columns(item_type: str, rows: int, data: bytes) -> np.ndarray:
+    """The (fields, rows) columns of a stored mismatch table"""
+    return np.frombuffer(data, dtype=STORED_DTYPE).reshape(len(dataclasses.fields(ITEM_TYPES[item_type])), rows)
+
+def mismatched_seconds(table: np.ndarray, frame_seconds: float, row_seconds: bytes | None = None) -> np.ndarray:
+    """
+    Seconds of the recording each stored mismatch row covers, table being its (fields, rows) columns.
+    row_seconds holds them per row when they differ (progressive analyses), otherwise every row covers frame_seconds
+    """
+    if row_seconds is not None:
+        return np.frombuffer(row_seconds, dtype=STORED_DTYPE).astype(np.float64)
+    if frame_seconds > 0:
+        return np.full(table.shape[1], frame_seconds)
+    # spans, (time, end, ...)
+    return table[1] - table[0]
+
+class ResultsStore:
+    def __init__(self, path: str | Path = RESULTS_DB):
+        self.path = Path(path)
+        with self.connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+            if "row_seconds" not in {column[1] for column in db.execute("PRAGMA table_info(feedback)")}:
+                # databases created before durations were stored per row, their rows all cover frame_seconds
+                try:
+                    db.execute("ALTER TABLE feedback ADD COLUMN row_seconds BLOB")
+                except sqlite3.OperationalError as e:
+                    if "duplicate column" not in str(e):  # another worker added it first
+                        raise
+
+    @contextmanager
+    def connect(self) -> Iterator[sqlite3.Connection]:
+        """A connection for one operation, committed if the block succeeds. Connections aren't shared between greenlets"""
+        with closing(sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)) as db:
+            with db:
+                yield db
+
+    def save(self, wav_id: str, mxl_id: str, analysis: Analysis, options: dict | None = None, created: float | None = None) -> int:
+        """Stores the analysis of a take, returns its id. options are the request's analysis options, kept for reference"""
+        window = analysis.window
+        with self.connect() as db:
+            analysis_id = db.execute(
+                "INSERT INTO analyses (wav_id, mxl_id, analyzer_version, created, onset, release, complete, options, measure_numbers) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (wav_id, mxl_id, ANALYZER_VERSION, time.time() if created is None else created,
+                 None if window is None else window.onset, None if window is None else window.release,
+                 analysis.complete, json.dumps(options or {}), np.asarray(analysis.measure_numbers, dtype="<i8").tobytes()),
+            ).lastrowid
+            levels = {DEFAULT_LEVEL: analysis.feedback, **analysis.levels}
+            db.executemany(
+                "INSERT INTO feedback (analysis_id, level, kind, item_type, rows, accuracy, frame_seconds, row_seconds, measure_starts, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(analysis_id, level, kind, table.item_type.__name__, len(table), analysis.accuracy(kind, table), analysis.frame_seconds.get(kind, 0.0),
+                  analysis.row_seconds(kind, table).astype(STORED_DTYPE).tobytes() if kind in analysis.coarse_frame_seconds else None,
+                  np.asarray(analysis.measure_starts.get(kind, np.zeros(0)), dtype="<f8").tobytes(), table.data.astype(STORED_DTYPE).tobytes())
+                 for level, feedback in levels.items() for kind, table in feedback.items()],
+            )
+        return analysis_id
+
+    def feedback(self, analysis_id: int, level: str = DEFAULT_LEVEL) -> dict[str, MismatchTable] | None:
+        """The stored feedback of an analysis, with its columns as float32. None if there is no such analysis"""
+        with self.connect() as db:
+            rows = db.execute("SELECT kind, item_type, rows, data FROM feedback WHERE analysis_id = ? AND level = ?", (analysis_id, level)).fetchall()
+        if not rows:
+            return None
+        return {kind: MismatchTable.from_array(ITEM_TYPES[item_type], stored_columns(item_type, count, data))
+                for kind, item_type, count, data in rows}
+
+    def progress(self, mxl_id: str, start: float = 0.0, end: float = float("inf"), bucket: float = 86400, version: str = ANALYZER_VERSION) -> list[dict]:
+        """
+        Accuracy of the takes of a score per bucket (seconds) of time between start and end (unix seconds):
+        the number of takes and the mean, min and max accuracy of each feedback kind, oldest bucket first
+        """
+        with self.connect() as db:
+            rows = db.execute(
+                f"WITH takes AS ({TAKES}) "
+                "SELECT CAST(a.created / :bucket AS INTEGER) * :bucket AS bucket_start, f.kind, COUNT(*), AVG(f.accuracy), MIN(f.accuracy), MAX(f.accuracy) "
+                "FROM takes JOIN analyses a ON a.id = takes.id JOIN feedback f ON f.analysis_id = a.id AND f.level = :level "
+                "GROUP BY bucket_start, f.kind ORDER BY bucket_start, f.kind",
+                {"mxl_id": mxl_id, "version": version, "start": start, "end": end, "bucket": bucket, "level": DEFAULT_LEVEL},
+            ).fetchall()
+        buckets: dict[float, dict] = {}
+        for bucket_start, kind, takes, mean, low, high in rows:
+            entry = buckets.setdefault(bucket_start, {"start": bucket_start, "takes": takes})
+            entry[kind] = {"mean": mean, "min": low, "max": high}
+        return list(buckets.values())
+
+    def heatmap(self, mxl_id: str, kind: str, start: float = 0.0, end: float = float("inf"), version: str = ANALYZER_VERSION,
+                limit: int = MAX_HEATMAP_TAKES) -> dict:
+        """
+        Seconds of mismatches of one feedback kind per measure, for each of the latest limit takes of a score between
+        start and end, and summed over them. Takes whose score had other measures (an older compilation) are left out
+        """
+        with self.connect() as db:
+            rows = db.execute(
+                f"WITH takes AS ({TAKES}) "
+                "SELECT a.id, a.wav_id, a.created, a.measure_numbers, f.item_type, f.rows, f.frame_seconds, f.row_seconds, f.measure_starts, f.data "
+                "FROM takes JOIN analyses a ON a.id = takes.id JOIN feedback f ON f.analysis_id = a.id AND f.level = :level AND f.kind = :kind "
+                "ORDER BY a.created DESC LIMIT :limit",
+                {"mxl_id": mxl_id, "version": version, "start": start, "end": end, "level": DEFAULT_LEVEL, "kind": kind, "limit": limit},
+            ).fetchall()
+        if not rows:
+            return {"measures": [], "takes": [], "total": []}
+
+        measures = np.frombuffer(rows[0][3], dtype="<i8")
+        takes = []
+        for analysis_id, wav_id, created, measure_numbers, item_type, count, frame_seconds, row_seconds, measure_starts, data in reversed(rows):
+            if measure_numbers != rows[0][3]:
+                continue
+            table = stored_columns(item_type, count, data).astype(np.float64)
+            # mismatches before the first measure (the lead-in) count towards it
+            measure_i = np.maximum(np.searchsorted(np.frombuffer(measure_starts, dtype="<f8"), table[0], side="right") - 1, 0)
+            errors = np.bincount(measure_i, weights=mismatched_seconds(table, frame_seconds, row_seconds), minlength=len(measures))
+            takes.append({"id": analysis_id, "id_wav": wav_id, "created": created, "errors": errors})
+        total = np.sum([take["errors"] for take in takes], axis=0)
+        return {
+            "measures": measures.tolist(),
+            "takes": [{**take, "errors": take["errors"].tolist()} for take in takes],
+            "total": total.tolist(),
+        }
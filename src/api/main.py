@@ -3,15 +3,35 @@ import os
 import dotenv
 import requests
 import boto3
-import io
+import botocore.config
+import time
+import tempfile
+from pathlib import Path
 from datetime import datetime
+from dataclasses import asdict
+from contextlib import ExitStack, contextmanager
+from typing import Iterator
 import uuid
 from flask_cors import CORS
 
 from .modules import valid_uuid
-
-from ..dynamics.feedback import get_dynamics_performance_feedback, DynamicsMismatch
-from ..pitch.main import pitch_check, PitchMismatch
+from .encoding import feedback_response
+from .dedup import HashingReader, find_duplicate
+from .executor import gevent_active, recycle_executor, run_blocking, run_cpu_bound
+from .history import ResultsStore
+from .memory import MemoryWatchdog
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, format_metric
+from .scheduler import OverCapacity, Scheduler, estimate_cost
+from .scores import ScoreIngestor, compile_mxl, find_pdf_conversion, index_pdf, ingest_score, mxl_key, stored_timeline
+
+from ..analysis.artifacts import ArtifactStore, SharedTimeline, share_timeline
+from ..analysis.memory import rss_bytes
+from ..analysis.pipeline import ANALYZER_VERSION, analyze
+from ..analysis.preflight import PreflightError
+from ..analysis.profiles import PROFILES
+from ..analysis.timeline import TIMELINE_VERSION, ScoreTimeline
+from ..analysis.tolerance import DEFAULT_TOLERANCE, parse_tolerance, parse_tolerance_levels
+from ..dynamics.feedback import dynamics_modes
 
 dotenv.load_dotenv()
 
@@ -28,6 +48,8 @@ APP_SCORE_STATUS_URL = APP_URL + "/score-status"
 APP_MXL_DOWNLOAD_URL = APP_URL + "/download/mxl"
 APP_WAV_DOWNLOAD_URL = APP_URL + "/download/wav"
 APP_ANALYZE_PERFORMANCE_URL = APP_URL + "/analyze-performance"
+APP_PROGRESS_URL = APP_URL + "/progress"
+APP_HEATMAP_URL = APP_URL + "/heatmap"
 
 # Endpoints for AWS audiveris hosting (used internally here by this API, not to be used directly by clients. Instead, use the endpoints above)
 AWS_URL = os.getenv("AUDIVERIS_API_URL", "Failed to find AWS endpoint")
@@ -36,8 +58,20 @@ AWS_SCORE_STATUS_URL = AWS_URL + "/status/"
 AWS_GET_MXL_URL = AWS_URL + "/download/"
 AWS_BUCKET = os.getenv("AWS_BUCKET", "Failed to get an AWS bucket")
 
+# Connection pools are shared by all requests of a worker. Under gevent workers (see gunicorn.conf.py) a worker
+# serves many requests at once, so the pools are sized for that rather than for one request at a time
+UPSTREAM_POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", "100"))
+UPSTREAM_TIMEOUT = (5, 60) # (connect, read) seconds for calls to Audiveris
+DOWNLOAD_CHUNK_SIZE = 64 * 1024 # downloads are streamed to the client in chunks of this many bytes
+MXL_MIMETYPE = "application/vnd.recordare.musicxml"
+
+http = requests.Session()
+http.mount("http://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=UPSTREAM_POOL_SIZE))
+http.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=UPSTREAM_POOL_SIZE))
+
 # lazy S3 client, initialized on first use 
 s3 = None
+S3_CONFIG = botocore.config.Config(max_pool_connections=UPSTREAM_POOL_SIZE)
 
 def get_s3_client():
     """Lazily create and cache an S3 client using AWS_PROFILE ."""
@@ -50,28 +84,147 @@ def get_s3_client():
     try:
         if "app_runner" in execution_env:
             session = boto3.Session()
-            s3 = session.client('s3')
+            s3 = session.client('s3', config=S3_CONFIG)
         else:
             # Try AWS_PROFILE first (from .env), then AWS_PROFILE (standard boto3 env var)
             profile = os.getenv("AWS_PROFILE")
             session = boto3.Session(profile_name=profile)
-            s3 = session.client('s3')
+            s3 = session.client('s3', config=S3_CONFIG)
         return s3
     except Exception as e:
         print(f"Warning: Failed to create S3 client: {str(e)}")
         print("You may not have AWS_PROFILE set correctly in your .env file")
         return None
 
+def stream_download(chunks, download_name: str, mimetype: str | None, content_length: int | str | None, close=None) -> flask.Response:
+    """Streams an upstream body to the client as an attachment, without holding the whole file in memory"""
+    response = flask.Response(chunks, mimetype=mimetype or "application/octet-stream")
+    response.headers["Content-Disposition"] = f"attachment; filename={download_name}"
+    if content_length is not None:
+        response.headers["Content-Length"] = str(content_length)
+    if close is not None:
+        response.call_on_close(close)
+    return response
+
+def fetch_wav(wav_id: str, path: Path) -> None:
+    """Writes a previously uploaded wav from S3 to path"""
+    s3 = get_s3_client()
+    if s3 is None:
+        raise RuntimeError("Unable to locate credentials")
+    body = s3.get_object(Bucket=AWS_BUCKET, Key=f"{wav_id}.wav")['Body']
+    with open(path, "wb") as f:
+        for chunk in body.iter_chunks(DOWNLOAD_CHUNK_SIZE):
+            f.write(chunk)
+
+@contextmanager
+def score_for_analysis(mxl_id: str, path: Path) -> Iterator[SharedTimeline | Path]:
+    """
+    The score's ingested timeline, shared with every process on the box through the artifact store until the block ends.
+    It is ingested now if that didn't happen yet. Falls back to downloading the mxl to path
+    """
+    with ExitStack() as stack:
+        try:
+            score = stack.enter_context(share_timeline(artifacts, f"timeline-v{TIMELINE_VERSION}-{mxl_id}", lambda: ingest(mxl_id)))
+        except Exception as e:
+            print(f"Warning: Failed to ingest score {mxl_id}, analyzing its mxl directly: {str(e)}")
+            fetch_mxl(mxl_id, path)
+            score = path
+        yield score
+
+def fetch_mxl(mxl_id: str, path: Path) -> None:
+    """Writes the mxl Audiveris produced for a previously uploaded pdf to path"""
+    with http.get(AWS_GET_MXL_URL + mxl_id, stream=True, timeout=UPSTREAM_TIMEOUT) as r:
+        assert r.status_code == 200, f"Expected 200 status code when downloading previously uploaded mxl file, got {r.status_code}"
+        with open(path, "wb") as f:
+            for chunk in r.iter_content(DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+
+def fetch_mxl_bytes(score_id: str) -> bytes:
+    """The mxl Audiveris produced for a previously uploaded pdf"""
+    r = http.get(AWS_GET_MXL_URL + score_id, timeout=UPSTREAM_TIMEOUT)
+    assert r.status_code == 200, f"Expected 200 status code when downloading the mxl file of score {score_id} from Audiveris, got {r.status_code}"
+    return r.content
+
+def fetch_score_status(score_id: str) -> str | None:
+    """The "status" Audiveris reports for a previously uploaded pdf"""
+    return http.get(AWS_SCORE_STATUS_URL + score_id, timeout=UPSTREAM_TIMEOUT).json().get("status")
+
+def ingest(score_id: str) -> ScoreTimeline:
+    """Copies a converted score into our bucket and compiles its timeline, see scores.py"""
+    s3 = get_s3_client()
+    if s3 is None:
+        raise RuntimeError("Unable to locate credentials")
+    return ingest_score(s3, AWS_BUCKET, score_id, fetch_mxl_bytes, compile=lambda data: run_cpu_bound(compile_mxl, data))
+
+ingestor = ScoreIngestor(ingest, fetch_score_status)
+
+# compiled scores are mapped from here by every worker and analysis process on the box, see artifacts.py
+artifacts = ArtifactStore()
+
+# analyses wait their turn here, shared with every other worker on the box through the ledger file
+scheduler = Scheduler()
+
+# every analysis is kept for the progress and heatmap endpoints, see history.py
+results = ResultsStore()
+
+# samples every request's memory and recycles bloated workers, see memory.py and gunicorn.conf.py
+watchdog = MemoryWatchdog()
+
+@app.before_request
+def sample_memory_before():
+    flask.g.rss_before = rss_bytes()
+
+@app.after_request
+def sample_memory_after(response: flask.Response) -> flask.Response:
+    watchdog.after_request(flask.request.endpoint or "unknown", flask.g.get("rss_before", 0))
+    return response
+
+def find_reusable_conversion(s3, digest: str) -> tuple[str | None, bool]:
+    """
+    Score id of an earlier upload of the same pdf whose conversion is done or still running.
+    The flag is True if the pdf was uploaded before but that conversion failed
+    """
+    previous_id = find_pdf_conversion(s3, AWS_BUCKET, digest)
+    if previous_id is None:
+        return None, False
+    if stored_timeline(s3, AWS_BUCKET, previous_id) is not None or fetch_score_status(previous_id) in ("processing", "completed"):
+        return previous_id, False
+    return None, True
+
 @app.route("/app-health")
 def backend_health_check():
     """Check health of backend api endpoints"""
     return "OK", 200
 
+@app.route("/metrics")
+def metrics():
+    """Analysis queue, cost, artifact store and memory metrics of the whole box, in the Prometheus text format"""
+    stats = artifacts.stats()
+    artifact_metrics = "".join([
+        format_metric("warbler_artifacts", "gauge", "Compiled score artifacts shared on the box", stats["artifacts"]),
+        format_metric("warbler_artifact_bytes", "gauge", "Bytes of the shared artifacts", stats["bytes"]),
+        format_metric("warbler_artifact_references", "gauge", "References processes hold to shared artifacts", stats["references"]),
+        format_metric("warbler_artifact_hits_total", "counter", "Artifacts mapped without compiling them", stats["hits"]),
+        format_metric("warbler_artifact_misses_total", "counter", "Artifacts that had to be compiled first", stats["misses"]),
+        format_metric("warbler_artifact_evictions_total", "counter", "Artifacts evicted to stay under the budget", stats["evictions"]),
+    ])
+    return flask.Response(scheduler.metrics() + artifact_metrics + watchdog.metrics(), content_type=METRICS_CONTENT_TYPE)
+
+@app.route("/debug/memory")
+def debug_memory():
+    """
+    Memory of the worker that serves this request, with the allocation sites that grew the most during its previous
+    request and since its first one. Only served with MEMORY_DEBUG=1, and needs MEMORY_TRACEMALLOC for the allocation sites
+    """
+    if not watchdog.debug:
+        return {"Error": "Memory debugging is disabled, set MEMORY_DEBUG=1"}, 404
+    return watchdog.debug_report(), 200
+
 @app.route("/aws-health")
 def aws_health_check():
     """Check health of the Audiveris AWS hosting"""
     try: 
-        r = requests.get(AWS_URL, timeout=5)
+        r = http.get(AWS_URL, timeout=5)
         return r.text, r.status_code
     except Exception as e:
         return {"Error": str(e)}, 503
@@ -80,27 +233,61 @@ def aws_health_check():
 def upload_score():
     """Uploads score to Audiveris. The score will then enter the 'processing' phase, where it will be converted from a pdf to mxl file
     Expects a binary file in pdf format as input. The pdf is expected to be a score, otherwise the the download endpoint will likely fail
-     
+
+    Identical pdfs are recognized by content hash: if the same pdf was uploaded before and its conversion didn't fail,
+    no new conversion is started and the earlier id is returned with "duplicate": true.
     """
     if "file" not in flask.request.files:
         return "Key 'file' with file data is required to upload", 400
     try:
         uploaded_score = flask.request.files["file"]
 
+        hashed_stream = HashingReader(uploaded_score.stream)
+        while hashed_stream.read(DOWNLOAD_CHUNK_SIZE):
+            pass
+        uploaded_score.stream.seek(0)
+
+        s3 = get_s3_client()
+        existing_id, stale = None, False
+        if s3 is not None:
+            try:
+                existing_id, stale = find_reusable_conversion(s3, hashed_stream.hexdigest())
+            except Exception as e:
+                # deduplication is an optimization, never fail an upload because of it
+                print(f"Warning: Failed to look up earlier uploads of the pdf: {str(e)}")
+        if existing_id is not None:
+            print(f"Uploaded pdf was converted before as {existing_id}, reusing it")
+            return {"id": existing_id, "duplicate": True}, 200
+
         file_name = f"{uuid.uuid4()}.pdf"
 
         files = {"file": (file_name, uploaded_score.stream, uploaded_score.content_type or "application/pdf")}
-        r = requests.post(AWS_UPLOAD_URL, files=files)
+        r = http.post(AWS_UPLOAD_URL, files=files, timeout=UPSTREAM_TIMEOUT)
         try:
-            return r.json(), r.status_code
+            body = r.json()
         except:
             return r.text, r.status_code
+
+        if r.status_code == 200 and isinstance(body, dict) and "id" in body:
+            ingestor.track_upload(body["id"])
+            if s3 is not None:
+                try:
+                    index_pdf(s3, AWS_BUCKET, hashed_stream.hexdigest(), body["id"], replace=stale)
+                except Exception as e:
+                    print(f"Warning: Failed to index pdf of score {body['id']}: {str(e)}")
+            body["duplicate"] = False
+        return body, r.status_code
     except Exception as e:
         return {"Error": str(e)}, 503
     
 @app.route("/upload/wav", methods=["POST"])
 def upload_wav():
-    """Uploads a WAV file to S3."""
+    """Uploads a WAV file to S3.
+
+    Uploads are deduplicated by content hash: if the same recording was uploaded before (e.g. a retried upload),
+    the new copy is dropped and the earlier id is returned with "duplicate": true. With WAV_FINGERPRINT_DEDUP,
+    an upload that only sounds like an earlier one (e.g. a re-encode) is kept, and the earlier id is returned as "similar_to".
+    """
 
     if "file" not in flask.request.files:
         return "Key 'file' with file data is required to upload", 400
@@ -113,8 +300,26 @@ def upload_wav():
         if s3 is None:
             return {"Error": "Unable to locate credentials"}, 503
         
-        s3.upload_fileobj(uploaded_wav.stream, AWS_BUCKET, file_name)
-        response = flask.jsonify({"id": id})
+        hashed_stream = HashingReader(uploaded_wav.stream)
+        s3.upload_fileobj(hashed_stream, AWS_BUCKET, file_name)
+
+        try:
+            existing_id, identical = find_duplicate(s3, AWS_BUCKET, id, hashed_stream.hexdigest(), uploaded_wav.stream)
+        except Exception as e:
+            # deduplication is an optimization, never fail an upload because of it
+            print(f"Warning: Failed to deduplicate {file_name}: {str(e)}")
+            existing_id, identical = None, False
+
+        if existing_id is not None and identical:
+            print(f"{file_name} is a duplicate of {existing_id}.wav, removing it")
+            s3.delete_object(Bucket=AWS_BUCKET, Key=file_name)
+            return flask.jsonify({"id": existing_id, "duplicate": True}), 200
+        if existing_id is not None:
+            # a fingerprint can't tell a re-encode from another take with the same opening, so nothing is dropped
+            print(f"{file_name} sounds like {existing_id}.wav, keeping both")
+            return flask.jsonify({"id": id, "duplicate": False, "similar_to": existing_id}), 200
+
+        response = flask.jsonify({"id": id, "duplicate": False})
         return response, 200
     except Exception as e:
         return {"Error": str(e)}, 503
@@ -135,14 +340,17 @@ def download_score():
         return {"Error": f"Invalid UUID for mxl ID: {score_id}"}, 400
     
     try:
-        r = requests.get(AWS_GET_MXL_URL + score_id)
-
-        return flask.send_file(
-            io.BytesIO(r.content), 
-            as_attachment=True,
-            download_name=f"score-{score_id}.mxl",
-            mimetype=r.headers.get("Content-Type")
-        )
+        # ingested scores are served from our bucket
+        s3 = get_s3_client()
+        if s3 is not None:
+            try:
+                obj = s3.get_object(Bucket=AWS_BUCKET, Key=mxl_key(score_id))
+                return stream_download(obj['Body'].iter_chunks(DOWNLOAD_CHUNK_SIZE), f"score-{score_id}.mxl", MXL_MIMETYPE, obj.get("ContentLength"), close=obj['Body'].close)
+            except s3.exceptions.NoSuchKey:
+                pass
+
+        r = http.get(AWS_GET_MXL_URL + score_id, stream=True, timeout=UPSTREAM_TIMEOUT)
+        return stream_download(r.iter_content(DOWNLOAD_CHUNK_SIZE), f"score-{score_id}.mxl", r.headers.get("Content-Type"), r.headers.get("Content-Length"), close=r.close)
     except Exception as e:
         return {"Error": str(e)}, 503
     
@@ -166,14 +374,9 @@ def download_wav():
     
     try:
         file_name = f"{wav_id}.wav"
-        data = s3.get_object(Bucket=AWS_BUCKET, Key=file_name)['Body'].read()
-
-        return flask.send_file(
-            io.BytesIO(data),
-            as_attachment=True,
-            download_name=file_name,
-            mimetype="audio/wav"
-        )
+        obj = s3.get_object(Bucket=AWS_BUCKET, Key=file_name)
+        body = obj['Body']
+        return stream_download(body.iter_chunks(DOWNLOAD_CHUNK_SIZE), file_name, "audio/wav", obj.get("ContentLength"), close=body.close)
     except Exception as e:
         return {"Error": str(e)}, 503
     
@@ -186,6 +389,7 @@ def get_score_status():
     The "status" key in the JSON response from the POST request indicates whether the processing is complete
     - If `response['status'] == 'processing'` -> still processing
     - If `response['status'] == 'completed'` -> finished processing, can now query download endpoint to retrieve file
+      (the first time this is seen the score is ingested into our bucket in the background, see scores.py)
     - If `response['status'] == 'error'` -> some error occured, check the 'message' header
     """
     score_id = flask.request.args.get("id", None)
@@ -196,13 +400,16 @@ def get_score_status():
         return {"Error": f"Invalid UUID for mxl ID: {score_id}"}, 400
 
     try:
-        r = requests.get(AWS_SCORE_STATUS_URL + str(score_id))
+        r = http.get(AWS_SCORE_STATUS_URL + str(score_id), timeout=UPSTREAM_TIMEOUT)
         print(f"Sent request to {r.url}")
         print(f"Resulting text: {r.text}")
         try:
-            return r.json(), r.status_code
+            body = r.json()
         except:
             return r.text, r.status_code
+        if r.status_code == 200 and isinstance(body, dict):
+            ingestor.observe_status(score_id, body.get("status"))
+        return body, r.status_code
     except Exception as e:
         return {"Error": str(e)}, 503
 
@@ -215,8 +422,38 @@ def analyze_performance():
 
     Make sure that the pdf has been processed and converted to an mxl file! (check the score-status endpoint)
 
+    Inputs that can't be analyzed (silent or unreadable recordings, scores without notes, recordings far longer
+    than the score) are rejected with a 422 before the analysis runs
+
     The response JSON contains two keys: "dynamics_feedback" and "pitch_feedback", each containing a list of PitchMismatch or DynamicsMismatch feedback objects
 
+    Optionally pass "time_budget" (seconds) in the body to bound the latency, time spent waiting for a turn counts against it
+    (a 503 is returned if the budget runs out in the queue). Pitch analysis then runs a coarse pass first
+    and refines the suspicious parts at full resolution until the budget runs out. The response gets two extra keys:
+    "complete" (whether everything was refined) and "completeness" (fraction of the suspicious parts that were refined)
+
+    Optionally pass "tolerance" to change how strictly the performance is judged, any of
+    {"dynamics_db": 5, "pitch_delta": 0.5, "right_note_window": 1} (the defaults): dB the level may be off,
+    how close to the neighbouring semitone a pitch may drift, and seconds within which the right note may be played.
+    Pass "tolerance_levels", e.g. {"strict": {"dynamics_db": 3}, "lenient": {"pitch_delta": 0.8}}, to get the feedback
+    at several levels at once (fields a level leaves out come from "tolerance"). The response then gets a "tolerance_levels"
+    key with "dynamics_feedback" and "pitch_feedback" per level. All levels are judged on a single analysis of the recording
+
+    Optionally pass "dynamics_mode": "note" or "marking" to judge the mean level of every note, or of every span of notes
+    under one dynamics marking, instead of every frame ("frame", the default). "dynamics_feedback" then holds DynamicsSpan objects
+
+    Optionally pass "profile": "balanced" or "fast" to analyze at a lower sample rate and coarser hop, about 2x and 4x
+    faster than "accurate" (the default) at some cost in pitch accuracy (see analysis/profiles.py)
+
+    Analyses are scheduled shortest recording first and the box only runs so many audio-seconds at once (see scheduler.py).
+    When it is over capacity the request is rejected with a 503 and a Retry-After header (seconds)
+
+    Every analysis is stored, see the /progress and /heatmap endpoints
+
+    Large results can be requested in a compact form through the Accept header (see encoding.py):
+    columnar JSON (application/vnd.warbler.columnar+json), MessagePack (application/msgpack) or raw
+    little-endian float32 columns (application/vnd.warbler.float32). Accept-Encoding gzip/br is honored.
+
     They are defined as:
 
     class DynamicsMismatch:
@@ -228,51 +465,126 @@ def analyze_performance():
         time: float
         expected_pitch: float
         actual_pitch: float
+
+    class DynamicsSpan:
+        time: float
+        end: float
+        expectedDB: float
+        actualDB: float
+        peakDB: float
     """
     wav_id = flask.request.json.get("id_wav", None)
     mxl_id = flask.request.json.get("id_mxl", None)
+    time_budget = flask.request.json.get("time_budget", None)
+    tolerance_json = flask.request.json.get("tolerance", None)
+    levels_json = flask.request.json.get("tolerance_levels", None)
+    dynamics_mode = flask.request.json.get("dynamics_mode", "frame")
+    profile_name = flask.request.json.get("profile", "accurate")
 
     if wav_id is None or mxl_id is None:
         return "Both 'id_wav' and 'id_mxl' are required in the body", 400
 
+    if time_budget is not None and (isinstance(time_budget, bool) or not isinstance(time_budget, (int, float)) or time_budget <= 0):
+        return {"Error": f"'time_budget' must be a positive number of seconds, got {time_budget}"}, 400
+    deadline = time.monotonic() + time_budget if time_budget is not None else None
+
+    try:
+        tolerance = parse_tolerance(tolerance_json) if tolerance_json is not None else DEFAULT_TOLERANCE
+        levels = parse_tolerance_levels(levels_json, tolerance) if levels_json is not None else {}
+    except ValueError as e:
+        return {"Error": str(e)}, 400
+    if dynamics_mode not in dynamics_modes:
+        return {"Error": f"'dynamics_mode' must be one of {', '.join(dynamics_modes)}, got {dynamics_mode}"}, 400
+    if not isinstance(profile_name, str) or profile_name not in PROFILES:
+        return {"Error": f"'profile' must be one of {', '.join(PROFILES)}, got {profile_name}"}, 400
+
     if not valid_uuid(wav_id):
         return {"Error": f"Invalid UUID for wav ID: {wav_id}"}, 400
     if not valid_uuid(mxl_id):
         return {"Error": f"Invalid UUID for mxl ID: {mxl_id}"}, 400
     
-    print("Passed checks, about to send requests to download endpoints...")
+    print("Passed checks, about to download the wav and mxl files...")
+    try:
+        # every request gets its own directory, concurrent analyses on one worker must not share files
+        with tempfile.TemporaryDirectory(prefix="warbler-") as tmp:
+            performance_path = Path(tmp) / "performance.wav"
+            fetch_wav(wav_id, performance_path)
+            print(f"Downloaded performance.wav ({performance_path.stat().st_size} bytes)")
+            with score_for_analysis(mxl_id, Path(tmp) / "score.mxl") as sheet_music:
+                cost = estimate_cost(performance_path, sheet_music)
+                print(f"Waiting for a slot for {cost:.0f} audio-seconds...")
+                with scheduler.slot(cost, deadline):
+                    print("Performing analysis...")
+                    analysis = run_cpu_bound(analyze, performance_path, sheet_music, deadline=deadline, tolerance=tolerance, levels=levels,
+                                             dynamics_mode=dynamics_mode, profile=PROFILES[profile_name])
+        if watchdog.after_analysis(analysis, pooled=gevent_active()):
+            recycle_executor()
+
+        try:
+            options = {"tolerance": asdict(tolerance), "tolerance_levels": {name: asdict(level) for name, level in levels.items()},
+                       "dynamics_mode": dynamics_mode, "profile": profile_name, "time_budget": time_budget}
+            run_blocking(results.save, wav_id, mxl_id, analysis, options)
+        except Exception as e:
+            # the history is a convenience, never fail an analysis because of it
+            print(f"Warning: Failed to store the analysis of {wav_id}: {str(e)}")
+
+        metadata = {"complete": analysis.complete, "completeness": analysis.completeness} if deadline is not None else None
+        feedback = {**analysis.feedback, "tolerance_levels": analysis.levels} if analysis.levels else analysis.feedback
+        return feedback_response(feedback, metadata)
+    except PreflightError as e:
+        return {"Error": str(e)}, 422
+    except OverCapacity as e:
+        return {"Error": str(e)}, 503, {"Retry-After": str(e.retry_after)}
+    except Exception as e:
+        return {"Error": str(e)}, 503
+
+def history_query() -> tuple[str, float, float, str]:
+    """The id_mxl, from, to and version parameters shared by the history endpoints. Raises ValueError if they are invalid"""
+    mxl_id = flask.request.args.get("id_mxl", None)
+    if mxl_id is None or not valid_uuid(mxl_id):
+        raise ValueError(f"Key 'id_mxl' with the UUID of a score is required, got {mxl_id}")
+    start, end = float(flask.request.args.get("from", 0.0)), float(flask.request.args.get("to", float("inf")))
+    return mxl_id, start, end, flask.request.args.get("version", ANALYZER_VERSION)
+
+@app.route("/progress")
+def progress():
+    """
+    Accuracy of the takes of a score over time, from the stored analyses (no audio is analyzed).
+
+    Pass id_mxl, optionally from and to (unix seconds), bucket (seconds per bucket, a day by default)
+    and version (the analyzer version, the current one by default). A recording analyzed more than once counts once.
+    The "progress" key holds one entry per bucket with takes: {"start", "takes", "dynamics_feedback": {"mean", "min", "max"}, "pitch_feedback": {...}},
+    where accuracy is the fraction of the played part of a take without mismatches of that kind
+    """
     try:
-        r_wav = requests.get(APP_WAV_DOWNLOAD_URL, params={"id": wav_id})
-        r_mxl = requests.get(APP_MXL_DOWNLOAD_URL, params={"id": mxl_id})
-
-        assert r_wav.status_code == 200, f"Expected 200 status code when downloading previously uploaded wav file, got {r_wav.status_code}"
-        assert r_mxl.status_code == 200, f"Expected 200 status code when downloading previously uploaded mxl file, got {r_mxl.status_code}"
-
-        print("Download requests for wav an mxl succeeded. Storing files temporarily for analysis...")
-        with open("score.mxl", "wb") as f:
-            f.write(r_mxl.content)
-        print("Wrote to score.mxl")
-        with open("performance.wav", "wb") as f:
-            f.write(r_wav.content)
-        print("Wrote to performance.wav")
-
-        print("Performing analysis...")
-        # insert analysis
-        print("Size of score.mxl:", os.path.getsize("score.mxl"))
-        print("Size of performance.wav:", os.path.getsize("performance.wav"))
-
-        dynamics_feedback: list[DynamicsMismatch] = get_dynamics_performance_feedback("score.mxl", "performance.wav")
-        for fb in dynamics_feedback:
-            print(f"At time {fb.time:.2f}s: expected {fb.expectedDB:.2f} dB, got {fb.actualDB:.2f} dB")
-
-        pitch_feedback: list[PitchMismatch] = pitch_check("performance.wav", "score.mxl")
-        for fb in pitch_feedback:
-            print(f"At time {fb.time:.2f}s: expected {fb.expected_pitch:.2f} Hz, got {fb.actual_pitch:.2f} Hz")
-
-        # cleanup files after
-        os.remove("score.mxl")
-        os.remove("performance.wav")
-
-        return flask.jsonify({ "dynamics_feedback": dynamics_feedback, "pitch_feedback": pitch_feedback }), 200
+        mxl_id, start, end, version = history_query()
+        bucket = float(flask.request.args.get("bucket", 86400))
+        if not 0 < bucket < float("inf"):
+            raise ValueError(f"'bucket' must be a positive number of seconds, got {bucket}")
+    except ValueError as e:
+        return {"Error": str(e)}, 400
+    try:
+        return {"id_mxl": mxl_id, "version": version, "bucket": bucket, "progress": run_blocking(results.progress, mxl_id, start, end, bucket, version)}, 200
     except Exception as e:
-        return {"Error": str(e)}, 503
\ No newline at end of file
+        return {"Error": str(e)}, 503
+
+@app.route("/heatmap")
+def heatmap():
+    """
+    Seconds of mismatches per measure of a score, for every take and summed over them, from the stored analyses.
+
+    Pass id_mxl and kind ("pitch_feedback", the default, or "dynamics_feedback"), optionally from, to and version like /progress.
+    The response has "measures" (the measure numbers), "takes" ({"id", "id_wav", "created", "errors"}, oldest first)
+    and "total", where errors and total have one value per measure
+    """
+    try:
+        mxl_id, start, end, version = history_query()
+        kind = flask.request.args.get("kind", "pitch_feedback")
+        if kind not in ("pitch_feedback", "dynamics_feedback"):
+            raise ValueError(f"'kind' must be pitch_feedback or dynamics_feedback, got {kind}")
+    except ValueError as e:
+        return {"Error": str(e)}, 400
+    try:
+        return {"id_mxl": mxl_id, "version": version, "kind": kind, **run_blocking(results.heatmap, mxl_id, kind, start, end, version)}, 200
+    except Exception as e:
+        return {"Error": str(e)}, 503
@@ -0,0 +1,188 @@
+"""
+Memory watchdog of the gunicorn workers.
+
+music21 and librosa keep internal caches and a parsed score is a large object graph, so long-running workers slowly
+gain resident memory. Every request samples its worker's RSS, and with MEMORY_TRACEMALLOC the top allocation sites
+are snapshotted every MEMORY_SNAPSHOT_INTERVAL seconds. Once a worker is over WORKER_MAX_RSS_MB, gunicorn's
+post_request hook (see gunicorn.conf.py) stops it from taking new requests: it finishes the ones in flight and the
+arbiter starts a fresh worker. Analyses report the RSS of the process that ran them and how much it grew during each
+stage (see analysis/memory.py). An analysis pool (see executor.py) over ANALYSIS_MAX_RSS_MB is replaced the same way.
+
+Every worker writes its numbers to its own file in MEMORY_STATS_DIR, so /metrics on any worker reports the whole box.
+With MEMORY_DEBUG=1 every request is snapshotted and /debug/memory dumps what the last request, and all requests since
+the worker started, left allocated. Under gevent workers requests overlap, so the growth per endpoint is approximate.
+"""
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Final
+
+from .metrics import format_metric, labels
+from ..analysis.memory import rss_bytes
+from ..analysis.pipeline import Analysis
+from ..analysis.statefile import locked_state, process_alive, replace_file
+
+MEGABYTE: Final[int] = 1 << 20
+
+WORKER_MAX_RSS: Final[int] = int(float(os.getenv("WORKER_MAX_RSS_MB", "1024")) * MEGABYTE)
+"""resident bytes beyond which a worker is recycled after its current requests, 0 never recycles"""
+
+ANALYSIS_MAX_RSS: Final[int] = int(float(os.getenv("ANALYSIS_MAX_RSS_MB", "1536")) * MEGABYTE)
+"""resident bytes beyond which a worker's analysis pool is replaced, 0 never replaces it"""
+
+MEMORY_TRACEMALLOC: Final[int] = int(os.getenv("MEMORY_TRACEMALLOC", "0"))
+"""frames of traceback tracemalloc keeps per allocation, 0 doesn't trace. Tracing slows allocations down and costs memory"""
+
+MEMORY_SNAPSHOT_INTERVAL: Final[float] = float(os.getenv("MEMORY_SNAPSHOT_INTERVAL", "30"))
+"""seconds between the tracemalloc snapshots behind the top allocators metric"""
+
+MEMORY_DEBUG: Final[bool] = os.getenv("MEMORY_DEBUG", "0") == "1"
+"""serves /debug/memory, snapshots after every request (slow) and needs MEMORY_TRACEMALLOC for the allocation diffs"""
+
+MEMORY_STATS_DIR: Final[str] = os.getenv("MEMORY_STATS_DIR", os.path.join(tempfile.gettempdir(), "warbler-memory"))
+
+STATS_INTERVAL: Final[float] = 1
+"""seconds between writes of a worker's stats file"""
+
+TOP_ALLOCATORS: Final[int] = 10
+
+def new_totals() -> dict:
+    return {"requests": 0, "recycles": 0, "pool_recycles": 0, "endpoints": {}, "stages": {}}
+
+def add_growth(growths: dict[str, dict], name: str, growth: int, count: int = 1) -> None:
+    entry = growths.setdefault(name, {"count": 0, "growth": 0})
+    entry["count"] += count
+    entry["growth"] += growth
+
+def top_allocators(snapshot: tracemalloc.Snapshot) -> list[dict]:
+    return [{"location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}", "bytes": stat.size, "count": stat.count}
+            for stat in snapshot.statistics("lineno")[:TOP_ALLOCATORS]]
+
+def allocation_diff(new: tracemalloc.Snapshot, old: tracemalloc.Snapshot) -> list[dict]:
+    """The allocation sites whose memory changed the most from old to new"""
+    return [{"location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}", "size_diff": stat.size_diff,
+             "count_diff": stat.count_diff, "bytes": stat.size}
+            for stat in new.compare_to(old, "lineno")[:TOP_ALLOCATORS]]
+
+class MemoryWatchdog:
+    def __init__(self, stats_dir: str | Path = MEMORY_STATS_DIR, max_rss: int = WORKER_MAX_RSS, analysis_max_rss: int = ANALYSIS_MAX_RSS,
+                 tracemalloc_frames: int = MEMORY_TRACEMALLOC, snapshot_interval: float = MEMORY_SNAPSHOT_INTERVAL, debug: bool = MEMORY_DEBUG):
+        self.stats_dir = Path(stats_dir)
+        self.stats_dir.mkdir(parents=True, exist_ok=True)
+        self.max_rss = max_rss
+        self.analysis_max_rss = analysis_max_rss
+        self.snapshot_interval = snapshot_interval
+        self.debug = debug
+        self.stats = {"pid": os.getpid(), "rss": 0, "peak_rss": 0, "analysis_rss": 0, "recycling": False,
+                      "top_allocators": [], **new_totals()}
+        self.last_write = 0.0
+        self.last_snapshot = 0.0
+        self.snapshots: list[tracemalloc.Snapshot] = []
+        """with debug: the first snapshot, then the ones after the last two requests"""
+        if tracemalloc_frames > 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(tracemalloc_frames)
+
+    def should_recycle(self) -> bool:
+        """Whether the worker is over its budget and should stop taking requests"""
+        return self.stats["recycling"]
+
+    def after_request(self, endpoint: str, rss_before: int) -> None:
+        """Samples the worker's memory after a request that started with rss_before resident bytes"""
+        rss = rss_bytes()
+        self.stats.update(pid=os.getpid(), rss=rss, peak_rss=max(self.stats["peak_rss"], rss), requests=self.stats["requests"] + 1)
+        add_growth(self.stats["endpoints"], endpoint, rss - rss_before)
+        if self.max_rss > 0 and rss > self.max_rss and not self.stats["recycling"]:
+            print(f"Warning: Worker {os.getpid()} is at {rss / MEGABYTE:.0f} MB, over the {self.max_rss / MEGABYTE:.0f} MB limit, recycling it")
+            self.stats["recycling"] = True
+            self.last_write = 0.0
+
+        now = time.monotonic()
+        if tracemalloc.is_tracing() and (self.debug or now - self.last_snapshot >= self.snapshot_interval):
+            self.last_snapshot = now
+            snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+            self.stats["top_allocators"] = top_allocators(snapshot)
+            if self.debug:
+                self.snapshots = [*self.snapshots[:1], *self.snapshots[1:][-1:], snapshot]
+        if now - self.last_write >= STATS_INTERVAL:
+            self.last_write = now
+            self.write()
+
+    def after_analysis(self, analysis: Analysis, pooled: bool) -> bool:
+        """Records an analysis's memory. Returns whether the pool it ran in (if pooled) is over its budget and should be replaced"""
+        for stage, growth in analysis.stage_growth.items():
+            add_growth(self.stats["stages"], stage, growth)
+        self.stats["analysis_rss"] = analysis.rss
+        if pooled and self.analysis_max_rss > 0 and analysis.rss > self.analysis_max_rss:
+            print(f"Warning: Analysis process is at {analysis.rss / MEGABYTE:.0f} MB, over the {self.analysis_max_rss / MEGABYTE:.0f} MB limit, replacing the pool")
+            self.stats["pool_recycles"] += 1
+            return True
+        return False
+
+    def write(self) -> None:
+        """Publishes this worker's stats for /metrics on the other workers"""
+        replace_file(self.stats_dir / f"{os.getpid()}.json", json.dumps(self.stats))
+
+    def collect(self) -> tuple[list[dict], dict]:
+        """The stats of every live worker on the box, and the totals of the workers that are gone"""
+        self.write()
+        with locked_state(self.stats_dir / "retired.json", new_totals) as totals:
+            live = []
+            for path in self.stats_dir.glob("*.json"):
+                if not path.stem.isdigit():
+                    continue
+                try:
+                    stats = json.loads(path.read_text())
+                except (OSError, json.JSONDecodeError):
+                    continue
+                if process_alive(stats["pid"]):
+                    live.append(stats)
+                    continue
+                totals["requests"] += stats["requests"]
+                totals["recycles"] += stats["recycling"]
+                totals["pool_recycles"] += stats["pool_recycles"]
+                for kind in ("endpoints", "stages"):
+                    for name, entry in stats[kind].items():
+                        add_growth(totals[kind], name, entry["growth"], entry["count"])
+                path.unlink(missing_ok=True)
+        return live, totals
+
+    def metrics(self) -> str:
+        """Memory of every worker on the box, in the Prometheus text format"""
+        live, totals = self.collect()
+        for stats in live:
+            totals["requests"] += stats["requests"]
+            totals["recycles"] += stats["recycling"]
+            totals["pool_recycles"] += stats["pool_recycles"]
+            for kind in ("endpoints", "stages"):
+                for name, entry in stats[kind].items():
+                    add_growth(totals[kind], name, entry["growth"], entry["count"])
+        per_worker = lambda key: {labels(pid=stats["pid"]): stats[key] for stats in live}
+        return "".join([
+            format_metric("warbler_worker_rss_bytes", "gauge", "Resident memory of each worker", per_worker("rss")),
+            format_metric("warbler_worker_peak_rss_bytes", "gauge", "Most resident memory each worker had after a request", per_worker("peak_rss")),
+            format_metric("warbler_analysis_process_rss_bytes", "gauge", "Resident memory of the process that ran each worker's last analysis", per_worker("analysis_rss")),
+            format_metric("warbler_worker_requests_total", "counter", "Requests the workers served", totals["requests"]),
+            format_metric("warbler_worker_recycles_total", "counter", "Workers recycled for using too much memory", totals["recycles"]),
+            format_metric("warbler_analysis_pool_recycles_total", "counter", "Analysis pools replaced for using too much memory", totals["pool_recycles"]),
+            format_metric("warbler_request_rss_growth_bytes", "gauge", "Growth of worker resident memory during requests, per endpoint",
+                          {labels(endpoint=name): entry["growth"] for name, entry in totals["endpoints"].items()}),
+            format_metric("warbler_analysis_stage_rss_growth_bytes", "gauge", "Growth of resident memory during each analysis stage",
+                          {labels(stage=name): entry["growth"] for name, entry in totals["stages"].items()}),
+            format_metric("warbler_tracemalloc_top_bytes", "gauge", "Bytes held by the top allocation sites of each traced worker",
+                          {labels(pid=stats["pid"], location=top["location"]): top["bytes"] for stats in live for top in stats["top_allocators"]}),
+        ])
+
+    def debug_report(self) -> dict:
+        """This worker's memory, and what the last request and all requests since the first one left allocated"""
+        report = {key: self.stats[key] for key in ("pid", "rss", "peak_rss", "analysis_rss", "recycling", "endpoints", "stages", "top_allocators")}
+        report["tracing"] = tracemalloc.is_tracing()
+        if len(self.snapshots) < 2:
+            report["last_request"] = report["since_start"] = None
+            report["hint"] = "Set MEMORY_TRACEMALLOC (e.g. 10) and send a few requests to see allocation diffs"
+        else:
+            report["last_request"] = allocation_diff(self.snapshots[-1], self.snapshots[-2])
+            report["since_start"] = allocation_diff(self.snapshots[-1], self.snapshots[0])
+        return report
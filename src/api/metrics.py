@@ -0,0 +1,27 @@
+"""
+Metrics in the Prometheus text exposition format, for the /metrics endpoint.
+
+Values are plain numbers, a summary is {"sum", "count"} and a histogram additionally has
+"buckets", the cumulative count per upper bound (as a string, the last one "+Inf").
+A gauge or counter with labels is a dict of its values keyed by their labels, see labels.
+"""
+from typing import Final
+
+CONTENT_TYPE: Final[str] = "text/plain; version=0.0.4; charset=utf-8"
+
+def format_metric(name: str, kind: str, help: str, value: float | dict) -> str:
+    """The HELP, TYPE and sample lines of one metric"""
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    if kind in ("histogram", "summary"):
+        lines += [f'{name}_bucket{{le="{bound}"}} {count}' for bound, count in value.get("buckets", {}).items()]
+        lines += [f"{name}_sum {value['sum']}", f"{name}_count {value['count']}"]
+    elif isinstance(value, dict):
+        lines += [f"{name}{{{series}}} {sample}" for series, sample in value.items()]
+    else:
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+def labels(**values) -> str:
+    """The labels of one series, e.g. labels(pid=12, stage="pitch") -> 'pid="12",stage="pitch"'"""
+    escape = lambda value: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{name}="{escape(value)}"' for name, value in values.items())
@@ -0,0 +1,200 @@
+"""
+Admission control and size-aware scheduling of analyses, shared by every gunicorn worker on the box.
+
+Each analysis is costed in audio-seconds (the part of the recording that will actually be analyzed,
+from the wav header and the score length) before it runs. Analyses start shortest job first, with
+waiting jobs gaining priority as they age so long recordings still get their turn, and only while the
+audio-seconds in flight on the box stay under ANALYSIS_CAPACITY. Once the backlog (running and waiting)
+would exceed ANALYSIS_MAX_BACKLOG, new analyses are rejected with a Retry-After estimate instead of queueing.
+
+The workers are separate processes, so the queue lives in a small JSON ledger file (see analysis/statefile.py).
+Entries of workers that died are dropped the next time anyone looks at the ledger, and a ledger that can't be
+read is replaced by an empty one instead of failing every analysis.
+"""
+import math
+import os
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+from itertools import accumulate
+from pathlib import Path
+from typing import Final, Iterator
+
+import soundfile
+
+from .metrics import format_metric
+from ..analysis.artifacts import SharedTimeline
+from ..analysis.preflight import TRIM_DURATION_RATIO
+from ..analysis.statefile import locked_state, process_alive
+from ..analysis.timeline import ScoreTimeline
+
+ANALYSIS_CAPACITY: Final[float] = float(os.getenv("ANALYSIS_CAPACITY", "600"))
+"""audio-seconds that may be analyzed at once on the box. A single longer analysis still runs, on its own"""
+
+ANALYSIS_MAX_BACKLOG: Final[float] = float(os.getenv("ANALYSIS_MAX_BACKLOG", str(4 * ANALYSIS_CAPACITY)))
+"""audio-seconds running and waiting beyond which new analyses are rejected"""
+
+ANALYSIS_AGING: Final[float] = float(os.getenv("ANALYSIS_AGING", "10"))
+"""audio-seconds of priority a waiting analysis gains per second it waits"""
+
+ANALYSIS_QUEUE_TIMEOUT: Final[float] = float(os.getenv("ANALYSIS_QUEUE_TIMEOUT", "120"))
+"""seconds an analysis may wait for its turn before it is rejected after all"""
+
+ANALYSIS_LEDGER: Final[str] = os.getenv("ANALYSIS_LEDGER", os.path.join(tempfile.gettempdir(), "warbler-analysis-ledger.json"))
+
+POLL_INTERVAL: Final[float] = 0.2
+"""seconds between checks of a waiting analysis"""
+
+MIN_COST: Final[float] = 1
+"""audio-seconds charged for any analysis, covers the fixed overhead of short ones"""
+
+MAX_RETRY_AFTER: Final[int] = 600
+
+COST_BUCKETS: Final[tuple[float, ...]] = (10, 30, 60, 120, 300, 600, 1200, 3600)
+"""upper bounds (audio-seconds) of the cost estimate histogram"""
+
+class OverCapacity(Exception):
+    """The box can't take the analysis now. retry_after is a hint in seconds"""
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def estimate_cost(audio_path: str | Path, sheet_music: str | Path | ScoreTimeline | SharedTimeline) -> float:
+    """
+    Audio-seconds the analysis will process: the recording's duration from its header, capped the way preflight
+    trims recordings much longer than the score. Unreadable recordings cost MIN_COST, preflight rejects them quickly
+    """
+    try:
+        duration = soundfile.info(audio_path).duration
+    except RuntimeError:
+        return MIN_COST
+    if isinstance(sheet_music, SharedTimeline):
+        with sheet_music.open() as timeline:
+            return estimate_cost(audio_path, timeline)
+    if isinstance(sheet_music, ScoreTimeline):
+        duration = min(duration, sheet_music.expected_duration() * TRIM_DURATION_RATIO)
+    return max(duration, MIN_COST)
+
+def new_state() -> dict:
+    return {
+        "jobs": {}, "speed": 1.0,
+        "admitted": 0, "rejected": 0, "timed_out": 0,
+        "cost_buckets": [0] * (len(COST_BUCKETS) + 1), "cost_sum": 0.0, "wait_sum": 0.0, "started": 0,
+    }
+
+class Scheduler:
+    def __init__(self, ledger_path: str | Path = ANALYSIS_LEDGER, capacity: float = ANALYSIS_CAPACITY, max_backlog: float = ANALYSIS_MAX_BACKLOG,
+                 aging: float = ANALYSIS_AGING, queue_timeout: float = ANALYSIS_QUEUE_TIMEOUT):
+        self.ledger_path = Path(ledger_path)
+        self.capacity = capacity
+        self.max_backlog = max_backlog
+        self.aging = aging
+        self.queue_timeout = queue_timeout
+
+    @contextmanager
+    def ledger(self) -> Iterator[dict]:
+        """The box-wide state, locked against every other worker until the block ends. Changes to it are saved"""
+        with locked_state(self.ledger_path, new_state) as state:
+            state["jobs"] = {ticket: job for ticket, job in state["jobs"].items() if process_alive(job["pid"])}
+            yield state
+
+    def retry_after(self, state: dict, excess: float) -> int:
+        """Seconds until excess audio-seconds of the backlog have drained, at the measured speed of the running analyses"""
+        running = sum(job["cost"] for job in state["jobs"].values() if job["started"] is not None)
+        throughput = max(running, MIN_COST) / max(state["speed"], 1e-3)
+        return min(max(math.ceil(excess / throughput), 1), MAX_RETRY_AFTER)
+
+    def enqueue(self, cost: float) -> str:
+        """Queues an analysis of cost audio-seconds, returns its ticket. Raises OverCapacity if the backlog is full"""
+        with self.ledger() as state:
+            backlog = sum(job["cost"] for job in state["jobs"].values())
+            state["cost_buckets"][next((i for i, bound in enumerate(COST_BUCKETS) if cost <= bound), len(COST_BUCKETS))] += 1
+            state["cost_sum"] += cost
+            # an analysis that doesn't fit an empty box on its own is still taken when nothing else is there
+            if state["jobs"] and backlog + cost > self.max_backlog:
+                state["rejected"] += 1
+                retry_after = self.retry_after(state, backlog + cost - self.max_backlog)
+            else:
+                ticket = uuid.uuid4().hex
+                state["jobs"][ticket] = {"cost": cost, "pid": os.getpid(), "enqueued": time.time(), "started": None}
+                state["admitted"] += 1
+                return ticket
+        raise OverCapacity(f"Too many analyses in progress ({backlog:.0f} audio-seconds), try again in {retry_after}s", retry_after)
+
+    def priority(self, job: dict, now: float) -> float:
+        """Lower starts first: the cost, minus what the job has earned by waiting"""
+        return job["cost"] - self.aging * (now - job["enqueued"])
+
+    def try_start(self, ticket: str) -> bool:
+        """Starts the analysis if it is the next one and fits under the capacity, returns whether it did"""
+        with self.ledger() as state:
+            now = time.time()
+            job = state["jobs"][ticket]
+            waiting = [other for other in state["jobs"].values() if other["started"] is None]
+            if min(waiting, key=lambda other: self.priority(other, now)) is not job:
+                return False
+            running = sum(other["cost"] for other in state["jobs"].values() if other["started"] is not None)
+            if running > 0 and running + job["cost"] > self.capacity:
+                return False
+            job["started"] = now
+            state["started"] += 1
+            state["wait_sum"] += now - job["enqueued"]
+            return True
+
+    def release(self, ticket: str) -> None:
+        """Removes the analysis from the ledger, updating the measured speed if it ran"""
+        with self.ledger() as state:
+            job = state["jobs"].pop(ticket, None)
+            if job is not None and job["started"] is not None:
+                seconds_per_audio_second = (time.time() - job["started"]) / job["cost"]
+                state["speed"] = 0.8 * state["speed"] + 0.2 * seconds_per_audio_second
+
+    @contextmanager
+    def slot(self, cost: float, deadline: float | None = None) -> Iterator[None]:
+        """
+        Waits for the analysis's turn and holds its place in the capacity until the block ends.
+        Raises OverCapacity if the backlog is full, or if the turn doesn't come within the queue timeout
+        or before deadline (in time.monotonic() seconds), the time waiting would count against the analysis's budget
+        """
+        ticket = self.enqueue(cost)
+        give_up = time.monotonic() + self.queue_timeout
+        if deadline is not None:
+            give_up = min(give_up, deadline)
+        try:
+            while not self.try_start(ticket):
+                if time.monotonic() > give_up:
+                    with self.ledger() as state:
+                        state["jobs"].pop(ticket, None)
+                        state["timed_out"] += 1
+                        retry_after = self.retry_after(state, cost)
+                    if deadline is not None and give_up == deadline:
+                        raise OverCapacity(f"The analysis's time budget ran out before its turn came, try again in {retry_after}s", retry_after)
+                    raise OverCapacity(f"The analysis waited {self.queue_timeout:.0f}s without its turn coming, try again in {retry_after}s", retry_after)
+                time.sleep(POLL_INTERVAL)
+            yield
+        finally:
+            self.release(ticket)
+
+    def metrics(self) -> str:
+        """The queue and cost estimate metrics, in the Prometheus text format"""
+        with self.ledger() as state:
+            jobs = list(state["jobs"].values())
+            running = [job for job in jobs if job["started"] is not None]
+            waiting = [job for job in jobs if job["started"] is None]
+            # Prometheus histogram buckets are cumulative
+            buckets = dict(zip([*map(str, COST_BUCKETS), "+Inf"], accumulate(state["cost_buckets"])))
+            return "".join([
+                format_metric("warbler_analysis_queue_depth", "gauge", "Analyses waiting for their turn", len(waiting)),
+                format_metric("warbler_analysis_running", "gauge", "Analyses running", len(running)),
+                format_metric("warbler_analysis_queued_audio_seconds", "gauge", "Audio-seconds of the waiting analyses", sum(job["cost"] for job in waiting)),
+                format_metric("warbler_analysis_in_flight_audio_seconds", "gauge", "Audio-seconds of the running analyses", sum(job["cost"] for job in running)),
+                format_metric("warbler_analysis_capacity_audio_seconds", "gauge", "Audio-seconds that may run at once", self.capacity),
+                format_metric("warbler_analysis_seconds_per_audio_second", "gauge", "Moving average of the analysis time per audio-second", state["speed"]),
+                format_metric("warbler_analysis_admitted_total", "counter", "Analyses admitted to the queue", state["admitted"]),
+                format_metric("warbler_analysis_rejected_total", "counter", "Analyses rejected because the backlog was full", state["rejected"]),
+                format_metric("warbler_analysis_timed_out_total", "counter", "Analyses rejected after waiting too long", state["timed_out"]),
+                format_metric("warbler_analysis_wait_seconds", "summary", "Time analyses waited for their turn", {"sum": state["wait_sum"], "count": state["started"]}),
+                format_metric("warbler_analysis_cost_audio_seconds", "histogram", "Estimated cost of the analyses",
+                              {"buckets": buckets, "sum": state["cost_sum"], "count": sum(state["cost_buckets"])}),
+            ])
@@ -0,0 +1,160 @@
+"""
+Score ingestion.
+
+Once Audiveris has converted an uploaded pdf, the mxl is copied into our bucket under SCORE_PREFIX and
+compiled into a ScoreTimeline (see analysis/timeline.py) stored next to it, so analyses against that
+score neither wait on Audiveris nor run converter.parse. Ingestion starts the first time /score-status
+sees the score completed, or from a background poller for uploads nobody polls.
+
+Uploaded pdfs are indexed by content hash (see dedup.py), an identical pdf reuses the earlier conversion
+instead of queueing another OMR job.
+"""
+import os
+import tempfile
+import threading
+import time
+from music21 import converter
+from pathlib import Path
+from typing import Callable, Final
+
+from .dedup import claim_digest, index_key
+from ..analysis.timeline import ScoreTimeline
+from ..dynamics.feedback import compile_score
+
+SCORE_PREFIX: Final[str] = "scores/"
+"""S3 key prefix for ingested scores"""
+
+PDF_INDEX_KIND: Final[str] = "pdf-sha256"
+
+POLL_INTERVAL: Final[float] = float(os.getenv("SCORE_POLL_INTERVAL", "5"))
+"""seconds between status checks of uploaded scores that are still processing, 0 disables the poller"""
+
+POLL_TIMEOUT: Final[float] = float(os.getenv("SCORE_POLL_TIMEOUT", "1800"))
+"""uploads that are still not converted after this many seconds are no longer polled"""
+
+def mxl_key(score_id: str) -> str:
+    return f"{SCORE_PREFIX}{score_id}.mxl"
+
+def timeline_key(score_id: str) -> str:
+    return f"{SCORE_PREFIX}{score_id}.timeline.npz"
+
+def get_object_bytes(s3, bucket: str, key: str) -> bytes | None:
+    try:
+        return s3.get_object(Bucket=bucket, Key=key)["Body"].read()
+    except s3.exceptions.NoSuchKey:
+        return None
+
+def compile_mxl(data: bytes) -> bytes:
+    """Parses an mxl file and returns its serialized timeline"""
+    with tempfile.TemporaryDirectory(prefix="warbler-") as tmp:
+        path = Path(tmp) / "score.mxl"
+        path.write_bytes(data)
+        return compile_score(converter.parse(path)).to_bytes()
+
+def stored_timeline(s3, bucket: str, score_id: str) -> ScoreTimeline | None:
+    """The ingested timeline of a score, None if it wasn't ingested (by this TIMELINE_VERSION)"""
+    data = get_object_bytes(s3, bucket, timeline_key(score_id))
+    if data is None:
+        return None
+    try:
+        return ScoreTimeline.from_bytes(data)
+    except ValueError:
+        return None
+
+def ingest_score(s3, bucket: str, score_id: str, fetch_mxl: Callable[[str], bytes], compile: Callable[[bytes], bytes] = compile_mxl) -> ScoreTimeline:
+    """
+    Copies a converted score into the bucket and compiles its timeline, unless that was done before.
+    fetch_mxl downloads the mxl from Audiveris, compile turns it into a serialized timeline.
+    Ingestion is idempotent, concurrent workers ingesting the same score just write the same objects.
+    """
+    timeline = stored_timeline(s3, bucket, score_id)
+    if timeline is not None:
+        return timeline
+
+    mxl = get_object_bytes(s3, bucket, mxl_key(score_id))
+    if mxl is None:
+        mxl = fetch_mxl(score_id)
+        s3.put_object(Bucket=bucket, Key=mxl_key(score_id), Body=mxl)
+
+    data = compile(mxl)
+    s3.put_object(Bucket=bucket, Key=timeline_key(score_id), Body=data)
+    return ScoreTimeline.from_bytes(data)
+
+def find_pdf_conversion(s3, bucket: str, digest: str) -> str | None:
+    """Score id of an earlier upload of the pdf with this content hash"""
+    data = get_object_bytes(s3, bucket, index_key(PDF_INDEX_KIND, digest))
+    return None if data is None else data.decode()
+
+def index_pdf(s3, bucket: str, digest: str, score_id: str, replace: bool = False) -> None:
+    """Maps the pdf's content hash to score_id. replace overwrites a mapping to a failed conversion"""
+    if replace:
+        s3.put_object(Bucket=bucket, Key=index_key(PDF_INDEX_KIND, digest), Body=score_id.encode())
+    else:
+        claim_digest(s3, bucket, PDF_INDEX_KIND, digest, score_id)
+
+class ScoreIngestor:
+    """
+    Runs ingestion in the background, at most once at a time per score in this worker.
+    Under gevent workers threads are greenlets, so the waiting on S3 and Audiveris doesn't block other requests.
+    """
+
+    def __init__(self, ingest: Callable[[str], ScoreTimeline], fetch_status: Callable[[str], str | None]):
+        self.ingest = ingest
+        self.fetch_status = fetch_status
+        self.lock = threading.Lock()
+        self.ingested: set[str] = set()
+        self.running: set[str] = set()
+        self.pending: dict[str, float] = {}
+        """uploads that are still processing, with the time.monotonic() they were uploaded at"""
+        self.poller: threading.Thread | None = None
+
+    def observe_status(self, score_id: str, status: str | None) -> None:
+        """Called with every status Audiveris reports for a score, starts ingestion once it is completed"""
+        if status == "completed":
+            with self.lock:
+                self.pending.pop(score_id, None)
+                if score_id in self.ingested or score_id in self.running:
+                    return
+                self.running.add(score_id)
+            threading.Thread(target=self.run, args=(score_id,), daemon=True).start()
+        elif status == "error":
+            with self.lock:
+                self.pending.pop(score_id, None)
+
+    def run(self, score_id: str) -> None:
+        try:
+            self.ingest(score_id)
+            with self.lock:
+                self.ingested.add(score_id)
+            print(f"Ingested score {score_id}")
+        except Exception as e:
+            # the next completed status (or the first analysis) retries
+            print(f"Warning: Failed to ingest score {score_id}: {str(e)}")
+        finally:
+            with self.lock:
+                self.running.discard(score_id)
+
+    def track_upload(self, score_id: str) -> None:
+        """Polls the status of a fresh upload in the background until it is converted"""
+        if POLL_INTERVAL <= 0:
+            return
+        with self.lock:
+            self.pending[score_id] = time.monotonic()
+            if self.poller is None:
+                self.poller = threading.Thread(target=self.poll, daemon=True)
+                self.poller.start()
+
+    def poll(self) -> None:
+        while True:
+            time.sleep(POLL_INTERVAL)
+            with self.lock:
+                pending = list(self.pending.items())
+            for score_id, uploaded in pending:
+                if time.monotonic() - uploaded > POLL_TIMEOUT:
+                    with self.lock:
+                        self.pending.pop(score_id, None)
+                    continue
+                try:
+                    self.observe_status(score_id, self.fetch_status(score_id))
+                except Exception as e:
+                    print(f"Warning: Failed to poll status of score {score_id}: {str(e)}")
@@ -0,0 +1,77 @@
+import io, types
+import botocore.exceptions
+import librosa
+import numpy as np
+import soundfile
+from pathlib import Path
+from .. import dedup
+from ..dedup import HashingReader, find_duplicate, audio_fingerprint
+
+TEST_WAV_PATH = Path(__file__).resolve().parents[2] / "pitch" / "test_files" / "test2.wav"
+
+class InMemoryS3:
+    """the handful of S3 calls the dedup index makes, kept in a dict"""
+    class NoSuchKey(Exception):
+        pass
+
+    def __init__(self):
+        self.objects: dict[str, bytes] = {}
+        self.exceptions = types.SimpleNamespace(NoSuchKey=InMemoryS3.NoSuchKey)
+
+    def put_object(self, Bucket, Key, Body, IfNoneMatch=None):
+        if IfNoneMatch == "*" and Key in self.objects:
+            raise botocore.exceptions.ClientError({"Error": {"Code": "PreconditionFailed"}}, "PutObject")
+        self.objects[Key] = Body
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise InMemoryS3.NoSuchKey(Key)
+        return {"Body": io.BytesIO(self.objects[Key])}
+
+def upload(s3: InMemoryS3, id: str, data: bytes) -> tuple[str | None, bool]:
+    stream = io.BytesIO(data)
+    reader = HashingReader(stream)
+    while reader.read(4096):
+        pass
+    return find_duplicate(s3, "bucket", id, reader.hexdigest(), stream)
+
+def reencode(data: bytes, sample_rate: int) -> bytes:
+    y, sr = soundfile.read(io.BytesIO(data), always_2d=True)
+    out = io.BytesIO()
+    soundfile.write(out, librosa.resample(y.T, orig_sr=sr, target_sr=sample_rate).T * 0.8, sample_rate, subtype="PCM_16", format="WAV")
+    return out.getvalue()
+
+def test_identical_upload_returns_first_id():
+    s3 = InMemoryS3()
+    data = TEST_WAV_PATH.read_bytes()
+    assert upload(s3, "first", data) == (None, False)
+    assert upload(s3, "second", data) == ("first", True)
+    assert upload(s3, "third", data + b"\0") == (None, False)
+
+def test_fingerprint_matches_reencode(monkeypatch):
+    monkeypatch.setattr(dedup, "FINGERPRINT_ENABLED", True)
+    s3 = InMemoryS3()
+    data = TEST_WAV_PATH.read_bytes()
+    assert upload(s3, "original", data) == (None, False)
+    # only similar, so the re-encode is kept under its own content hash
+    assert upload(s3, "resampled", reencode(data, 48000)) == ("original", False)
+    assert upload(s3, "retry", reencode(data, 48000)) == ("resampled", True)
+
+def test_fingerprint_tells_takes_with_the_same_opening_apart(monkeypatch):
+    monkeypatch.setattr(dedup, "FINGERPRINT_ENABLED", True)
+    s3 = InMemoryS3()
+    y, sample_rate = soundfile.read(TEST_WAV_PATH, always_2d=True)
+    assert upload(s3, "take-1", TEST_WAV_PATH.read_bytes()) == (None, False)
+
+    other_ending, longer = y.copy(), np.concatenate([y, y[len(y) // 2:]])
+    other_ending[len(y) // 2:] = 0.3 * np.sin(2 * np.pi * 1000 * np.arange(len(y) - len(y) // 2) / sample_rate)[:, None]
+    for id, take in (("take-2", other_ending), ("take-3", longer)):
+        out = io.BytesIO()
+        soundfile.write(out, take, sample_rate, format="WAV")
+        assert upload(s3, id, out.getvalue()) == (None, False)
+
+def test_fingerprint_skips_silence():
+    out = io.BytesIO()
+    soundfile.write(out, np.zeros(44100 * 10), 44100, format="WAV")
+    out.seek(0)
+    assert audio_fingerprint(out) is None
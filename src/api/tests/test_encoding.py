@@ -0,0 +1,71 @@
+import gzip, json
+import flask
+import msgpack
+import numpy as np
+from ..encoding import feedback_response, COLUMNAR_MIMETYPE, MSGPACK_MIMETYPE, FLOAT32_MIMETYPE
+from ...analysis.results import MismatchTable
+from ...dynamics.feedback import DynamicsMismatch
+from ...pitch.main import PitchMismatch
+
+app = flask.Flask(__name__)
+
+def sample_feedback(rows: int = 3) -> dict[str, MismatchTable]:
+    times = np.arange(rows) * 0.5
+    return {
+        "dynamics_feedback": MismatchTable(DynamicsMismatch, times, np.full(rows, -20.0), np.full(rows, -30.0)),
+        "pitch_feedback": MismatchTable(PitchMismatch, times, np.full(rows, 440.0), np.full(rows, 415.0)),
+    }
+
+def respond(headers: dict[str, str], feedback: dict[str, MismatchTable], metadata: dict | None = None) -> flask.Response:
+    with app.test_request_context("/analyze-performance", method="POST", headers=headers):
+        return feedback_response(feedback, metadata)
+
+def test_default_is_json_records():
+    r = respond({}, sample_feedback())
+    assert r.mimetype == "application/json"
+    body = json.loads(r.get_data())
+    assert body["dynamics_feedback"][1] == {"time": 0.5, "expectedDB": -20.0, "actualDB": -30.0}
+    assert body["pitch_feedback"][0] == {"time": 0.0, "expected_pitch": 440.0, "actual_pitch": 415.0}
+
+def test_columnar_json():
+    r = respond({"Accept": COLUMNAR_MIMETYPE}, sample_feedback())
+    body = json.loads(r.get_data())
+    assert body["pitch_feedback"]["time"] == [0.0, 0.5, 1.0]
+    assert body["dynamics_feedback"]["actualDB"] == [-30.0, -30.0, -30.0]
+
+def test_msgpack_float32_columns():
+    r = respond({"Accept": MSGPACK_MIMETYPE}, sample_feedback())
+    body = msgpack.unpackb(r.get_data())
+    assert np.frombuffer(body["pitch_feedback"]["expected_pitch"], dtype="<f4").tolist() == [440.0] * 3
+
+def test_raw_float32_layout():
+    r = respond({"Accept": FLOAT32_MIMETYPE}, sample_feedback(rows=2))
+    assert r.headers["X-Warbler-Layout"] == "dynamics_feedback:2:time,expectedDB,actualDB;pitch_feedback:2:time,expected_pitch,actual_pitch"
+    values = np.frombuffer(r.get_data(), dtype="<f4")
+    assert values.tolist() == [0.0, 0.5, -20.0, -20.0, -30.0, -30.0, 0.0, 0.5, 440.0, 440.0, 415.0, 415.0]
+
+def test_gzip_only_for_large_bodies():
+    small = respond({"Accept-Encoding": "gzip"}, sample_feedback(rows=1))
+    assert "Content-Encoding" not in small.headers
+
+    large = respond({"Accept-Encoding": "gzip", "Accept": COLUMNAR_MIMETYPE}, sample_feedback(rows=1000))
+    assert large.headers["Content-Encoding"] == "gzip"
+    assert len(json.loads(gzip.decompress(large.get_data()))["pitch_feedback"]["time"]) == 1000
+
+def test_metadata_is_added_to_every_format():
+    metadata = {"complete": False, "completeness": 0.5}
+    assert json.loads(respond({}, sample_feedback(), metadata).get_data())["complete"] is False
+    assert json.loads(respond({"Accept": COLUMNAR_MIMETYPE}, sample_feedback(), metadata).get_data())["completeness"] == 0.5
+    assert msgpack.unpackb(respond({"Accept": MSGPACK_MIMETYPE}, sample_feedback(), metadata).get_data())["complete"] is False
+    assert json.loads(respond({"Accept": FLOAT32_MIMETYPE}, sample_feedback(), metadata).headers["X-Warbler-Metadata"]) == metadata
+
+def test_groups_nest_and_flatten_in_layout():
+    feedback = {**sample_feedback(rows=1), "tolerance_levels": {"strict": sample_feedback(rows=2)}}
+    body = json.loads(respond({}, feedback).get_data())
+    assert len(body["tolerance_levels"]["strict"]["pitch_feedback"]) == 2
+    r = respond({"Accept": FLOAT32_MIMETYPE}, feedback)
+    assert r.headers["X-Warbler-Layout"].split(";")[2:] == [
+        "tolerance_levels/strict/dynamics_feedback:2:time,expectedDB,actualDB",
+        "tolerance_levels/strict/pitch_feedback:2:time,expected_pitch,actual_pitch",
+    ]
+    assert len(np.frombuffer(r.get_data(), dtype="<f4")) == 3 * 2 + 6 * 2
@@ -0,0 +1,73 @@
+import sqlite3
+import numpy as np
+import pytest
+from ..history import ResultsStore
+from ...analysis.pipeline import Analysis
+from ...analysis.results import MismatchTable
+from ...analysis.window import AnalysisWindow
+from ...dynamics.feedback import DynamicsSpan
+from ...pitch.main import PitchMismatch
+
+SCORE = "11111111-1111-1111-1111-111111111111"
+
+def take(pitch_times: list[float], span: tuple[float, float] | None = None) -> Analysis:
+    """A 10s take of a score with measures starting every 2s from the onset at 1s, with pitch mismatches every 0.1s"""
+    spans = [span] if span else []
+    return Analysis(
+        feedback={
+            "pitch_feedback": MismatchTable(PitchMismatch, pitch_times, np.full(len(pitch_times), 440.0), np.full(len(pitch_times), 466.2)),
+            "dynamics_feedback": MismatchTable(DynamicsSpan, [s[0] for s in spans], [s[1] for s in spans], [-10.0] * len(spans), [0.0] * len(spans), [0.0] * len(spans)),
+        },
+        window=AnalysisWindow(start=0.5, end=11.5, onset=1.0, release=11.0),
+        measure_starts={"pitch_feedback": 1.0 + np.arange(5) * 2.0, "dynamics_feedback": 1.0 + np.arange(5) * 2.0},
+        measure_numbers=np.arange(1, 6),
+        frame_seconds={"pitch_feedback": 0.1, "dynamics_feedback": 0.0},
+    )
+
+def test_progress_counts_each_recording_once(tmp_path):
+    store = ResultsStore(tmp_path / "results.sqlite3")
+    day = 86400
+    store.save("first", SCORE, take([1.0, 1.1], span=(3.0, 5.0)), created=0.5 * day)
+    # the first recording analyzed again on the same day replaces its earlier analysis
+    store.save("first", SCORE, take([1.0, 1.1, 1.2, 1.3]), created=0.6 * day)
+    store.save("second", SCORE, take([]), created=1.5 * day)
+    store.save("other score", "22222222-2222-2222-2222-222222222222", take([1.0] * 50), created=1.5 * day)
+
+    first_day, second_day = store.progress(SCORE, bucket=day)
+    assert (first_day["start"], first_day["takes"]) == (0, 1)
+    assert first_day["pitch_feedback"]["mean"] == pytest.approx(1 - 0.4 / 10)
+    assert first_day["dynamics_feedback"]["mean"] == 1.0
+    assert (second_day["start"], second_day["takes"], second_day["pitch_feedback"]["mean"]) == (day, 1, 1.0)
+    assert store.progress(SCORE, start=day, bucket=day) == [second_day]
+
+def test_heatmap_bins_mismatches_into_measures(tmp_path):
+    store = ResultsStore(tmp_path / "results.sqlite3")
+    store.save("first", SCORE, take([0.8, 1.5, 3.0, 3.1, 10.9], span=(3.5, 4.5)), created=1.0)
+    second = store.save("second", SCORE, take([9.0]), created=2.0)
+
+    heatmap = store.heatmap(SCORE, "pitch_feedback")
+    assert heatmap["measures"] == [1, 2, 3, 4, 5]
+    # the mismatch in the lead-in counts towards the first measure
+    assert [take["id_wav"] for take in heatmap["takes"]] == ["first", "second"]
+    assert heatmap["takes"][0]["errors"] == pytest.approx([0.2, 0.2, 0, 0, 0.1])
+    assert heatmap["total"] == pytest.approx([0.2, 0.2, 0, 0, 0.2])
+    assert store.heatmap(SCORE, "dynamics_feedback")["total"] == pytest.approx([0, 1.0, 0, 0, 0])
+
+    stored = store.feedback(second)
+    assert stored["pitch_feedback"].item_type is PitchMismatch
+    assert stored["pitch_feedback"]["time"].tolist() == [9.0]
+
+def test_progressive_rows_cover_their_own_pass(tmp_path):
+    analysis = take([2.0, 2.1, 4.0, 6.0])
+    # refined between 1.5s and 3s, the other rows come from a coarse pass 4x as long per row
+    analysis.coarse_frame_seconds, analysis.refined_regions = {"pitch_feedback": 0.4}, {"pitch_feedback": [(1.5, 3.0)]}
+    assert analysis.accuracy("pitch_feedback") == pytest.approx(1 - (0.1 + 0.1 + 0.4 + 0.4) / 10)
+
+    # databases from before per-row durations are upgraded in place
+    with sqlite3.connect(tmp_path / "results.sqlite3") as db:
+        db.execute("CREATE TABLE feedback (analysis_id INTEGER NOT NULL, level TEXT NOT NULL, kind TEXT NOT NULL, item_type TEXT NOT NULL, "
+                   "rows INTEGER NOT NULL, accuracy REAL NOT NULL, frame_seconds REAL NOT NULL, measure_starts BLOB NOT NULL, data BLOB NOT NULL, "
+                   "PRIMARY KEY (analysis_id, level, kind)) WITHOUT ROWID")
+    store = ResultsStore(tmp_path / "results.sqlite3")
+    store.save("first", SCORE, analysis, created=1.0)
+    assert store.heatmap(SCORE, "pitch_feedback")["total"] == pytest.approx([0.2, 0.4, 0.4, 0, 0])
@@ -0,0 +1,37 @@
+import json
+import subprocess
+import sys
+from types import SimpleNamespace
+from ..memory import MemoryWatchdog
+
+def test_recycles_over_the_limit(tmp_path):
+    watchdog = MemoryWatchdog(tmp_path, max_rss=1 << 50, analysis_max_rss=1 << 20)
+    watchdog.after_request("analyze_performance", 0)
+    assert not watchdog.should_recycle()
+    # the worker itself is always over a megabyte
+    watchdog.max_rss = 1 << 20
+    watchdog.after_request("analyze_performance", 0)
+    assert watchdog.should_recycle()
+
+    analysis = SimpleNamespace(stage_growth={"pitch": 100, "dynamics": 50}, rss=2 << 20)
+    assert not watchdog.after_analysis(analysis, pooled=False)  # ran in the worker itself, there is no pool to replace
+    assert watchdog.after_analysis(analysis, pooled=True)
+    assert watchdog.stats["pool_recycles"] == 1 and watchdog.stats["stages"]["pitch"] == {"count": 2, "growth": 200}
+
+def test_metrics_cover_the_box_and_keep_dead_workers_counts(tmp_path):
+    dead = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True, text=True).stdout.strip()
+    (tmp_path / f"{dead}.json").write_text(json.dumps({
+        "pid": int(dead), "rss": 1, "peak_rss": 1, "analysis_rss": 0, "recycling": True, "top_allocators": [],
+        "requests": 7, "recycles": 0, "pool_recycles": 1, "endpoints": {"progress": {"count": 7, "growth": 4096}}, "stages": {},
+    }))
+    watchdog = MemoryWatchdog(tmp_path, max_rss=0)
+    watchdog.after_request("progress", 0)
+
+    for _ in range(2):  # the dead worker is folded into the totals once
+        metrics = watchdog.metrics()
+        assert "warbler_worker_requests_total 8\n" in metrics
+        assert "warbler_worker_recycles_total 1\n" in metrics
+        assert "warbler_analysis_pool_recycles_total 1\n" in metrics
+        assert f'warbler_worker_rss_bytes{{pid="{watchdog.stats["pid"]}"}}' in metrics and f'pid="{dead}"' not in metrics
+        assert 'warbler_request_rss_growth_bytes{endpoint="progress"}' in metrics
+    assert not (tmp_path / f"{dead}.json").exists()
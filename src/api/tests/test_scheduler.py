@@ -0,0 +1,83 @@
+import subprocess
+import sys
+import time
+import pytest
+from ..scheduler import OverCapacity, Scheduler, estimate_cost
+from ...dynamics.feedback import compile_score
+from pathlib import Path
+from music21 import converter
+
+TEST_FILES_DIR = Path(__file__).resolve().parents[2] / "pitch" / "test_files"
+
+def test_shortest_job_starts_first(tmp_path):
+    scheduler = Scheduler(tmp_path / "ledger.json", capacity=100, aging=0)
+    running = scheduler.enqueue(90)
+    assert scheduler.try_start(running)
+    long, short = scheduler.enqueue(60), scheduler.enqueue(5)
+    assert not scheduler.try_start(long)
+    assert scheduler.try_start(short)  # fits next to the running one
+    scheduler.release(running)
+    scheduler.release(short)
+    assert scheduler.try_start(long)
+
+def test_waiting_jobs_age(tmp_path):
+    scheduler = Scheduler(tmp_path / "ledger.json", capacity=100, aging=1000)
+    long = scheduler.enqueue(60)
+    time.sleep(0.1)
+    short = scheduler.enqueue(5)
+    assert not scheduler.try_start(short)
+    assert scheduler.try_start(long)
+
+def test_rejects_over_backlog_with_retry_after(tmp_path):
+    scheduler = Scheduler(tmp_path / "ledger.json", capacity=100, max_backlog=150)
+    assert scheduler.try_start(scheduler.enqueue(100))
+    with pytest.raises(OverCapacity) as rejected:
+        scheduler.enqueue(60)
+    assert rejected.value.retry_after >= 1
+    assert "warbler_analysis_rejected_total 1" in scheduler.metrics()
+
+def test_jobs_of_dead_workers_are_dropped(tmp_path):
+    ledger = tmp_path / "ledger.json"
+    code = f"from src.api.scheduler import Scheduler; s = Scheduler({str(ledger)!r}); s.try_start(s.enqueue(100))"
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=Path(__file__).resolve().parents[3])
+    scheduler = Scheduler(ledger, capacity=100)
+    assert "warbler_analysis_running 0" in scheduler.metrics()
+    assert scheduler.try_start(scheduler.enqueue(100))
+
+def test_concurrent_workers_keep_every_update(tmp_path):
+    ledger = tmp_path / "ledger.json"
+    code = (f"from src.api.scheduler import Scheduler; s = Scheduler({str(ledger)!r}, capacity=1e9, max_backlog=1e9)\n"
+            "for _ in range(200): s.release(s.enqueue(1))")
+    workers = [subprocess.Popen([sys.executable, "-c", code], cwd=Path(__file__).resolve().parents[3]) for _ in range(2)]
+    assert all(worker.wait() == 0 for worker in workers)
+    assert "warbler_analysis_admitted_total 400" in Scheduler(ledger).metrics()
+
+def test_corrupt_ledger_starts_over(tmp_path):
+    ledger = tmp_path / "ledger.json"
+    ledger.write_text('{"jobs": {"cut off')  # a worker killed mid-write before saves were atomic
+    scheduler = Scheduler(ledger, capacity=100)
+    assert scheduler.try_start(scheduler.enqueue(10))
+    assert "warbler_analysis_running 1" in scheduler.metrics()
+
+def test_wait_stops_at_the_deadline(tmp_path):
+    scheduler = Scheduler(tmp_path / "ledger.json", capacity=100, queue_timeout=60)
+    assert scheduler.try_start(scheduler.enqueue(100))
+    start = time.monotonic()
+    with pytest.raises(OverCapacity, match="time budget"):
+        with scheduler.slot(50, deadline=start + 0.5):
+            pass
+    assert time.monotonic() - start < 5
+    assert "warbler_analysis_timed_out_total 1" in scheduler.metrics()
+
+def test_metrics_expose_queue_and_costs(tmp_path):
+    scheduler = Scheduler(tmp_path / "ledger.json", capacity=10)
+    scheduler.try_start(scheduler.enqueue(8))
+    scheduler.enqueue(20)
+    metrics = scheduler.metrics()
+    assert "warbler_analysis_queue_depth 1" in metrics
+    assert 'warbler_analysis_cost_audio_seconds_bucket{le="10"} 1' in metrics
+    assert 'warbler_analysis_cost_audio_seconds_bucket{le="+Inf"} 2' in metrics
+
+def test_cost_is_capped_by_score_length():
+    timeline = compile_score(converter.parse(str(TEST_FILES_DIR / "test7.mxl")))
+    assert estimate_cost(TEST_FILES_DIR / "test7.wav", timeline) == pytest.approx(min(estimate_cost(TEST_FILES_DIR / "test7.wav", str(TEST_FILES_DIR / "test7.mxl")), 3 * timeline.expected_duration()))
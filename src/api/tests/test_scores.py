@@ -0,0 +1,38 @@
+from pathlib import Path
+from .test_dedup import InMemoryS3
+from ..scores import ScoreIngestor, find_pdf_conversion, index_pdf, ingest_score, mxl_key, timeline_key
+
+TEST_MXL_PATH = Path(__file__).resolve().parents[2] / "dynamics" / "mxl_test_files" / "test8.mxl"
+
+def test_ingest_stores_mxl_and_timeline_once():
+    s3 = InMemoryS3()
+    fetched = []
+    def fetch(score_id: str) -> bytes:
+        fetched.append(score_id)
+        return TEST_MXL_PATH.read_bytes()
+
+    timeline = ingest_score(s3, "bucket", "score", fetch)
+    assert s3.objects[mxl_key("score")] == TEST_MXL_PATH.read_bytes()
+    assert timeline_key("score") in s3.objects
+    assert timeline.has_notes
+
+    again = ingest_score(s3, "bucket", "score", fetch)
+    assert fetched == ["score"]
+    assert again.expected_duration() == timeline.expected_duration()
+
+def test_pdf_index_keeps_first_conversion_unless_replaced():
+    s3 = InMemoryS3()
+    assert find_pdf_conversion(s3, "bucket", "digest") is None
+    index_pdf(s3, "bucket", "digest", "first")
+    index_pdf(s3, "bucket", "digest", "second")
+    assert find_pdf_conversion(s3, "bucket", "digest") == "first"
+    index_pdf(s3, "bucket", "digest", "third", replace=True)
+    assert find_pdf_conversion(s3, "bucket", "digest") == "third"
+
+def test_ingestor_runs_once_per_completed_score():
+    ingested = []
+    ingestor = ScoreIngestor(ingested.append, lambda score_id: "completed")
+    ingestor.observe_status("score", "processing")
+    ingestor.run("score")
+    ingestor.observe_status("score", "completed")
+    assert ingested == ["score"]
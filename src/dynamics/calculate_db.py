@@ -16,9 +16,7 @@ def calculate_dB_levels(audio_file_path, frame_length=2048, hop_length=512): #ch
     return rms_dB_flat
 
 if __name__ == "__main__":
-    audio_file = '/Users/richardwu/Desktop/MusicNU Dynamics/Ode to Joy - Beethoven (Easy variation) [Piano Sheet Music].wav' #filepath
-    dB_levels = calculate_dB_levels(audio_file)
-
-    # print db
-    for dB in dB_levels:
-        print(f"dB: {dB:.2f} dB")
\ No newline at end of file
+    # python -m src.dynamics.calculate_db recording.wav, see src/analysis/batch.py to analyze many recordings
+    import sys
+    for dB in calculate_dB_levels(sys.argv[1]):
+        print(f"dB: {dB:.2f} dB")
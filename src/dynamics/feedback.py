@@ -4,16 +4,34 @@ Compares actual audio performance against sheet music dynamics markings.
 """
 import librosa
 import music21
+from dataclasses import dataclass
 import numpy as np
 from music21 import converter, dynamics, tempo
 from scipy.interpolate import interp1d
 from pathlib import Path
 
+from ..analysis.profiles import DEFAULT_PROFILE, AnalysisProfile, Recording, load_span
+from ..analysis.results import MismatchTable
+from ..analysis.timeline import ScoreTimeline
+from ..analysis.window import AnalysisWindow
+
+@dataclass(slots=True)
 class DynamicsMismatch:
     time: float
     expectedDB: float
     actualDB: float
 
+@dataclass(slots=True)
+class DynamicsSpan:
+    time: float
+    """start of the note or marking span on the recording, in seconds"""
+    end: float
+    expectedDB: float
+    actualDB: float
+    """mean level over the span, relative to the loudest frame"""
+    peakDB: float
+    """loudest frame of the span, relative to the loudest frame"""
+
 # Mapping of dynamic markings to relative dB levels
 dynamic_to_rms: dict[str, int] = {
     "pp": -40, "p": -30, "mp": -25,
@@ -25,18 +43,28 @@ dynamic_to_rms: dict[str, int] = {
 # Default tempo if none provided in score
 default_tempo: int = 120
 
-def load_audio(audio_path: str | Path) -> tuple[np.ndarray, int]:
+# How many dB the performance may be off from the expected level before it's a mismatch
+dynamics_tolerance_db: float = 5
+
+# "frame" compares every RMS frame with the interpolated expected curve, "note" compares the level of every note
+# and "marking" the level of every span of notes under one dynamics marking
+dynamics_modes: tuple[str, ...] = ("frame", "note", "marking")
+
+def load_audio(audio_path: str | Path | Recording, offset: float = 0.0, duration: float | None = None, profile: AnalysisProfile = DEFAULT_PROFILE) -> tuple[np.ndarray, int]:
     """
     Load audio file and calculate RMS.
     
     Args:
-        audio_path: Path to audio file
+        audio_path: Path to audio file, or the already decoded Recording
+        offset: Start loading this many seconds into the file
+        duration: Only load this many seconds, None loads until the end of the file
+        profile: Sample rate, hop length and frame length of the RMS frames
         
     Returns:
         Tuple of (rms_array, sample_rate)
     """
-    y, sample_rate = librosa.load(audio_path)
-    rms = librosa.feature.rms(y=y)[0]
+    y, sample_rate = load_span(audio_path, profile.dynamics_sample_rate, offset=offset, duration=duration)
+    rms = librosa.feature.rms(y=y, frame_length=profile.dynamics_frame_length, hop_length=profile.dynamics_hop_length)[0]
     return rms, sample_rate
 
 def get_dynamics(score: music21.stream.Score) -> list[tuple[float, str]]:
@@ -70,77 +98,145 @@ def get_tempos(score: music21.stream.Score) -> list[tuple[float, int]]:
         tempos.insert(0, (0.0, default_tempo))
     return tempos
 
-def rms_note_by_note(score: music21.stream.Score, dynamics_list: list[tuple[float, str]], tempos_list: list[tuple[float, int]], sample_rate: int) -> tuple[list, list]:
-
-    def extend_expected_rms(start: float, end: float, decibel: int, tempo: int) -> None:
-        duration: float = end - start
-        samples: int = int((duration / tempo) * sample_rate)
-        expected_rms.extend([decibel] * samples)
-        time_points.extend(np.linspace(start, end, samples, endpoint=False))
-
-    expected_rms: list[float] = []
-    time_points: list[float] = []
-    note_ptr, dyn_ptr, tempo_ptr = 0, 0, 0
-    cur_beat = 0.0
+def dynamic_level(marking: str) -> int | None:
+    """Expected level in dB of a dynamics marking, None for markings without a level in dynamic_to_rms"""
+    return dynamic_to_rms.get(marking)
 
-    # only consider the first part in the score, for now at least
-    notes_and_rests = list(score.parts[0].recurse().notesAndRests)  
+def compile_score(score: music21.stream.Score) -> ScoreTimeline:
+    """Precompiled form of the score with its tempo map and dynamics levels"""
+    return ScoreTimeline.from_score(score, get_tempos(score), [(offset, dynamic_level(marking)) for offset, marking in get_dynamics(score)])
 
-    while note_ptr < len(notes_and_rests):
-        note = notes_and_rests[note_ptr]
-
-        note_length: float = note.duration.quarterLength
-        next_note_change: float = cur_beat + note_length
-        next_dynamic_change: float = dynamics_list[dyn_ptr + 1][0] if dyn_ptr < len(dynamics_list) - 1 else float('inf')
-        next_tempo_change: float = tempos_list[tempo_ptr + 1][0] if tempo_ptr < len(tempos_list) - 1 else float('inf')
-
-        cur_end: float = next_note_change
-        cur_tempo: int = tempos_list[tempo_ptr][1]
-        cur_dyn = dynamic_to_rms.get(dynamics_list[dyn_ptr][1]) if note.isNote else dynamic_to_rms.get("rest")
-
-        if(next_dynamic_change < next_note_change):
-            cur_end = next_dynamic_change
-            dyn_ptr += 1
-        else:
-            if next_tempo_change == next_note_change:
-                tempo_ptr += 1
-            note_ptr += 1
-
-        extend_expected_rms(start=cur_beat, end=cur_end, decibel=cur_dyn, tempo=cur_tempo)
-        cur_beat = min(next_note_change, next_dynamic_change, next_tempo_change)
-        
-    return expected_rms, time_points
+def rms_note_by_note(score: music21.stream.Score, dynamics_list: list[tuple[float, str]], tempos_list: list[tuple[float, int]], sample_rate: int) -> tuple[list, list]:
+    """Expected level (dB) and score position of every sample of the first part of the score"""
+    timeline = ScoreTimeline.from_score(score, tempos_list, [(offset, dynamic_level(marking)) for offset, marking in dynamics_list])
+    return timeline.expected_rms(sample_rate, dynamic_to_rms["rest"])
 
 def align_expected_rms(time_points: list, expected_rms: list, rms_len: int) -> np.ndarray:
     """Interpolates expected RMS to match the frame length of actual RMS."""
     interp_func = interp1d(time_points, expected_rms, kind="linear", fill_value="extrapolate")
     return interp_func(np.linspace(0, time_points[-1], rms_len))
 
-def analyze_performance(rms: np.ndarray, expected_rms: list, time_points: list) -> list[str]:
-    """Analyze performance by aligning RMS values and providing feedback."""
+def analyze_performance(rms: np.ndarray, expected_rms: list, time_points: list, seconds_per_frame: float | None = None, offset: float = 0.0,
+                        tolerance_db: float = dynamics_tolerance_db) -> MismatchTable:
+    """
+    Analyze performance by aligning RMS values and providing feedback.
+
+    If seconds_per_frame is given, mismatch times are reported in seconds on the recording's timeline,
+    starting at offset. Otherwise they are positions in the score, in the units of time_points.
+    """
+    return analyze_performance_levels(rms, expected_rms, time_points, [tolerance_db], seconds_per_frame, offset)[0]
+
+def analyze_performance_levels(rms: np.ndarray, expected_rms: list, time_points: list, tolerances_db: list[float],
+                               seconds_per_frame: float | None = None, offset: float = 0.0) -> list[MismatchTable]:
+    """Same as analyze_performance, with one MismatchTable per tolerance. The deviation per frame is computed once"""
     interpolated_expected_rms = align_expected_rms(time_points, expected_rms, len(rms))
     
     actual_db = librosa.amplitude_to_db(rms, ref=np.max)
     expected_db = librosa.amplitude_to_db(interpolated_expected_rms, ref=np.max)
+    deviation = np.abs(actual_db - expected_db)
 
-    feedback: list[DynamicsMismatch] = []
-    for i, (act, exp) in enumerate(zip(actual_db, expected_db)):
-        if abs(act - exp) > 5:  # Adjust tolerance
+    tables = []
+    for tolerance_db in tolerances_db:
+        mismatched = np.flatnonzero(deviation > tolerance_db)
+        if seconds_per_frame is None:
+            times = mismatched / len(rms) * time_points[-1]
+        else:
+            times = offset + mismatched * seconds_per_frame
+        tables.append(MismatchTable(DynamicsMismatch, times, expected_db[mismatched], actual_db[mismatched]))
+    return tables
 
-            feedback.append(DynamicsMismatch(time=i / len(rms) * time_points[-1], expectedDB=exp, actualDB=act))
-    return feedback
+def span_levels(rms: np.ndarray, first: np.ndarray, last: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Power sum and peak RMS of the frames [first, last) of every (non-empty, non-overlapping, sorted) span"""
+    # reduceat reduces between consecutive indices, so interleaving the ends gives the spans at even positions
+    # and the gaps between them at odd ones. The padding keeps the end index of a span ending on the last frame valid
+    padded = np.append(rms, 0.0)
+    bounds = np.column_stack([first, last]).ravel()
+    power_sums = np.add.reduceat(padded ** 2, bounds)[::2]
+    peaks = np.maximum.reduceat(padded, bounds)[::2]
+    return power_sums, peaks
 
-def get_dynamics_performance_feedback(sheet_music_path: str, audio_path: str) -> list[DynamicsMismatch]:
-    rms, sample_rate = load_audio(audio_path)
-    
+def analyze_spans_levels(rms: np.ndarray, timeline: ScoreTimeline, tolerances_db: list[float], mode: str,
+                         seconds_per_frame: float, offset: float = 0.0) -> list[MismatchTable]:
+    """
+    Note ("note" mode) or marking span ("marking" mode) level dynamics: the mean level of the frames of each span
+    is compared with the level of its marking, one MismatchTable of DynamicsSpan per tolerance.
+    The score is stretched over the frames like in analyze_performance, rests are left out.
+    Costs one pass over the frames plus work per note, instead of expanding the score to every sample
+    """
+    note_beats = timeline.note_beats()
+    is_note = ~np.isnan(timeline.note_frequencies)
+    note_seconds = timeline.beats_to_seconds(note_beats)
+
+    # score time of every frame, so the notes can be located with a binary search
+    frame_seconds = np.arange(len(rms)) * (note_seconds[-1] / max(len(rms), 1))
+    frame_bounds = np.searchsorted(frame_seconds, note_seconds)
+    first, last = frame_bounds[:-1][is_note], frame_bounds[1:][is_note]
+    markings = timeline.marking_of(note_beats[:-1][is_note])
+
+    played = last > first  # notes shorter than a frame have no frames of their own
+    first, last, markings = first[played], last[played], markings[played]
+    power_sums, peaks = span_levels(rms, first, last)
+    frame_counts = last - first
+
+    if mode == "marking":
+        groups = np.flatnonzero(np.diff(markings, prepend=-1) != 0)
+        power_sums, peaks, frame_counts = np.add.reduceat(power_sums, groups), np.maximum.reduceat(peaks, groups), np.add.reduceat(frame_counts, groups)
+        first, last, markings = first[groups], last[np.append(groups[1:], len(last)) - 1], markings[groups]
+
+    ref = rms.max(initial=0.0)
+    actual_db = librosa.power_to_db(power_sums / np.maximum(frame_counts, 1), ref=ref ** 2, top_db=None)
+    peak_db = librosa.amplitude_to_db(peaks, ref=ref, top_db=None)
+    expected_db = timeline.dynamic_db[markings]
+    deviation = np.abs(actual_db - expected_db)  # nan for markings without a level, which never mismatch
+
+    tables = []
+    for tolerance_db in tolerances_db:
+        mismatched = np.flatnonzero(deviation > tolerance_db)
+        tables.append(MismatchTable(DynamicsSpan, offset + first[mismatched] * seconds_per_frame, offset + last[mismatched] * seconds_per_frame,
+                                    expected_db[mismatched], actual_db[mismatched], peak_db[mismatched]))
+    return tables
+
+def get_dynamics_performance_feedback(sheet_music_path: str, audio_path: str) -> MismatchTable:
     score = converter.parse(sheet_music_path)
-    dynamics_list = get_dynamics(score)
-    tempo_list = get_tempos(score)
+    return get_dynamics_feedback_for_score(score, audio_path)
+
+def get_dynamics_feedback_for_score(score: music21.stream.Score, audio_path: str, window: AnalysisWindow | None = None) -> MismatchTable:
+    """Same as get_dynamics_performance_feedback, for an already parsed score"""
+    return get_dynamics_feedback_for_timeline(compile_score(score), audio_path, window=window)
+
+def get_dynamics_feedback_for_timeline(timeline: ScoreTimeline, audio_path: str | Recording, window: AnalysisWindow | None = None,
+                                       profile: AnalysisProfile = DEFAULT_PROFILE) -> MismatchTable:
+    """
+    Same as get_dynamics_performance_feedback, for a precompiled score.
+    If a window is given, only the part between its onset and release (loaded with the window's margin around it)
+    is analyzed and the score is stretched over it. Mismatch times are seconds on the recording's timeline.
+    """
+    return get_dynamics_feedback_levels(timeline, audio_path, [dynamics_tolerance_db], window=window, profile=profile)[0]
+
+def get_dynamics_feedback_levels(timeline: ScoreTimeline, audio_path: str | Recording, tolerances_db: list[float], window: AnalysisWindow | None = None,
+                                 mode: str = "frame", profile: AnalysisProfile = DEFAULT_PROFILE) -> list[MismatchTable]:
+    """
+    Same as get_dynamics_feedback_for_timeline, with one MismatchTable per tolerance, all from a single RMS pass.
+    mode is one of dynamics_modes, the tables hold DynamicsSpan rows instead of DynamicsMismatch ones unless it's "frame"
+    """
+    if window is None:
+        rms, sample_rate = load_audio(audio_path, profile=profile)
+        seconds_per_frame = profile.dynamics_hop_length / sample_rate
+        offset = 0.0
+    else:
+        # the margin is loaded so the frames at the onset and release see the audio around them instead of padding,
+        # but only the frames from the onset to the release are compared with the score
+        rms, sample_rate = load_audio(audio_path, offset=window.start, duration=window.duration, profile=profile)
+        seconds_per_frame = profile.dynamics_hop_length / sample_rate
+        first = round((window.onset - window.start) / seconds_per_frame)
+        rms = rms[first:round((window.release - window.start) / seconds_per_frame) + 1]
+        offset = window.start + first * seconds_per_frame
+    if mode != "frame":
+        return analyze_spans_levels(rms, timeline, tolerances_db, mode, seconds_per_frame, offset)
     
-    expected_rms, time_points = rms_note_by_note(score, dynamics_list, tempo_list, sample_rate)
+    expected_rms, time_points = timeline.expected_rms(sample_rate, dynamic_to_rms["rest"])
     
-    feedback = analyze_performance(rms, expected_rms, time_points)
-    return feedback
+    return analyze_performance_levels(rms, expected_rms, time_points, tolerances_db, seconds_per_frame=seconds_per_frame, offset=offset)
 
 # def main():
 #     base = Path(__file__).parent
@@ -0,0 +1,32 @@
+import numpy as np
+from ..feedback import DynamicsSpan, analyze_spans_levels, dynamic_to_rms
+from ...analysis.timeline import ScoreTimeline, to_ratios
+
+def four_notes_p_then_f() -> ScoreTimeline:
+    """Four quarter notes at 60 bpm, p for the first two and f for the last two"""
+    return ScoreTimeline(
+        note_lengths=to_ratios([1, 1, 1, 1]), note_frequencies=np.full(4, 440.0),
+        tempo_beats=to_ratios([0]), tempo_bpm=np.array([60.0]),
+        dynamic_beats=to_ratios([0, 2]), dynamic_db=np.array([dynamic_to_rms["p"], dynamic_to_rms["f"]], dtype=np.float64),
+    )
+
+def test_marking_spans():
+    # 10 frames per second, played at p (-30 dB) and then much too loud (0 dB instead of -10 dB)
+    rms = np.concatenate([np.full(20, 10 ** (-30 / 20)), np.ones(20)])
+    strict, lenient = analyze_spans_levels(rms, four_notes_p_then_f(), [5, 15], "marking", seconds_per_frame=0.1, offset=1.0)
+    assert len(lenient) == 0
+    assert len(strict) == 1
+    span = strict[0]
+    assert isinstance(span, DynamicsSpan)
+    assert (span.time, span.end, span.expectedDB) == (3.0, 5.0, -10.0)
+    assert np.isclose(span.actualDB, 0.0) and np.isclose(span.peakDB, 0.0)
+
+def test_note_spans_skip_rests():
+    timeline = four_notes_p_then_f()
+    timeline.note_frequencies[3] = np.nan
+    rms = np.full(40, 10 ** (-30 / 20))
+    rms[0] = 1.0  # loud attack on the first note only
+    (feedback,) = analyze_spans_levels(rms, timeline, [5], "note", seconds_per_frame=0.1)
+    # the first note averages well above p, the f notes are too quiet, the rest isn't judged
+    assert feedback["time"].tolist() == [0.0, 2.0]
+    assert feedback["expectedDB"].tolist() == [-30.0, -10.0]
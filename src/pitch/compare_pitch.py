@@ -1,7 +1,9 @@
-import librosa, math
+import librosa, math, numpy as np
 REST_PITCH: float = float('nan') # pitch used to represent rest. A rest doesn't have a pitch, so it is set to impossible value nan
+DELTA_COEFF: float = .5 # what percent you must be close to the note above or below to be considered similar
+WINDOW_CHUNK: int = 4096 # frames per chunk in window_deviation, bounds its memory use for long recordings
 
-def similar(a_freq: float, b_freq: float):
+def similar(a_freq: float, b_freq: float, delta_coeff: float = DELTA_COEFF):
     #if one is resting but not the other, then not similar
     if math.isnan(a_freq) != math.isnan(b_freq):
         return False
@@ -15,28 +17,62 @@ def similar(a_freq: float, b_freq: float):
         a_bef_f: float = librosa.midi_to_hz(round(librosa.hz_to_midi(a_freq) - 1))
         a_next_f: float = librosa.midi_to_hz(round(librosa.hz_to_midi(a_freq) + 1))
 
-        delta_coeff = .5 # what percent you must be close to the note above or below to be considered similar 
         lower_bound: float = a_freq - ((a_freq - a_bef_f) * delta_coeff)
         upper_bound: float = a_freq + ((a_next_f - a_freq) * delta_coeff)
 
         return lower_bound <= b_freq <= upper_bound
 
-# compares the sample frequencies of user and expected, returns the number of times they significantly differ (for now, at least)
-def accuracy_check(user, expected: list[float], right_note_hop_window: int, voiced_flag, sr: int, hop_length: int) -> list[int]:
+def semitone_gaps(user: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Distance in Hz from each pitch down to the semitone below and up to the semitone above it, as similar() defines them"""
+    with np.errstate(invalid="ignore"):
+        midi = librosa.hz_to_midi(user)
+        return user - librosa.midi_to_hz(np.round(midi - 1)), librosa.midi_to_hz(np.round(midi + 1)) - user
 
-    # if the user's is 95% or shorter than the original length, the user didn't record until the end
-    # if len(user) < .95 * len(expected): 
-    #     print("user's is 95% or shorter than the original length, the user didn't record until the end")
-    #     return (int(.95 * (len(expected) - len(user))))
-    
-    ret = [] # for now just how many times the pitches significantly differ
-    n: int = min(len(user), len(expected))
+def deviation_from(user: np.ndarray, below: np.ndarray, above: np.ndarray, expected: np.ndarray) -> np.ndarray:
+    """
+    Vectorized similar(): how far expected is from user, as a fraction of the gap from user to its neighbouring semitone
+    in that direction. similar(a, b, delta_coeff) is deviation <= delta_coeff. 0 if both are rests, inf if only one is
+    """
+    with np.errstate(invalid="ignore", divide="ignore"):
+        deviation = np.where(expected < user, (user - expected) / below, (expected - user) / above)
+    user_rest, expected_rest = np.isnan(user), np.isnan(expected)
+    return np.where(user_rest | expected_rest, np.where(user_rest & expected_rest, 0.0, np.inf), deviation)
+
+def expected_at(expected: np.ndarray, frames: np.ndarray, lead_in: int = 0) -> np.ndarray:
+    """expected[frames - lead_in], a rest for the frames before the lead in"""
+    i = frames - lead_in
+    if len(expected) == 0:
+        return np.full(len(i), REST_PITCH)
+    return np.where(i >= 0, expected[np.clip(i, 0, len(expected) - 1)], REST_PITCH)
 
-    for i in range(n):
-        if not voiced_flag[i]: # if the recording is not voiced
-            user[i] = math.nan
-        if not similar(user[i], expected[i]):
-            if not any(similar(user[j], expected[i]) for j in range(max(i - right_note_hop_window, 0), min(i + right_note_hop_window + 1, n))):
-                ret.append(i)
+def window_deviation(user: np.ndarray, expected: np.ndarray, hop_windows: list[int], lead_in: int = 0) -> np.ndarray:
+    """
+    (frames, len(hop_windows)) array: [i, k] is the smallest deviation of the expected pitch of frame i from any user pitch within hop_windows[k] hops of i.
+    Frame i expects expected[i - lead_in], a rest before that, so a score that starts later isn't copied to pad it.
+    The pitch deviations are computed once for the widest window, every narrower one is a running minimum over them
+    """
+    n = max(min(len(user), lead_in + len(expected)), 0)
+    user, expected = np.asarray(user[:n], dtype=np.float64), np.asarray(expected, dtype=np.float64)
+    below, above = semitone_gaps(user)
+    widest = max(hop_windows, default=0)
+    offsets = np.arange(-widest, widest + 1)
 
-    return ret
\ No newline at end of file
+    result = np.empty((n, len(hop_windows)))
+    for start in range(0, n, WINDOW_CHUNK):
+        i = np.arange(start, min(start + WINDOW_CHUNK, n))
+        j = i[:, None] + offsets[None, :]
+        valid = (j >= 0) & (j < n)
+        j = np.clip(j, 0, max(n - 1, 0))
+        deviation = np.where(valid, deviation_from(user[j], below[j], above[j], expected_at(expected, i, lead_in)[:, None]), np.inf)
+        # smallest deviation within r hops, for every r up to widest
+        within = np.minimum.accumulate(np.minimum(deviation[:, widest::-1], deviation[:, widest:]), axis=1)
+        result[i] = within[:, hop_windows]
+    return result
+
+# compares the sample frequencies of user and expected, returns the indices where they significantly differ (for now, at least)
+def accuracy_check(user, expected: list[float], right_note_hop_window: int, voiced_flag, sr: int, hop_length: int, delta_coeff: float = DELTA_COEFF) -> list[int]:
+    """Frames where neither the user's pitch nor any within right_note_hop_window hops is similar to the expected one. Unvoiced frames count as rests"""
+    n: int = min(len(user), len(expected))
+    user = np.where(np.asarray(voiced_flag[:n], dtype=bool), np.asarray(user[:n], dtype=np.float64), math.nan)
+    deviation = window_deviation(user, np.asarray(expected[:n], dtype=np.float64), [right_note_hop_window])[:, 0]
+    return np.flatnonzero(deviation > delta_coeff).tolist()
@@ -1,7 +1,12 @@
 import librosa, music21, math, numpy as np
 from music21 import converter, tempo
-from .compare_pitch import accuracy_check
+from .compare_pitch import expected_at, window_deviation, DELTA_COEFF
+from ..analysis.profiles import DEFAULT_PROFILE, AnalysisProfile, Recording, audio_sample_rate, load_span
+from ..analysis.results import MismatchTable
+from ..analysis.timeline import ScoreTimeline
+from ..analysis.window import AnalysisWindow
 from typing import Final
+from dataclasses import dataclass
 
 DEFAULT_TEMPO: Final[int] = 120
 """default tempo for a score if no tempo is specified"""
@@ -15,17 +20,18 @@ HOP_LENGTH: Final[int] = 512
 RIGHT_NOTE_WINDOW: Final[float] = 1
 """window for the user to play the right note in seconds"""
 
+@dataclass(slots=True)
 class PitchMismatch:
     time: float
     expected_pitch: float
     actual_pitch: float
 
-def load_audio(audio_path: str) -> tuple[np.ndarray, int]:
-    """Load audio file and it's sample rate"""
+def load_audio(audio_path: str, offset: float = 0.0, duration: float | None = None) -> tuple[np.ndarray, int]:
+    """Load audio file and it's sample rate, optionally only duration seconds starting at offset"""
     """Returns time-series data and sample_rate of audio file"""
     y: np.ndarray
     sample_rate: int
-    y, sample_rate = librosa.load(audio_path, sr=None)
+    y, sample_rate = librosa.load(audio_path, sr=None, offset=offset, duration=duration)
     return y, sample_rate
 
 def get_tempos(score: music21.stream.Score) -> list[tuple[float, int]]:
@@ -41,122 +47,95 @@ def get_tempos(score: music21.stream.Score) -> list[tuple[float, int]]:
     return tempos
 
 def find_expected_pitches(score: music21.stream.Score, tempos_list: list[tuple[float, str]], sample_rate: int, hop_length: int) -> list[float]:
-    def extend_pitches(start: float, end: float, pitch: float, tempo: float):
-        duration: float = end - start
-        samples: int = int((duration / tempo * 60) * sample_rate / hop_length)
-        expected_pitches.extend([pitch] * samples)
+    """Expected pitch per hop of the first part of the score, REST_PITCH for rests"""
+    return ScoreTimeline.from_score(score, tempos_list).expected_pitches(sample_rate, hop_length)
 
-    expected_pitches: list[float] = []
-    note_ptr, tempo_ptr = 0, 0
-    cur_beat = 0.0
+PitchLevel = tuple[float, float]
+"""a pitch tolerance: (delta_coeff, right_note_window in seconds), see compare_pitch.similar and RIGHT_NOTE_WINDOW"""
 
-    # only consider the first part in the score, for now at least
-    notes_and_rests = list(score.parts[0].recurse().notesAndRests)
+DEFAULT_PITCH_LEVEL: Final[PitchLevel] = (DELTA_COEFF, RIGHT_NOTE_WINDOW)
 
-    while note_ptr < len(notes_and_rests):
-        note = notes_and_rests[note_ptr]
-
-        note_length: float = note.duration.quarterLength
-        next_note_change: float = cur_beat + note_length
-        next_tempo_change: float = tempos_list[tempo_ptr + 1][0] if tempo_ptr < len(tempos_list) - 1 else float('inf')
-
-        cur_tempo: int = tempos_list[tempo_ptr][1]
-        cur_pitch: float = note.pitch.frequency if note.isNote else REST_PITCH # NOTE: IF IT'S A REST FREQUENCY IS SET TO nan
-
-        extend_pitches(start=cur_beat, end=next_note_change, pitch=cur_pitch, tempo=cur_tempo)
-        cur_beat = next_note_change # I belive the only case to watch is when note changes, as tempo only changes on note changes as well (at least in MuseScore)
-
-        # increment next tempo if the tempo change occurs at next note
-        if next_tempo_change == next_note_change:
-            tempo_ptr += 1
-        # always increment to next note
-        note_ptr += 1
-    
-    return expected_pitches
-
-def find_hop_window(sample_rate: int):
+def find_hop_window(sample_rate: int, hop_length: int = HOP_LENGTH, right_note_window: float = RIGHT_NOTE_WINDOW):
     """given any some sample rate, returns the number of hops that the user must play within to be considered "correct\""""
-    seconds_per_hop = HOP_LENGTH / sample_rate
-    return math.ceil(RIGHT_NOTE_WINDOW / seconds_per_hop)
-
-def use_pyin():
-    audio_path = ".\\test_files\\test2.wav"
-    sheet_music_path = ".\\test_files\\test2.mxl"
-
-    test_piano_path = ".\\test_files\\775495__tian_yueyao__piano-76.wav"
-
-    score = converter.parse(sheet_music_path)
-    print(f"score is ", score)
-
-    y, sample_rate = load_audio(test_piano_path)
-
-    f0: np.ndarray
-    voiced_flag: np.ndarray 
-    voiced_prob: np.ndarray 
-
-    f0, voiced_flag, voiced_probs = librosa.pyin(y, fmin=librosa.note_to_hz('C2'), fmax=librosa.note_to_hz('C7'))
-    
-    for i in range(0, len(f0), 4):
-        # if voiced_flag[i]:
-        print(f"This is the f0 here: {f0[i]}")
-        print(f"This is the voiced_flag here: {voiced_flag[i]}")
-        print(f"This is the voiced_probs here: {voiced_probs[i]}")
-
-def printNotesInScore():
-    audio_path = ".\\test_files\\test2.wav"
-    sheet_music_path = ".\\test_files\\test2.mxl"
+    seconds_per_hop = hop_length / sample_rate
+    return math.ceil(right_note_window / seconds_per_hop)
 
+def pitch_check(audio_path: str, sheet_music_path: str) -> MismatchTable:
+    """Given a path to the audio and sheet music, returns the times where the wrong pitch was played"""
     score = converter.parse(sheet_music_path)
-    for note in score.flatten().notesAndRests:
-        if note.isNote:
-            freq = note.pitch.frequency
-            print(f"Note: {note.nameWithOctave}, Frequency: {freq} Hz")
-        else:
-            print(f"Rest, Frequency: {REST_PITCH} Hz")
-        # print(note)
-    
-# integrate generating the exepcted pitches and comparing the audio to the expected pitches
-def integration(): 
-    audio_path = ".\\test_files\\test2.wav"         # USER'S recording as wav file
-    y_sample_rate: tuple[np.ndarray, int] = load_audio(audio_path)         # get user recording's sample values and sample rate
-
-    sheet_music_path = ".\\test_files\\test2.mxl"   # sheet music mxl
-    score = converter.parse(sheet_music_path)  
-    tempos_list: list[tuple[float, int]] = get_tempos(score)
-    expected_pitches: list[float] = find_expected_pitches(score=score, tempos_list=tempos_list, sample_rate=y_sample_rate[1], hop_length=HOP_LENGTH)
-    f0: np.ndarray = librosa.pyin(y_sample_rate[0], fmin=librosa.note_to_hz('C2'), fmax=librosa.note_to_hz('C7'), sr=y_sample_rate[1], hop_length=HOP_LENGTH)
-    right_note_hop_window = find_hop_window(y_sample_rate[1])
-
-    # print(f"the size of f0[0] or the frequencies estimated is {len(f0[0])}")
-    # print(f"the size of expected_pitches is {len(expected_pitches)}")
-    
-    print(accuracy_check(f0[0], expected_pitches, right_note_hop_window))
-
-def pitch_check(audio_path: str, sheet_music_path: str) -> list[PitchMismatch]:
-    """Given a path to the audio and sheet music, prints the number of times there's an error in playing"""
-
-    y_sample_rate: tuple[np.ndarray, int] = load_audio(audio_path)         # get user recording's sample values and sample rate
-    
-    score = converter.parse(sheet_music_path)  
-    tempos_list: list[tuple[float, int]] = get_tempos(score)
-    expected_pitches: list[float] = find_expected_pitches(score=score, tempos_list=tempos_list, sample_rate=y_sample_rate[1], hop_length=HOP_LENGTH)
-    f0, voiced_flag, voiced_prob = librosa.pyin(y_sample_rate[0], fmin=librosa.note_to_hz('C2'), fmax=librosa.note_to_hz('C7'), sr=y_sample_rate[1], hop_length=HOP_LENGTH)
-    right_note_hop_window = find_hop_window(y_sample_rate[1])
-
-    # the indices of user recording (sampled at hop_length intervals) where the wrong note was played
-    wrong_i = accuracy_check(f0, expected_pitches, right_note_hop_window, voiced_flag, y_sample_rate[1], HOP_LENGTH)
-
-    ret: list[PitchMismatch] = []
-    for i in wrong_i:
-        actual_time = i * (HOP_LENGTH / y_sample_rate[1])
-        ret.append(PitchMismatch(time=actual_time, expected_pitch=expected_pitches[i], actual_pitch=f0[i]))
-    return ret
-
-def main():
-    audio_path = ".\\test_files\\test7.wav"
-    sheet_music_path = ".\\test_files\\test7.mxl"
-
-    pitch_check(audio_path=audio_path, sheet_music_path=sheet_music_path)
-            
-if __name__ == "__main__":
-    main()
\ No newline at end of file
+    return pitch_check_score(audio_path, score)
+
+def pitch_check_score(audio_path: str, score: music21.stream.Score, window: AnalysisWindow | None = None, profile: AnalysisProfile = DEFAULT_PROFILE) -> MismatchTable:
+    """Same as pitch_check, for an already parsed score"""
+    return pitch_check_timeline(audio_path, ScoreTimeline.from_score(score, get_tempos(score)), window=window, profile=profile)
+
+def pitch_check_timeline(audio_path: str | Recording, timeline: ScoreTimeline, window: AnalysisWindow | None = None,
+                         profile: AnalysisProfile = DEFAULT_PROFILE) -> MismatchTable:
+    """
+    Same as pitch_check, for a precompiled score.
+    If a window is given, only that region of the recording is pitch tracked, with the score aligned to the window's onset.
+    Mismatch times are seconds on the recording's timeline either way.
+    """
+    return pitch_check_levels(audio_path, timeline, [DEFAULT_PITCH_LEVEL], window=window, profile=profile)[0]
+
+def pitch_check_levels(audio_path: str | Recording, timeline: ScoreTimeline, levels: list[PitchLevel], window: AnalysisWindow | None = None,
+                       profile: AnalysisProfile = DEFAULT_PROFILE) -> list[MismatchTable]:
+    """
+    Same as pitch_check_timeline, with one MismatchTable per tolerance level, all from a single pitch tracking pass.
+    The audio is tracked at the profile's pitch sample rate, hop and frame length, from its path or an already decoded Recording
+    """
+    sample_rate: int = profile.pitch_sample_rate or audio_sample_rate(audio_path)
+    hop_length = profile.pitch_hop_length
+    expected_pitches, lead_in = expected_pitches_for_window(timeline, sample_rate, hop_length, window)
+    offset, duration = tracked_span(window, lead_in + len(expected_pitches), sample_rate, hop_length)
+
+    y_sample_rate: tuple[np.ndarray, int] = load_span(audio_path, profile.pitch_sample_rate, offset=offset, duration=duration)         # get user recording's sample values and sample rate
+    f0, voiced_flag = track_pitch(y_sample_rate[0], y_sample_rate[1], hop_length, profile.pitch_frame_length)
+    return find_mismatch_levels(f0, voiced_flag, expected_pitches, y_sample_rate[1], hop_length, levels, offset, lead_in)
+
+def expected_pitches_for_window(timeline: ScoreTimeline, sample_rate: int, hop_length: int, window: AnalysisWindow | None = None) -> tuple[np.ndarray, int]:
+    """
+    Expected pitch per hop of the score, and the hops from the window's start to its onset where the score starts.
+    Hop i of the window expects expected_pitches[i - lead_in], a rest before the onset. The (possibly mapped) array isn't copied
+    """
+    expected_pitches = np.asarray(timeline.expected_pitches(sample_rate, hop_length), dtype=np.float64)
+    if window is None:
+        return expected_pitches, 0
+    return expected_pitches, round((window.onset - window.start) * sample_rate / hop_length)
+
+def tracked_span(window: AnalysisWindow | None, expected_len: int, sample_rate: int, hop_length: int) -> tuple[float, float | None]:
+    """Offset and duration (in seconds) of the audio worth pitch tracking. None duration means until the end of the recording"""
+    if window is None:
+        return 0.0, None
+    # frames after the last expected pitch are never compared, so don't pitch track them
+    score_end = window.start + (expected_len + 1) * hop_length / sample_rate
+    return window.start, min(window.end, score_end) - window.start
+
+def track_pitch(y: np.ndarray, sample_rate: int, hop_length: int, frame_length: int = 2048) -> tuple[np.ndarray, np.ndarray]:
+    """Estimated fundamental frequency and voiced flag per hop, using pyin"""
+    f0, voiced_flag, voiced_prob = librosa.pyin(y, fmin=librosa.note_to_hz('C2'), fmax=librosa.note_to_hz('C7'), sr=sample_rate, frame_length=frame_length, hop_length=hop_length)
+    return f0, voiced_flag
+
+def find_mismatches(f0: np.ndarray, voiced_flag: np.ndarray, expected_pitches: list[float], sample_rate: int, hop_length: int, offset: float = 0.0) -> MismatchTable:
+    """Compares tracked pitches against the expected ones. offset is the recording time (in seconds) of the first hop"""
+    return find_mismatch_levels(f0, voiced_flag, expected_pitches, sample_rate, hop_length, [DEFAULT_PITCH_LEVEL], offset)[0]
+
+def find_mismatch_levels(f0: np.ndarray, voiced_flag: np.ndarray, expected_pitches: list[float], sample_rate: int, hop_length: int,
+                         levels: list[PitchLevel], offset: float = 0.0, lead_in: int = 0) -> list[MismatchTable]:
+    """
+    Same as find_mismatches, with one MismatchTable per tolerance level. The per-frame deviations are computed once,
+    each level only thresholds them. Frame i expects expected_pitches[i - lead_in], a rest before that
+    """
+    n = max(min(len(f0), lead_in + len(expected_pitches)), 0)
+    user = np.where(np.asarray(voiced_flag[:n], dtype=bool), np.asarray(f0[:n], dtype=np.float64), REST_PITCH)
+    expected = np.asarray(expected_pitches, dtype=np.float64)
+    hop_windows = [find_hop_window(sample_rate, hop_length, right_note_window) for _, right_note_window in levels]
+    deviation = window_deviation(user, expected, hop_windows, lead_in)
+
+    tables = []
+    for k, (delta_coeff, _) in enumerate(levels):
+        # the indices of user recording (sampled at hop_length intervals) where the wrong note was played
+        wrong_i = np.flatnonzero(deviation[:, k] > delta_coeff)
+        actual_times = offset + wrong_i * (hop_length / sample_rate)
+        tables.append(MismatchTable(PitchMismatch, actual_times, expected_at(expected, wrong_i, lead_in), user[wrong_i]))
+    return tables
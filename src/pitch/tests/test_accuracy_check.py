@@ -1,7 +1,32 @@
-from ..compare_pitch import accuracy_check
+import numpy as np
+from ..compare_pitch import accuracy_check, deviation_from, semitone_gaps, similar, window_deviation
 
 def test_accuracy_check():
     user = [440.00, 19.45, 43.65, 43.65]
     expected = [430.30, 19.45, 43.65, 43.65]  
     voiced_flag = [True] * len(user)
-    assert(accuracy_check(user=user, expected=expected, right_note_hop_window=4, voiced_flag=voiced_flag, sr=44100, hop_length=512) == [])
\ No newline at end of file
+    assert(accuracy_check(user=user, expected=expected, right_note_hop_window=4, voiced_flag=voiced_flag, sr=44100, hop_length=512) == [])
+
+def test_deviation_agrees_with_similar():
+    rng = np.random.default_rng(0)
+    user = 440 * 2 ** (rng.uniform(-24, 24, 500) / 12)
+    expected = user * 2 ** (rng.normal(0, 1, 500) / 12)
+    below, above = semitone_gaps(user)
+    deviation = deviation_from(user, below, above, expected)
+    for delta_coeff in [0.1, 0.5, 0.9]:
+        assert ((deviation <= delta_coeff) == [similar(a, b, delta_coeff) for a, b in zip(user, expected)]).all()
+
+def test_wider_window_forgives_late_notes():
+    user = [float('nan'), float('nan'), 440.0, 440.0]
+    expected = [440.0, 440.0, 440.0, 440.0]
+    deviation = window_deviation(user, expected, [0, 1, 2])
+    assert (deviation[:, 0] <= .5).tolist() == [False, False, True, True]
+    assert (deviation[:, 1] <= .5).tolist() == [False, True, True, True]
+    assert (deviation[:, 2] <= .5).tolist() == [True, True, True, True]
+
+def test_lead_in_expects_rests_before_the_score():
+    user = [float('nan'), float('nan'), 440.0, 440.0]
+    deviation = window_deviation(user, np.array([440.0, 440.0]), [0], lead_in=2)
+    assert deviation[:, 0].tolist() == window_deviation(user, [float('nan'), float('nan'), 440.0, 440.0], [0])[:, 0].tolist() == [0, 0, 0, 0]
+    # a score that starts before the tracked frames is indexed from the frame's own position in it
+    assert (window_deviation(user, np.array([1.0, float('nan'), float('nan'), 440.0, 440.0]), [0], lead_in=-1)[:, 0] == 0).all()